@@ -1,18 +1,89 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 from app.core.config import settings
+from app.core.profiling import install_query_profiler
 
-# SQLite固有の設定: check_same_threadをFalseにして、マルチスレッドでの動作を許可
-connect_args = {"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {}
+IS_SQLITE = settings.DATABASE_URL.startswith("sqlite")
+IS_PRODUCTION = settings.DB_PROFILE == "production"
 
-engine = create_engine(
-    settings.DATABASE_URL, 
-    connect_args=connect_args,
-    # pool_pre_ping=True は、接続が切れている場合に自動で再接続を試みる設定
-    pool_pre_ping=True
-)
+def _engine_options() -> dict:
+    """DB種別とプロファイルに応じた create_engine の引数"""
+    if IS_SQLITE:
+        # SQLite固有の設定: check_same_threadをFalseにして、マルチスレッドでの動作を許可
+        options = {"connect_args": {"check_same_thread": False}}
+        if IS_PRODUCTION:
+            # ローカルファイルなので切断検知 (pre_ping) は不要。
+            # 接続数は上限付きのプールで管理し、ロック待ちは busy_timeout に任せる
+            options["connect_args"]["timeout"] = settings.SQLITE_BUSY_TIMEOUT_MS / 1000
+            options["pool_size"] = settings.DB_POOL_SIZE
+            options["max_overflow"] = settings.DB_MAX_OVERFLOW
+            options["pool_timeout"] = settings.DB_POOL_TIMEOUT
+            options["pool_pre_ping"] = False
+        else:
+            # pool_pre_ping=True は、接続が切れている場合に自動で再接続を試みる設定
+            options["pool_pre_ping"] = True
+        return options
+
+    # PostgreSQL など (サーバー型DB)
+    options = {"pool_pre_ping": settings.DB_POOL_PRE_PING}
+    if IS_PRODUCTION:
+        options["pool_size"] = settings.DB_POOL_SIZE
+        options["max_overflow"] = settings.DB_MAX_OVERFLOW
+        options["pool_timeout"] = settings.DB_POOL_TIMEOUT
+        options["pool_recycle"] = settings.DB_POOL_RECYCLE
+    return options
+
+def _async_database_url() -> str:
+    """同期用URLから非同期ドライバ用のURLを導出する (ASYNC_DATABASE_URL で上書き可)"""
+    if settings.ASYNC_DATABASE_URL:
+        return settings.ASYNC_DATABASE_URL
+    url = settings.DATABASE_URL
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("postgresql"):
+        _, rest = url.split("://", 1)
+        return f"postgresql+asyncpg://{rest}"
+    return url
+
+engine = create_engine(settings.DATABASE_URL, **_engine_options())
+
+# 非同期エンドポイント用のエンジン (接続プール・PRAGMA は同期側と同じ設定)
+async_engine = create_async_engine(_async_database_url(), **_engine_options())
+
+def _register_sqlite_pragmas(target: Engine) -> None:
+    @event.listens_for(target, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """
+        接続ごとに PRAGMA を設定する。
+        WAL モードでは読み込みが書き込み (ハートビート更新など) にブロックされない。
+        """
+        cursor = dbapi_connection.cursor()
+        # ON DELETE CASCADE / SET NULL を有効にする (SQLiteはデフォルト無効)
+        cursor.execute("PRAGMA foreign_keys=ON")
+        if IS_PRODUCTION:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+            # 負の値は KiB 単位の指定
+            cursor.execute(f"PRAGMA cache_size=-{settings.SQLITE_CACHE_SIZE_KB}")
+            cursor.execute(f"PRAGMA mmap_size={settings.SQLITE_MMAP_SIZE}")
+            cursor.execute(f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+if IS_SQLITE:
+    _register_sqlite_pragmas(engine)
+    _register_sqlite_pragmas(async_engine.sync_engine)
+
+# クエリ数・DB時間の集計と遅いクエリの記録 (どちらも無効なら計測しない)
+if settings.SQL_PROFILE or settings.SQL_PROFILE_HEADERS or settings.SQL_SLOW_QUERY_MS > 0:
+    install_query_profiler(engine)
+    install_query_profiler(async_engine.sync_engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# commit 後も属性を参照できるように expire_on_commit=False (非同期では遅延ロードができないため)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
@@ -23,4 +94,10 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# 非同期版: async def のエンドポイントで db: AsyncSession = Depends(get_async_db) として使用します
+# (イベントループをブロックせず、スレッドプールも消費しない)
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
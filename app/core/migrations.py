@@ -0,0 +1,281 @@
+"""
+バージョン管理付きのスキーマ移行 (マイグレーション)
+
+適用済みのバージョンは schema_migrations テーブルに記録され、
+未適用のものだけが番号順に実行されます。既存の運用中DBにも安全に適用できるよう、
+各マイグレーションは「すでに適用済みの状態」でも何もしないように書いてください。
+
+    python scripts/migrate.py          # 未適用分を適用
+    python scripts/migrate.py --status # 適用状況の表示
+"""
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateTable
+
+from app.core.database import Base
+
+# モデル定義を Base.metadata に登録するため
+from app.models import models  # noqa: F401
+
+_version_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    _version_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String),
+    Column("applied_at", DateTime),
+)
+
+
+# --- ヘルパー ---
+
+def _column_names(conn: Connection, table_name: str) -> set:
+    return {c["name"] for c in inspect(conn).get_columns(table_name)}
+
+def _index_names(conn: Connection, table_name: str) -> set:
+    return {i["name"] for i in inspect(conn).get_indexes(table_name)}
+
+def add_column_if_missing(conn: Connection, table_name: str, column_name: str) -> None:
+    """モデル定義に従って列を追加する (存在する場合は何もしない)"""
+    if column_name in _column_names(conn, table_name):
+        return
+    column = Base.metadata.tables[table_name].c[column_name]
+    col_type = column.type.compile(dialect=conn.dialect)
+    ddl = f"ALTER TABLE {table_name} ADD COLUMN {column_name} {col_type}"
+    if column.default is not None and column.default.is_scalar:
+        ddl += f" DEFAULT {column.default.arg!r}"
+    conn.execute(text(ddl))
+
+def create_indexes_if_missing(conn: Connection, table_name: str) -> None:
+    """
+    モデル定義にあるインデックスのうち、未作成のものを作成する
+    (まだ追加されていない列のインデックスは、その列を追加するマイグレーションで作成する)
+    """
+    existing = _index_names(conn, table_name)
+    columns = _column_names(conn, table_name)
+    for index in Base.metadata.tables[table_name].indexes:
+        if index.name not in existing and all(c.name in columns for c in index.columns):
+            index.create(conn)
+
+def _fk_ondelete_matches(conn: Connection, table_name: str) -> bool:
+    """DB上の外部キーの ON DELETE がモデル定義と一致しているか"""
+    expected = {
+        (fk.parent.name, (fk.ondelete or "").upper())
+        for fk in Base.metadata.tables[table_name].foreign_keys
+    }
+    actual = {
+        (fk["constrained_columns"][0], (fk.get("options", {}).get("ondelete") or "").upper())
+        for fk in inspect(conn).get_foreign_keys(table_name)
+    }
+    return expected == actual
+
+def rebuild_foreign_keys(conn: Connection, table_name: str) -> None:
+    """
+    外部キー制約 (ON DELETE) をモデル定義に合わせる。
+
+    SQLite は制約の変更ができないため、公式手順どおりテーブルを作り直す
+    (新テーブル作成 → データコピー → 旧テーブル削除 → リネーム → インデックス再作成)。
+    """
+    if _fk_ondelete_matches(conn, table_name):
+        return
+
+    table = Base.metadata.tables[table_name]
+
+    if conn.dialect.name != "sqlite":
+        for fk in inspect(conn).get_foreign_keys(table_name):
+            conn.execute(text(f'ALTER TABLE {table_name} DROP CONSTRAINT "{fk["name"]}"'))
+        for fk in table.foreign_keys:
+            ondelete = f" ON DELETE {fk.ondelete}" if fk.ondelete else ""
+            conn.execute(text(
+                f"ALTER TABLE {table_name} ADD CONSTRAINT fk_{table_name}_{fk.parent.name} "
+                f"FOREIGN KEY ({fk.parent.name}) REFERENCES {fk.column.table.name} ({fk.column.name}){ondelete}"
+            ))
+        return
+
+    tmp_name = f"_new_{table_name}"
+    create_sql = str(CreateTable(table).compile(dialect=conn.dialect))
+    create_sql = create_sql.replace(f"CREATE TABLE {table_name} ", f"CREATE TABLE {tmp_name} ", 1)
+    conn.execute(text(create_sql))
+
+    columns = ", ".join(c for c in table.columns.keys() if c in _column_names(conn, table_name))
+    conn.execute(text(f"INSERT INTO {tmp_name} ({columns}) SELECT {columns} FROM {table_name}"))
+    conn.execute(text(f"DROP TABLE {table_name}"))
+    conn.execute(text(f"ALTER TABLE {tmp_name} RENAME TO {table_name}"))
+    for index in table.indexes:
+        index.create(conn)
+
+
+# --- マイグレーション定義 (追加するときは末尾に追記する) ---
+
+def _0001_baseline(conn: Connection) -> None:
+    """未作成のテーブルを作成 (従来の init_db と同等)"""
+    Base.metadata.create_all(bind=conn)
+
+def _0002_playlist_columns(conn: Connection) -> None:
+    """プレイリスト用の列 (contents.position / duration)"""
+    add_column_if_missing(conn, "contents", "position")
+    add_column_if_missing(conn, "contents", "duration")
+    conn.execute(text("UPDATE contents SET position = 0 WHERE position IS NULL"))
+    conn.execute(text("UPDATE contents SET duration = 10 WHERE duration IS NULL"))
+
+def _0003_lookup_indexes(conn: Connection) -> None:
+    """表示設定・ダッシュボード・ポータルログインで絞り込む列のインデックス"""
+    for table_name in ("slots", "contents", "ads", "invitation_tokens"):
+        create_indexes_if_missing(conn, table_name)
+
+def _0004_foreign_key_cascades(conn: Connection) -> None:
+    """
+    学校・スロット削除時に子レコードを DB 側で削除/NULL化する
+    (テーブルを作り直すため、外部キー制約を無効にして実行する: FOREIGN_KEYS_OFF)
+    """
+    for table_name in ("users", "slots", "contents", "ads", "invitation_tokens"):
+        rebuild_foreign_keys(conn, table_name)
+
+def _0005_user_school_index(conn: Connection) -> None:
+    """ユーザー一覧の学校絞り込み用"""
+    create_indexes_if_missing(conn, "users")
+
+def _0006_heartbeat_history(conn: Connection) -> None:
+    """稼働履歴テーブル。最終通信が記録済みの学校は、その時刻から継続中の区間として開始する"""
+    for table_name in ("heartbeat_intervals", "heartbeat_daily"):
+        Base.metadata.tables[table_name].create(conn, checkfirst=True)
+    conn.execute(text(
+        "INSERT INTO heartbeat_intervals (school_id, started_at) "
+        "SELECT id, last_heartbeat FROM schools WHERE last_heartbeat IS NOT NULL "
+        "AND id NOT IN (SELECT school_id FROM heartbeat_intervals)"
+    ))
+
+def _0007_school_district(conn: Connection) -> None:
+    """学校の地区 (緊急連絡の配信範囲)"""
+    add_column_if_missing(conn, "schools", "district")
+    create_indexes_if_missing(conn, "schools")
+
+def _0008_scheduler_leases(conn: Connection) -> None:
+    """定期ジョブのリース (実行するワーカーの選出用)"""
+    Base.metadata.tables["scheduler_leases"].create(conn, checkfirst=True)
+
+def _0009_ad_derivatives(conn: Connection) -> None:
+    """広告画像の処理結果 (元画像・サムネイル・エラー)"""
+    for column_name in ("original_url", "thumbnail_url", "processing_error"):
+        add_column_if_missing(conn, "ads", column_name)
+
+def _0010_compact_styles(conn: Connection) -> None:
+    """
+    スタイル設定から要素配置を layout_config に分け、
+    未知の項目・空の値・不正な値を取り除く (すでに正規化済みの行は書き換えない)
+    """
+    from app.services.content_style import split_legacy_style
+
+    add_column_if_missing(conn, "contents", "layout_config")
+    contents = Base.metadata.tables["contents"]
+    rows = conn.execute(
+        contents.select().with_only_columns(contents.c.id, contents.c.style_config, contents.c.layout_config)
+    ).all()
+    for row in rows:
+        style, layout = split_legacy_style(row.style_config)
+        layout = layout or row.layout_config
+        if style != (row.style_config or {}) or layout != row.layout_config:
+            conn.execute(contents.update().where(contents.c.id == row.id).values(style_config=style, layout_config=layout))
+
+def _0011_school_config_revision(conn: Connection) -> None:
+    """表示設定のリビジョン (ワーカー間で共有するため DB に持つ)"""
+    add_column_if_missing(conn, "schools", "config_revision")
+
+def _0012_emergency_alerts(conn: Connection) -> None:
+    """緊急連絡と配信状況 (ワーカー間で共有し、再起動後も解除されていない連絡を残すため DB に持つ)"""
+    for table_name in ("emergency_alerts", "emergency_deliveries"):
+        Base.metadata.tables[table_name].create(conn, checkfirst=True)
+
+def _0013_created_at(conn: Connection) -> None:
+    """広告・ユーザーの登録日時 (一覧の期間絞り込み用。既存の行は NULL のまま)"""
+    for table_name in ("ads", "users"):
+        add_column_if_missing(conn, table_name, "created_at")
+        create_indexes_if_missing(conn, table_name)
+
+def _0014_open_heartbeat_interval_unique(conn: Connection) -> None:
+    """
+    継続中の稼働区間を学校ごとに1行に制限する。
+    すでに重複している場合は最後に開いた区間を残し、他は開始時刻で閉じる (残す区間と期間が重なるため)
+    """
+    conn.execute(text(
+        "UPDATE heartbeat_intervals SET ended_at = started_at "
+        "WHERE ended_at IS NULL AND id NOT IN "
+        "(SELECT MAX(id) FROM heartbeat_intervals WHERE ended_at IS NULL GROUP BY school_id)"
+    ))
+    create_indexes_if_missing(conn, "heartbeat_intervals")
+
+def _0015_worker_presence(conn: Connection) -> None:
+    """WebSocket の接続状況 (ワーカー間で共有するため DB に持つ)"""
+    Base.metadata.tables["worker_presence"].create(conn, checkfirst=True)
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "baseline", _0001_baseline),
+    (2, "playlist columns", _0002_playlist_columns),
+    (3, "lookup indexes", _0003_lookup_indexes),
+    (4, "foreign key cascades", _0004_foreign_key_cascades),
+    (5, "user school index", _0005_user_school_index),
+    (6, "heartbeat history", _0006_heartbeat_history),
+    (7, "school district", _0007_school_district),
+    (8, "scheduler leases", _0008_scheduler_leases),
+    (9, "ad derivatives", _0009_ad_derivatives),
+    (10, "compact content styles", _0010_compact_styles),
+    (11, "school config revision", _0011_school_config_revision),
+    (12, "emergency alerts", _0012_emergency_alerts),
+    (13, "created at", _0013_created_at),
+    (14, "open heartbeat interval unique", _0014_open_heartbeat_interval_unique),
+    (15, "worker presence", _0015_worker_presence),
+]
+
+# SQLite で外部キー制約を無効にして実行するマイグレーション (参照されているテーブルを作り直すもの)
+FOREIGN_KEYS_OFF = {4}
+
+
+# --- 実行 ---
+
+def applied_versions(engine: Engine) -> set:
+    _version_metadata.create_all(bind=engine)
+    with engine.connect() as conn:
+        return {row.version for row in conn.execute(schema_migrations.select())}
+
+def _set_foreign_keys(conn: Connection, enabled: bool) -> None:
+    """
+    SQLite の外部キー制約の有効/無効を切り替える。
+    PRAGMA foreign_keys はトランザクション内では無視されるため、トランザクションの外で実行する
+    """
+    conn.execute(text(f"PRAGMA foreign_keys={'ON' if enabled else 'OFF'}"))
+    conn.commit()
+
+def _check_foreign_keys(conn: Connection) -> None:
+    """制約を無効にしている間に壊れた参照がないか確認する (あればトランザクションごと取り消す)"""
+    violations = conn.execute(text("PRAGMA foreign_key_check")).all()
+    if violations:
+        raise RuntimeError(f"foreign key check failed: {violations[:10]}")
+
+def run_migrations(engine: Engine) -> List[int]:
+    """未適用のマイグレーションを順に適用し、適用したバージョンの一覧を返す"""
+    done = applied_versions(engine)
+    newly_applied = []
+    for version, description, migrate in MIGRATIONS:
+        if version in done:
+            continue
+        with engine.connect() as conn:
+            foreign_keys_off = version in FOREIGN_KEYS_OFF and conn.dialect.name == "sqlite"
+            if foreign_keys_off:
+                _set_foreign_keys(conn, False)
+            try:
+                # 1マイグレーション = 1トランザクション (途中で失敗したら記録されない)
+                with conn.begin():
+                    migrate(conn)
+                    if foreign_keys_off:
+                        _check_foreign_keys(conn)
+                    conn.execute(schema_migrations.insert().values(
+                        version=version, description=description, applied_at=datetime.now()
+                    ))
+            finally:
+                if foreign_keys_off:
+                    _set_foreign_keys(conn, True)
+        newly_applied.append(version)
+    return newly_applied
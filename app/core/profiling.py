@@ -0,0 +1,126 @@
+"""
+リクエスト単位の SQL プロファイリング
+
+SQL_PROFILE=true のとき、リクエストごとに発行したクエリ数と DB 時間を集計してログに出す
+(SQL_PROFILE_HEADERS=true ならレスポンスヘッダーにも付ける)。
+SQL_SLOW_QUERY_MS を超えたクエリは、SQL文と発行元のルートをログに出す。
+"""
+import logging
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.core.config import settings
+
+logger = logging.getLogger("app.sql")
+slow_logger = logging.getLogger("app.sql.slow")
+
+# ログに出す SQL 文の最大文字数
+STATEMENT_MAX_LENGTH = 1000
+
+
+@dataclass
+class QueryStats:
+    scope: Optional[dict] = None
+    count: int = 0
+    seconds: float = 0.0
+    slow: int = 0
+    started_at: float = field(default_factory=time.perf_counter)
+
+    @property
+    def route(self) -> str:
+        if self.scope is None:
+            return "-"
+        # ルーティング後はルートのパス (/super_admin/schools/{school_id} など)
+        return getattr(self.scope.get("route"), "path", None) or self.scope.get("path", "-")
+
+    @property
+    def milliseconds(self) -> float:
+        return round(self.seconds * 1000, 1)
+
+
+# 現在のリクエストの集計 (リクエスト外のバックグラウンド処理では None)。
+# 同期エンドポイントのスレッドや AsyncSession の greenlet にもコンテキストごと引き継がれる
+current_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def install_query_profiler(target: Engine) -> None:
+    """エンジンにクエリ計測用のイベントを登録する"""
+
+    @event.listens_for(target, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+    @event.listens_for(target, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started_at"].pop()
+        _record(statement, elapsed)
+
+    @event.listens_for(target, "handle_error")
+    def _error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_started_at"):
+            conn.info["query_started_at"].pop()
+
+
+def _record(statement: str, elapsed: float) -> None:
+    stats = current_stats.get()
+    is_slow = settings.SQL_SLOW_QUERY_MS > 0 and elapsed * 1000 >= settings.SQL_SLOW_QUERY_MS
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += elapsed
+        stats.slow += is_slow
+    if is_slow:
+        slow_logger.warning(
+            "slow query %.1fms route=%s: %s",
+            elapsed * 1000, stats.route if stats else "-", " ".join(statement.split())[:STATEMENT_MAX_LENGTH],
+        )
+
+
+class QueryProfileMiddleware:
+    """リクエストごとのクエリ数・DB時間を集計する ASGI ミドルウェア (WebSocket は対象外)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats(scope=scope)
+        token = current_stats.set(stats)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if settings.SQL_PROFILE_HEADERS:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-db-query-count", str(stats.count).encode()))
+                    headers.append((b"x-db-query-time-ms", str(stats.milliseconds).encode()))
+                    headers.append((b"server-timing", f'db;dur={stats.milliseconds};desc="{stats.count} queries"'.encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_stats.reset(token)
+            if settings.SQL_PROFILE:
+                self._log(scope, stats, status_code)
+
+    def _log(self, scope, stats: QueryStats, status_code: int) -> None:
+        total_ms = (time.perf_counter() - stats.started_at) * 1000
+        too_many = 0 < settings.SQL_QUERY_COUNT_WARN <= stats.count
+        logger.log(
+            logging.WARNING if too_many else logging.INFO,
+            "%s %s %s queries=%d db=%.1fms total=%.1fms%s",
+            scope["method"], stats.route, status_code, stats.count, stats.milliseconds, total_ms,
+            " (too many queries)" if too_many else "",
+        )
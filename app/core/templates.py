@@ -0,0 +1,35 @@
+import os
+
+from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+from app.core.config import settings
+
+TEMPLATE_DIR = "templates"
+
+
+def _create_environment() -> Environment:
+    bytecode_cache = None
+    if settings.TEMPLATE_CACHE_DIR:
+        # コンパイル結果をディスクに保存し、ワーカー起動ごとの再コンパイルを省く
+        os.makedirs(settings.TEMPLATE_CACHE_DIR, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(settings.TEMPLATE_CACHE_DIR)
+    return Environment(
+        loader=FileSystemLoader(TEMPLATE_DIR),
+        autoescape=True,
+        # 本番ではテンプレートの更新チェック (ファイルの stat) をしない
+        auto_reload=settings.TEMPLATE_AUTO_RELOAD,
+        bytecode_cache=bytecode_cache,
+    )
+
+
+# 全ルーターで共有するテンプレート (各モジュールで Jinja2Templates を作らないこと)
+templates = Jinja2Templates(env=_create_environment())
+
+
+def precompile_templates() -> int:
+    """全テンプレートを読み込んでコンパイルしておく (初回表示時のコンパイル待ちをなくす)。件数を返す"""
+    names = templates.env.list_templates(extensions=["html"])
+    for name in names:
+        templates.env.get_template(name)
+    return len(names)
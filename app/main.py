@@ -1,16 +1,79 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy.exc import SQLAlchemyError
 from starlette.middleware.sessions import SessionMiddleware
 
 from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.profiling import QueryProfileMiddleware
+from app.core.templates import precompile_templates
+from app.models import models
 
 # 各機能ごとのルーターをインポート
-from app.routers import api_display, web_ui, admin_ads, websocket, super_admin, portal
+from app.routers import api_display, web_ui, admin_ads, websocket, super_admin, portal, metrics, media
+from app.services.ad_processing import ad_queue
+from app.services.admission import admission
+from app.services.auth import shutdown_executor
+from app.services.emergency import dispatcher
+from app.services.maintenance import register_jobs
+from app.services.metrics import MetricsMiddleware
+from app.services.presence import presence
+from app.services.revisions import revisions
+from app.services.scheduler import scheduler
+from app.services.websocket import manager
+
+def _school_count() -> int:
+    """登録されている学校数 (DB 未初期化の場合は 0)"""
+    try:
+        with SessionLocal() as db:
+            return db.query(models.School).count()
+    except SQLAlchemyError:
+        return 0
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # --- 起動時 ---
+    if settings.TEMPLATE_PRECOMPILE:
+        precompile_templates()
+    keepalive = asyncio.create_task(manager.run_keepalive())
+    # 表示設定のリビジョン (他ワーカーでの変更) の取り込み
+    revision_sync = asyncio.create_task(revisions.run_sync())
+    # 緊急連絡 (他ワーカーでの発信・解除) の取り込み
+    emergency_sync = asyncio.create_task(dispatcher.run_sync())
+    # WebSocket の接続状況の書き込み (稼働監視用)
+    presence_flush = asyncio.create_task(presence.run())
+    # WebSocket の受け入れ制御を端末数の見込みに合わせる
+    admission.configure(_school_count())
+    # 前回の停止時に処理途中だった広告申請を再開する
+    ad_queue.resume()
+    if settings.SCHEDULER_ENABLED:
+        register_jobs(scheduler)
+        scheduler.start()
+    yield
+    # --- 終了時 ---
+    # 新しい接続を断り、接続中の端末には時間をずらして再接続させる
+    admission.draining = True
+    await manager.drain()
+    keepalive.cancel()
+    revision_sync.cancel()
+    emergency_sync.cancel()
+    presence_flush.cancel()
+    try:
+        await presence.clear()
+    except SQLAlchemyError:
+        pass
+    await scheduler.stop()
+    ad_queue.shutdown()
+    shutdown_executor()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
-    version=settings.VERSION
+    version=settings.VERSION,
+    lifespan=lifespan
 )
 
 # CORS設定
@@ -25,6 +88,13 @@ app.add_middleware(
 # セッション管理ミドルウェア
 app.add_middleware(SessionMiddleware, secret_key=settings.SECRET_KEY)
 
+# ルート別のレイテンシ・ステータスコードの計測 (/metrics で公開)
+app.add_middleware(MetricsMiddleware)
+
+# リクエストごとの SQL クエリ数・DB時間の集計 (遅いクエリのログに発行元のルートを出すためにも使う)
+if settings.SQL_PROFILE or settings.SQL_PROFILE_HEADERS or settings.SQL_SLOW_QUERY_MS > 0:
+    app.add_middleware(QueryProfileMiddleware)
+
 # 静的ファイルのマウント
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -36,6 +106,8 @@ app.include_router(websocket.router)   # WebSocket
 # ★追加したルーター
 app.include_router(super_admin.router) # システム管理者用
 app.include_router(portal.router)      # 広告主申請ポータル
+app.include_router(metrics.router)     # Prometheus 用メトリクス
+app.include_router(media.router)       # メディアの中継配信 (S3 など)
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Text, JSON, DateTime, Boolean, Enum
+from sqlalchemy import Column, Integer, String, ForeignKey, Text, JSON, Date, DateTime, Boolean, Enum, Index, text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
@@ -23,6 +23,8 @@ class ContentType(str, enum.Enum):
     LOST_FOUND = "lost_found"
 
 class AdStatus(str, enum.Enum):
+    # 画像の検証・縮小版の作成中 (完了すると PENDING になり審査できる)
+    PROCESSING = "processing"
     PENDING = "pending"
     APPROVED = "approved"
     REJECTED = "rejected"
@@ -35,7 +37,9 @@ class User(Base):
     username = Column(String, unique=True, index=True)
     hashed_password = Column(String)
     role = Column(String)
-    school_id = Column(String, ForeignKey("schools.id"), nullable=True)
+    school_id = Column(String, ForeignKey("schools.id", ondelete="SET NULL"), nullable=True, index=True)
+    # 登録日時 (一覧の期間絞り込み用)
+    created_at = Column(DateTime, default=datetime.now, index=True)
     school = relationship("School", back_populates="users")
     ads = relationship("Ad", back_populates="owner")
 
@@ -44,25 +48,36 @@ class School(Base):
     id = Column(String, primary_key=True, index=True)
     name = Column(String)
     layout_type = Column(Integer, default=4)
+    # 地区 (緊急連絡の一斉配信などで学校をまとめる単位)
+    district = Column(String, nullable=True, index=True)
     last_heartbeat = Column(DateTime, nullable=True)
+    # 表示設定のリビジョン (変更のたびに増える。ロングポーリングの変更検知に使う)
+    config_revision = Column(Integer, default=0)
     users = relationship("User", back_populates="school")
-    slots = relationship("Slot", back_populates="school", cascade="all, delete-orphan")
-    invitation_tokens = relationship("InvitationToken", back_populates="target_school")
+    slots = relationship("Slot", back_populates="school", cascade="all, delete-orphan", passive_deletes=True)
+    invitation_tokens = relationship("InvitationToken", back_populates="target_school", cascade="all, delete-orphan", passive_deletes=True)
 
 class Slot(Base):
     __tablename__ = "slots"
     id = Column(Integer, primary_key=True, index=True)
-    school_id = Column(String, ForeignKey("schools.id"))
+    school_id = Column(String, ForeignKey("schools.id", ondelete="CASCADE"), index=True)
     position = Column(Integer)
     content_type = Column(String)
     config = Column(JSON, default={})
     school = relationship("School", back_populates="slots")
-    contents = relationship("Content", back_populates="slot", cascade="all, delete-orphan")
+    # プレイリスト (表示順)
+    contents = relationship("Content", back_populates="slot", cascade="all, delete-orphan", passive_deletes=True, order_by="Content.position")
 
 class Content(Base):
     __tablename__ = "contents"
+    # スロット単位のプレイリスト取得 (slot_id で絞り込み、position 順) 用
+    __table_args__ = (Index("ix_contents_slot_id_position", "slot_id", "position"),)
+
     id = Column(Integer, primary_key=True, index=True)
-    slot_id = Column(Integer, ForeignKey("slots.id"))
+    slot_id = Column(Integer, ForeignKey("slots.id", ondelete="CASCADE"))
+    # プレイリスト内の表示順と表示秒数
+    position = Column(Integer, default=0)
+    duration = Column(Integer, default=10)
     
     body = Column(Text, nullable=True)
     media_url = Column(String, nullable=True)
@@ -74,29 +89,130 @@ class Content(Base):
     theme = Column(String, default="default")
     
     # ★追加: 詳細なデザイン設定（文字色、背景色、サイズなどをJSONで保存）
+    # 値のある項目だけを保存する (項目と値の形式は app/services/content_style.py)
     style_config = Column(JSON, default={})
+    # エディタ上の要素の配置 (ダッシュボード用。プレイヤーには送らない)
+    layout_config = Column(JSON, nullable=True)
 
     slot = relationship("Slot", back_populates="contents")
 
 class Ad(Base):
     __tablename__ = "ads"
+    # ステータス絞り込み + 新しい順 (id desc) の一覧/配信用
+    __table_args__ = (Index("ix_ads_status_id", "status", "id"),)
+
     id = Column(Integer, primary_key=True, index=True)
-    owner_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
     applicant_name = Column(String, nullable=True) 
     title = Column(String)
     media_url = Column(String)
     target_area = Column(String)
     status = Column(String, default=AdStatus.PENDING)
+    # 申請時の元画像 / 審査画面用のサムネイル (media_url は配信用に縮小・メタデータ除去した画像)
+    original_url = Column(String, nullable=True)
+    thumbnail_url = Column(String, nullable=True)
+    # 画像の検証に失敗した理由 (却下として扱う)
+    processing_error = Column(String, nullable=True)
+    # 申請日時 (一覧の期間絞り込み用)
+    created_at = Column(DateTime, default=datetime.now, index=True)
     owner = relationship("User", back_populates="ads")
 
 class InvitationToken(Base):
     __tablename__ = "invitation_tokens"
+    # ポータルログイン (token + 未使用 + 期限内) 用
+    __table_args__ = (Index("ix_invitation_tokens_lookup", "token", "is_used", "expires_at"),)
+
     id = Column(Integer, primary_key=True, index=True)
     token = Column(String, unique=True, index=True)
-    school_id = Column(String, ForeignKey("schools.id"))
+    school_id = Column(String, ForeignKey("schools.id", ondelete="CASCADE"))
     expires_at = Column(DateTime)
     default_start_at = Column(DateTime, nullable=True)
     default_end_at = Column(DateTime, nullable=True)
     is_used = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.now)
-    target_school = relationship("School", back_populates="invitation_tokens")
\ No newline at end of file
+    target_school = relationship("School", back_populates="invitation_tokens")
+
+class HeartbeatInterval(Base):
+    """
+    端末がオンラインだった期間 (ランレングス形式)。
+    通信が途切れずに続いている間は行を増やさず、途切れて再開したときだけ1行追加する。
+    ended_at が NULL の行は継続中で、終了時刻は School.last_heartbeat とみなす。
+    継続中の区間は学校ごとに1行まで (複数のワーカーが同時に区間を開いても重複しないよう一意インデックスで保証する)。
+    """
+    __tablename__ = "heartbeat_intervals"
+    __table_args__ = (
+        Index("ix_heartbeat_intervals_school_started", "school_id", "started_at"),
+        Index("uq_heartbeat_intervals_open", "school_id", unique=True,
+              sqlite_where=text("ended_at IS NULL"), postgresql_where=text("ended_at IS NULL")),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    school_id = Column(String, ForeignKey("schools.id", ondelete="CASCADE"), nullable=False)
+    started_at = Column(DateTime, nullable=False)
+    ended_at = Column(DateTime, nullable=True)
+
+class HeartbeatDaily(Base):
+    """学校ごと・日ごとのオンライン秒数 (HeartbeatInterval を集計したもの)"""
+    __tablename__ = "heartbeat_daily"
+    __table_args__ = (Index("ix_heartbeat_daily_school_day", "school_id", "day", unique=True),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    school_id = Column(String, ForeignKey("schools.id", ondelete="CASCADE"), nullable=False)
+    day = Column(Date, nullable=False, index=True)
+    online_seconds = Column(Integer, default=0)
+
+class WorkerPresence(Base):
+    """
+    WebSocket で接続中の端末数 (ワーカー x 学校ごと)。
+    各ワーカーが PRESENCE_FLUSH_SECONDS ごとにまとめて書き込み、last_seen が PRESENCE_TTL_SECONDS 以内の行がある学校を
+    online とする (停止したワーカーの行は書き込まれなくなり、期限切れで無視・削除される)。
+    """
+    __tablename__ = "worker_presence"
+
+    worker_id = Column(String, primary_key=True)
+    school_id = Column(String, ForeignKey("schools.id", ondelete="CASCADE"), primary_key=True, index=True)
+    devices = Column(Integer, default=0)
+    last_seen = Column(DateTime, nullable=False, index=True)
+
+class SchedulerLease(Base):
+    """
+    定期ジョブの実行権 (複数ワーカー・複数台で同じジョブを重複実行しないためのリース)。
+    expires_at までは owner のワーカーだけがそのジョブを実行する。
+    """
+    __tablename__ = "scheduler_leases"
+
+    name = Column(String, primary_key=True)
+    owner = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+class EmergencyAlert(Base):
+    """
+    緊急連絡 (配信履歴)。cleared_at が NULL の行は解除されていない (端末に表示中の) 連絡。
+    各ワーカーはこの表を読み、自分に接続している端末へ配信・解除を送る
+    """
+    __tablename__ = "emergency_alerts"
+
+    id = Column(String, primary_key=True)
+    message = Column(Text, nullable=False)
+    level = Column(String, default="urgent")
+    scope = Column(String, nullable=False)
+    target = Column(String, nullable=True)
+    school_ids = Column(JSON, default=[])
+    issued_by = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    issued_at = Column(DateTime, default=datetime.now, index=True)
+    cleared_at = Column(DateTime, nullable=True, index=True)
+
+class EmergencyDelivery(Base):
+    """緊急連絡の端末ごとの配信状況 (端末が接続しているワーカーが記録する)"""
+    __tablename__ = "emergency_deliveries"
+    __table_args__ = (Index("ix_emergency_deliveries_alert_device", "alert_id", "school_id", "device_id"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    alert_id = Column(String, ForeignKey("emergency_alerts.id", ondelete="CASCADE"), nullable=False)
+    school_id = Column(String, nullable=False)
+    device_id = Column(String, nullable=False)
+    sent_at = Column(DateTime, nullable=False)
+    acked_at = Column(DateTime, nullable=True)
+    # 送信から ACK までの時間 (送信したワーカーで計測する)
+    latency_ms = Column(Integer, nullable=True)
+    error = Column(Boolean, default=False)
@@ -1,26 +1,39 @@
 from fastapi import APIRouter, Depends, Request, Form, HTTPException, status
 from fastapi.responses import RedirectResponse, HTMLResponse
-from fastapi.templating import Jinja2Templates
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from app.core.database import get_db
+from app.core.database import get_db, get_async_db
+from app.core.templates import templates
 from app.models import models
-from app.services.websocket import manager
+from app.services.auth import get_principal, resolve_principal
+from app.services.pagination import keyset_paginate
+from app.services.revisions import revisions
 
 router = APIRouter(prefix="/admin")
-templates = Jinja2Templates(directory="templates")
+
+# 広告審査ができるロール
+REVIEWER_ROLES = (models.UserRole.SUPER_ADMIN, models.UserRole.SCHOOL_ADMIN)
 
 @router.get("/ads", response_class=HTMLResponse)
-def admin_ads_page(request: Request, db: Session = Depends(get_db)):
-    user_id = request.session.get("user_id")
-    if not user_id:
+def admin_ads_page(request: Request, status: str = None, cursor: str = None, db: Session = Depends(get_db)):
+    principal = resolve_principal(request, db)
+    if not principal or not principal.has_role(*REVIEWER_ROLES):
         return RedirectResponse(url="/")
     
-    ads = db.query(models.Ad).order_by(models.Ad.id.desc()).all()
+    query = db.query(models.Ad)
+    if status:
+        query = query.filter(models.Ad.status == status)
+    page = keyset_paginate(query, models.Ad.id, cursor)
+
+    status_counts = dict(db.query(models.Ad.status, func.count(models.Ad.id)).group_by(models.Ad.status).all())
 
     return templates.TemplateResponse("admin_ads.html", {
         "request": request,
-        "ads": ads
+        "ads": page.items,
+        "page": page,
+        "status_counts": status_counts
     })
 
 @router.post("/ads/update")
@@ -28,24 +41,28 @@ async def update_ad_status(
     request: Request,
     ad_id: int = Form(...),
     action: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    user_id = request.session.get("user_id")
-    if not user_id:
+    principal = await get_principal(request, db)
+    if not principal or not principal.has_role(*REVIEWER_ROLES):
         return RedirectResponse(url="/")
 
-    ad = db.query(models.Ad).filter(models.Ad.id == ad_id).first()
+    ad = await db.get(models.Ad, ad_id)
     if not ad:
         raise HTTPException(status_code=404, detail="Ad not found")
 
     if action == "approve":
+        if ad.status == models.AdStatus.PROCESSING or not ad.media_url:
+            # 配信用の画像がない (処理中・処理に失敗した) 広告は承認できない
+            return RedirectResponse(url="/admin/ads", status_code=status.HTTP_303_SEE_OTHER)
         ad.status = models.AdStatus.APPROVED
     elif action == "reject":
         ad.status = models.AdStatus.REJECTED
     
-    db.commit()
+    await revisions.bump_in(db)
+    await db.commit()
 
     # ラズパイへ更新通知
-    await manager.broadcast("RELOAD")
+    await revisions.refresh()
 
     return RedirectResponse(url="/admin/ads", status_code=status.HTTP_303_SEE_OTHER)
\ No newline at end of file
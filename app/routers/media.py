@@ -0,0 +1,19 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+
+from app.services.storage import StorageError, guess_content_type, storage
+
+router = APIRouter(tags=["media"])
+
+@router.get("/media/{key:path}")
+def get_media(key: str):
+    """
+    ストレージ上のファイルを中継して配信する
+    (S3 などで公開URL (S3_PUBLIC_BASE_URL) を使わない場合。ローカル保存時は /static から配信される)
+    """
+    try:
+        body = storage.open(key)
+    except StorageError:
+        raise HTTPException(status_code=404, detail="Not found")
+    return StreamingResponse(body, media_type=guess_content_type(key),
+                             headers={"Cache-Control": "public, max-age=86400"})
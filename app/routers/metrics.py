@@ -0,0 +1,21 @@
+import secrets
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+from app.core.config import settings
+from app.services.metrics import registry
+
+router = APIRouter(tags=["metrics"])
+
+# Prometheus テキスト形式
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+@router.get("/metrics", include_in_schema=False)
+def metrics(request: Request):
+    """Prometheus 用のメトリクス (METRICS_TOKEN 設定時は Bearer 認証)"""
+    if settings.METRICS_TOKEN:
+        auth = request.headers.get("authorization", "")
+        if not secrets.compare_digest(auth, f"Bearer {settings.METRICS_TOKEN}"):
+            raise HTTPException(status_code=401, detail="Unauthorized")
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
@@ -1,15 +1,17 @@
-import shutil
 import os
-from datetime import datetime
+import uuid
 from fastapi import APIRouter, Depends, Request, Form, UploadFile, File, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import RedirectResponse, HTMLResponse
-from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
+from app.core.config import settings
 from app.core.database import get_db
+from app.core.templates import templates
 from app.models import models
+from app.services.ad_processing import ORIGINAL_PREFIX, ad_queue
+from app.services.storage import storage
 
 router = APIRouter()
-templates = Jinja2Templates(directory="templates")
 
 @router.get("/form", response_class=HTMLResponse)
 def show_form(request: Request, db: Session = Depends(get_db)):
@@ -42,17 +44,18 @@ async def submit_application(
     invitation = db.query(models.InvitationToken).filter(models.InvitationToken.id == token_id).first()
     
     # 画像保存
-    media_url = ""
+    if file and file.size and file.size > settings.AD_MAX_UPLOAD_BYTES:
+        return templates.TemplateResponse("portal/form.html", {
+            "request": request,
+            "school": invitation.target_school,
+            "error": f"画像ファイルは {settings.AD_MAX_UPLOAD_BYTES // (1024 * 1024)}MB 以下にしてください"
+        })
     if file and file.filename:
-        os.makedirs("static/ads", exist_ok=True)
-        timestamp = int(datetime.now().timestamp())
-        safe_filename = os.path.basename(file.filename)
-        filename = f"ad_req_{timestamp}_{safe_filename}"
-        file_location = f"static/ads/{filename}"
-        
-        with open(file_location, "wb+") as file_object:
-            shutil.copyfileobj(file.file, file_object)
-        media_url = f"/static/ads/{filename}"
+        # 元画像は処理後に削除されるまで公開領域に置かれるため、推測できないファイル名にする
+        ext = os.path.splitext(os.path.basename(file.filename))[1].lower()
+        filename = f"ad_req_{uuid.uuid4().hex}{ext}"
+        # 画像の検証・縮小は処理キューで行い、ここでは元画像の保存だけにする
+        original_url = await run_in_threadpool(storage.save, f"{ORIGINAL_PREFIX}/{filename}", file.file, file.content_type)
     else:
         return templates.TemplateResponse("portal/form.html", {
             "request": request,
@@ -64,12 +67,13 @@ async def submit_application(
     new_ad = models.Ad(
         applicant_name=applicant_name,
         title=title,
-        media_url=media_url,
+        original_url=original_url,
         target_area=invitation.target_school.name, 
-        status=models.AdStatus.PENDING,
+        status=models.AdStatus.PROCESSING,
         owner_id=None
     )
     db.add(new_ad)
     db.commit()
+    ad_queue.enqueue(new_ad.id)
     
     return templates.TemplateResponse("portal/success.html", {"request": request})
\ No newline at end of file
@@ -1,13 +1,12 @@
 from datetime import datetime
 from fastapi import APIRouter, Depends, Request, Form, status
 from fastapi.responses import RedirectResponse, HTMLResponse
-from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
 from app.core.database import get_db
+from app.core.templates import templates
 from app.models import models
 
 router = APIRouter()
-templates = Jinja2Templates(directory="templates")
 
 @router.get("/login", response_class=HTMLResponse)
 def login_page(request: Request):
@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from . import dashboard, schools, tokens, users, ads
+from . import dashboard, schools, tokens, users, ads, uptime, emergency, contents
 
 # prefix="/super_admin" で配下のルーターをまとめる
 router = APIRouter(prefix="/super_admin", tags=["super_admin"])
@@ -9,4 +9,7 @@ router.include_router(dashboard.router)
 router.include_router(schools.router)
 router.include_router(tokens.router)
 router.include_router(users.router)  # ★追加
-router.include_router(ads.router)    # ★追加
\ No newline at end of file
+router.include_router(ads.router)    # ★追加
+router.include_router(uptime.router)
+router.include_router(emergency.router)
+router.include_router(contents.router)
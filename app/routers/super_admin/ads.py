@@ -1,28 +1,33 @@
 from fastapi import APIRouter, Depends, Request, Form, status
 from fastapi.responses import RedirectResponse, HTMLResponse
-from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
-from app.core.database import get_db
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload
+from app.core.database import get_db, get_async_db
+from app.core.templates import templates
 from app.models import models
-from app.services.websocket import manager
-from .dependencies import check_super_admin
+from app.services.pagination import filter_date_range, keyset_paginate
+from app.services.revisions import revisions
+from .dependencies import check_super_admin, check_super_admin_async
 
 router = APIRouter(prefix="/ads")
-templates = Jinja2Templates(directory="templates")
 
 @router.get("/", response_class=HTMLResponse)
 def list_ads(
     request: Request, 
     status: str = None,  # 追加: ステータス受け取り (クエリパラメータ)
     area: str = None,    # 追加: エリア検索ワード受け取り (クエリパラメータ)
+    date_from: str = None,  # 申請日の範囲 (YYYY-MM-DD)
+    date_to: str = None,
+    cursor: str = None,  # ページング用 (前ページ最後の広告ID)
     db: Session = Depends(get_db)
 ):
     """全広告一覧（フィルタリング機能付き）"""
     if not check_super_admin(request, db):
         return RedirectResponse(url="/")
     
-    # クエリの構築
-    query = db.query(models.Ad)
+    # クエリの構築 (申請者表示用に owner を同時に取得)
+    query = db.query(models.Ad).options(joinedload(models.Ad.owner))
 
     # フィルタリング適用
     if status:
@@ -32,12 +37,19 @@ def list_ads(
         # 学校名などに検索ワードが含まれているか (部分一致)
         query = query.filter(models.Ad.target_area.contains(area))
 
-    # 新しい順に取得して実行
-    ads = query.order_by(models.Ad.id.desc()).all()
+    query = filter_date_range(query, models.Ad.created_at, date_from, date_to)
+
+    # 新しい順に1ページ分だけ取得
+    page = keyset_paginate(query, models.Ad.id, cursor)
+
+    # ステータス別件数はSQLで集計 (ix_ads_status_id を利用)
+    status_counts = dict(db.query(models.Ad.status, func.count(models.Ad.id)).group_by(models.Ad.status).all())
     
     return templates.TemplateResponse("super_admin/ads.html", {
         "request": request,
-        "ads": ads,
+        "ads": page.items,
+        "page": page,
+        "status_counts": status_counts,
         "AdStatus": models.AdStatus
     })
 
@@ -46,18 +58,20 @@ async def update_ad_status(
     request: Request,
     ad_id: int = Form(...),
     status_val: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """ステータス更新"""
-    if not check_super_admin(request, db):
+    if not await check_super_admin_async(request, db):
         return RedirectResponse(url="/")
     
-    ad = db.query(models.Ad).filter(models.Ad.id == ad_id).first()
-    if ad:
+    ad = await db.get(models.Ad, ad_id)
+    # 配信用の画像がない (処理中・処理に失敗した) 広告は承認できない
+    if ad and not (status_val == models.AdStatus.APPROVED and (ad.status == models.AdStatus.PROCESSING or not ad.media_url)):
         ad.status = status_val
-        db.commit()
+        await revisions.bump_in(db)
+        await db.commit()
         # サイネージへ更新通知
-        await manager.broadcast("RELOAD")
+        await revisions.refresh()
     
     return RedirectResponse(url="/super_admin/ads", status_code=status.HTTP_303_SEE_OTHER)
 
@@ -65,17 +79,18 @@ async def update_ad_status(
 async def delete_ad(
     request: Request,
     ad_id: int = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """広告削除"""
-    if not check_super_admin(request, db):
+    if not await check_super_admin_async(request, db):
         return RedirectResponse(url="/")
     
-    ad = db.query(models.Ad).filter(models.Ad.id == ad_id).first()
+    ad = await db.get(models.Ad, ad_id)
     if ad:
-        db.delete(ad)
-        db.commit()
+        await db.delete(ad)
+        await revisions.bump_in(db)
+        await db.commit()
         # サイネージへ更新通知
-        await manager.broadcast("RELOAD")
+        await revisions.refresh()
     
     return RedirectResponse(url="/super_admin/ads", status_code=status.HTTP_303_SEE_OTHER)
\ No newline at end of file
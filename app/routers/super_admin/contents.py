@@ -0,0 +1,94 @@
+import re
+from typing import List
+
+from fastapi import APIRouter, Depends, Request, Form, UploadFile, File, status
+from fastapi.responses import RedirectResponse, HTMLResponse
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database import get_async_db
+from app.core.templates import templates
+from app.models import models
+from app.services.bulk_content import (
+    STYLE_KEYS, BulkChange, apply_bulk_change, parse_form_datetime, save_shared_asset,
+)
+from .dependencies import check_super_admin_async
+
+router = APIRouter(prefix="/contents")
+
+async def _resolve_schools(db: AsyncSession, target_scope: str, district: str, school_ids: str) -> List[str]:
+    query = select(models.School.id)
+    if target_scope == "district":
+        query = query.where(models.School.district == district)
+    elif target_scope == "schools":
+        ids = [s for s in re.split(r"[\s,]+", school_ids) if s]
+        query = query.where(models.School.id.in_(ids))
+    return list((await db.execute(query)).scalars())
+
+@router.get("/bulk", response_class=HTMLResponse)
+async def bulk_page(request: Request, db: AsyncSession = Depends(get_async_db)):
+    if not await check_super_admin_async(request, db):
+        return RedirectResponse(url="/")
+
+    districts = (await db.execute(
+        select(models.School.district).where(models.School.district != None)  # noqa: E711
+        .distinct().order_by(models.School.district)
+    )).scalars().all()
+    return templates.TemplateResponse("super_admin/bulk_content.html", {
+        "request": request,
+        "districts": districts,
+        "ContentType": models.ContentType,
+    })
+
+@router.post("/bulk")
+async def bulk_update(
+    request: Request,
+    target_scope: str = Form("all"),
+    district: str = Form(""),
+    school_ids: str = Form(""),
+    content_types: List[str] = Form(...),
+    body: str = Form(None),
+    theme: str = Form(None),
+    update_schedule: bool = Form(False),
+    start_at: str = Form(None),
+    end_at: str = Form(None),
+    duration: int = Form(None),
+    apply_style: bool = Form(False),
+    style_bg_color: str = Form(None),
+    style_text_color: str = Form(None),
+    style_font_size: str = Form(None),
+    style_text_align: str = Form(None),
+    style_font_weight: str = Form(None),
+    file: UploadFile = File(None),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """選択した学校・スロット種別に同じ内容を一括で反映する"""
+    if not await check_super_admin_async(request, db):
+        return RedirectResponse(url="/")
+
+    targets = await _resolve_schools(db, target_scope, district, school_ids)
+    if not targets:
+        return RedirectResponse(url="/super_admin/contents/bulk?error=no_target", status_code=status.HTTP_303_SEE_OTHER)
+
+    style_values = dict(zip(STYLE_KEYS, (
+        style_bg_color, style_text_color, style_font_size, style_text_align, style_font_weight,
+    )))
+    change = BulkChange(
+        body=body or None,
+        theme=theme or None,
+        update_schedule=update_schedule,
+        start_at=parse_form_datetime(start_at),
+        end_at=parse_form_datetime(end_at),
+        duration=duration if duration and duration > 0 else None,
+        style={k: v for k, v in style_values.items() if v} if apply_style else {},
+    )
+    # 素材は1回だけ保存して全校で同じ URL を参照する
+    if file and file.filename:
+        change.media_url = await run_in_threadpool(save_shared_asset, file.file, file.filename)
+
+    result = await apply_bulk_change(db, targets, content_types, change)
+    return RedirectResponse(
+        url=f"/super_admin/contents/bulk?schools={len(result.school_ids)}&updated={result.updated}&created={result.created}",
+        status_code=status.HTTP_303_SEE_OTHER
+    )
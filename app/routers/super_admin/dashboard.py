@@ -1,15 +1,17 @@
-from datetime import datetime
-from fastapi import APIRouter, Depends, Request, status
-from fastapi.responses import RedirectResponse, HTMLResponse
-from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Query, Request, status
+from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse
+from sqlalchemy.orm import Session, joinedload
 
 from app.core.database import get_db
+from app.core.templates import templates
 from app.models import models
+from app.services.display_config import config_flight
+from app.services.fleet import fleet_summary, school_statuses, status_to_dict
+from app.services.scheduler import scheduler
+from app.services.websocket import manager
 from .dependencies import check_super_admin
 
 router = APIRouter()
-templates = Jinja2Templates(directory="templates")
 
 @router.get("/dashboard", response_class=HTMLResponse)
 def view_dashboard(request: Request, db: Session = Depends(get_db)):
@@ -17,30 +19,70 @@ def view_dashboard(request: Request, db: Session = Depends(get_db)):
     if not user:
         return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
 
-    schools = db.query(models.School).all()
-    
-    # 死活監視チェック
-    school_status = []
-    now = datetime.now()
-    for school in schools:
-        is_online = False
-        if school.last_heartbeat:
-            delta = now - school.last_heartbeat
-            if delta.total_seconds() < 600: # 10分以内
-                is_online = True
-        
-        school_status.append({
-            "school": school,
-            "is_online": is_online,
-            "last_heartbeat": school.last_heartbeat
-        })
-
-    # 発行済みのトークン一覧
-    tokens = db.query(models.InvitationToken).order_by(models.InvitationToken.created_at.desc()).all()
+    # 死活監視 (件数は集計クエリ1回、一覧は1ページ分の列だけを取得)
+    status_filter = request.query_params.get("status")
+    fleet = fleet_summary(db)
+    page = school_statuses(db, status=status_filter, cursor=request.query_params.get("cursor"))
+
+    # トークン発行フォームの選択肢 (ID と名前だけを取得)
+    school_options = db.query(models.School.id, models.School.name).order_by(models.School.id).all()
+
+    # 発行済みのトークン (画面に表示する最新5件のみ)
+    tokens = (
+        db.query(models.InvitationToken)
+        .options(joinedload(models.InvitationToken.target_school))
+        .order_by(models.InvitationToken.id.desc())
+        .limit(5)
+        .all()
+    )
 
     return templates.TemplateResponse("super_admin/dashboard.html", {
         "request": request,
-        "school_status": school_status,
+        "fleet": fleet,
+        "page": page,
+        "school_options": school_options,
         "tokens": tokens,
         "created_token": request.query_params.get("created_token")
-    })
\ No newline at end of file
+    })
+
+@router.get("/fleet/status.json")
+def fleet_status(
+    request: Request,
+    status_filter: str = Query(None, alias="status"),
+    cursor: str = None,
+    db: Session = Depends(get_db)
+):
+    """
+    ダッシュボードの自動更新用。稼働状態の件数と、画面と同じ条件の1ページ分を返す。
+    (?status=online|stale|offline, ?cursor=... はダッシュボードと共通)
+    """
+    if not check_super_admin(request, db):
+        return JSONResponse({"detail": "Forbidden"}, status_code=status.HTTP_403_FORBIDDEN)
+
+    page = school_statuses(db, status=status_filter, cursor=cursor)
+    return {
+        "counts": fleet_summary(db),
+        "schools": [status_to_dict(row) for row in page.items],
+        "next_cursor": page.next_cursor,
+    }
+
+@router.get("/fleet/devices.json")
+def fleet_devices(request: Request, school_id: str, db: Session = Depends(get_db)):
+    """学校に接続中の端末一覧 (端末ID・メタデータ・最終応答からの秒数)"""
+    if not check_super_admin(request, db):
+        return JSONResponse({"detail": "Forbidden"}, status_code=status.HTTP_403_FORBIDDEN)
+    return {"school_id": school_id, "devices": manager.devices(school_id)}
+
+@router.get("/display/stats.json")
+def display_stats(request: Request, db: Session = Depends(get_db)):
+    """表示設定の組み立て回数 (collapsed = 実行中の組み立てを共有したリクエスト数)"""
+    if not check_super_admin(request, db):
+        return JSONResponse({"detail": "Forbidden"}, status_code=status.HTTP_403_FORBIDDEN)
+    return {"config_builds": config_flight.stats()}
+
+@router.get("/jobs.json")
+def job_status(request: Request, db: Session = Depends(get_db)):
+    """定期ジョブの実行状況 (このワーカーで実行した分のみ)"""
+    if not check_super_admin(request, db):
+        return JSONResponse({"detail": "Forbidden"}, status_code=status.HTTP_403_FORBIDDEN)
+    return {"jobs": scheduler.status()}
@@ -1,18 +1,26 @@
 from fastapi import Request, Depends, status
 from fastapi.responses import RedirectResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.core.database import get_db
-from app.models import models
+from app.core.database import get_db, get_async_db
+from app.services.auth import get_principal, resolve_principal
 
 def check_super_admin(request: Request, db: Session = Depends(get_db)):
-    """スーパー管理者権限チェック。権限がない場合はNoneを返す"""
-    user_id = request.session.get("user_id")
-    if not user_id:
+    """
+    スーパー管理者権限チェック。権限がない場合はNoneを返す。
+    ユーザー情報は Principal キャッシュから解決するため、通常はDBを参照しない。
+    """
+    principal = resolve_principal(request, db)
+    if not principal or not principal.is_super_admin:
         return None
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not user or user.role != models.UserRole.SUPER_ADMIN:
+    return principal
+
+async def check_super_admin_async(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """check_super_admin の非同期版 (AsyncSession を使う async def のエンドポイント用)"""
+    principal = await get_principal(request, db)
+    if not principal or not principal.is_super_admin:
         return None
-    return user
+    return principal
 
 def require_super_admin(request: Request, db: Session = Depends(get_db)):
     """
@@ -23,4 +31,4 @@ def require_super_admin(request: Request, db: Session = Depends(get_db)):
     if not user:
         # ここで例外を投げるか、Noneを返して呼び出し元でハンドリングする
         return None
-    return user
\ No newline at end of file
+    return user
@@ -0,0 +1,74 @@
+from fastapi import APIRouter, Depends, Request, Form, status
+from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database import get_async_db
+from app.core.templates import templates
+from app.models import models
+from app.services.emergency import SCOPE_ALL, SCOPE_DISTRICT, SCOPE_SCHOOL, SCOPES, dispatcher
+from .dependencies import check_super_admin_async
+
+router = APIRouter(prefix="/emergency")
+
+async def _target_school_ids(db: AsyncSession, scope: str, target: str) -> list:
+    query = select(models.School.id)
+    if scope == SCOPE_SCHOOL:
+        query = query.where(models.School.id == target)
+    elif scope == SCOPE_DISTRICT:
+        query = query.where(models.School.district == target)
+    return list((await db.execute(query)).scalars())
+
+@router.get("/", response_class=HTMLResponse)
+async def emergency_page(request: Request, db: AsyncSession = Depends(get_async_db)):
+    if not await check_super_admin_async(request, db):
+        return RedirectResponse(url="/")
+
+    districts = list((await db.execute(
+        select(models.School.district)
+        .where(models.School.district.is_not(None))
+        .distinct().order_by(models.School.district)
+    )).scalars())
+    return templates.TemplateResponse("super_admin/emergency.html", {
+        "request": request,
+        "districts": districts,
+        "reports": await dispatcher.recent_reports(),
+    })
+
+@router.post("/send")
+async def send_emergency(
+    request: Request,
+    message: str = Form(...),
+    scope: str = Form(SCOPE_ALL),
+    target: str = Form(""),
+    db: AsyncSession = Depends(get_async_db)
+):
+    principal = await check_super_admin_async(request, db)
+    if not principal:
+        return RedirectResponse(url="/")
+    if scope not in SCOPES or not message.strip():
+        return RedirectResponse(url="/super_admin/emergency?error=invalid", status_code=status.HTTP_303_SEE_OTHER)
+
+    school_ids = await _target_school_ids(db, scope, target)
+    if not school_ids:
+        return RedirectResponse(url="/super_admin/emergency?error=no_target", status_code=status.HTTP_303_SEE_OTHER)
+
+    await dispatcher.send(school_ids, message.strip(), scope=scope, target=target or None, issued_by=principal.id)
+    return RedirectResponse(url="/super_admin/emergency", status_code=status.HTTP_303_SEE_OTHER)
+
+@router.post("/clear")
+async def clear_emergency(request: Request, alert_id: str = Form(...), db: AsyncSession = Depends(get_async_db)):
+    if not await check_super_admin_async(request, db):
+        return RedirectResponse(url="/")
+    await dispatcher.clear(alert_id)
+    return RedirectResponse(url="/super_admin/emergency", status_code=status.HTTP_303_SEE_OTHER)
+
+@router.get("/{alert_id}.json")
+async def emergency_report(request: Request, alert_id: str, db: AsyncSession = Depends(get_async_db)):
+    """配信結果 (ACK 状況・遅延) の取得。画面の自動更新用"""
+    if not await check_super_admin_async(request, db):
+        return JSONResponse({"detail": "Forbidden"}, status_code=status.HTTP_403_FORBIDDEN)
+    report = await dispatcher.report(alert_id)
+    if not report:
+        return JSONResponse({"detail": "Not found"}, status_code=status.HTTP_404_NOT_FOUND)
+    return report
@@ -1,13 +1,17 @@
 from fastapi import APIRouter, Depends, Request, Form, status, HTTPException
 from fastapi.responses import RedirectResponse, HTMLResponse
-from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
-from app.core.database import get_db
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
+from app.core.database import get_db, get_async_db
+from app.core.templates import templates
 from app.models import models
-from .dependencies import check_super_admin
+from app.services.auth import principal_cache
+from app.services.pagination import keyset_paginate
+from app.services.revisions import revisions
+from .dependencies import check_super_admin, check_super_admin_async
 
 router = APIRouter(prefix="/schools")
-templates = Jinja2Templates(directory="templates")
 
 # ★ レイアウトIDと必要なスロット数の対応表
 LAYOUT_SLOT_COUNTS = {
@@ -28,14 +32,19 @@ LAYOUT_SLOT_COUNTS = {
 }
 
 @router.get("/", response_class=HTMLResponse)
-def list_schools(request: Request, db: Session = Depends(get_db)):
+def list_schools(request: Request, cursor: str = None, db: Session = Depends(get_db)):
     if not check_super_admin(request, db):
         return RedirectResponse(url="/")
     
-    schools = db.query(models.School).all()
+    # スロット情報はページ内の学校分だけ IN 句でまとめて取得
+    query = db.query(models.School).options(selectinload(models.School.slots))
+    page = keyset_paginate(query, models.School.id, cursor, descending=False)
+    page.total = db.query(func.count(models.School.id)).scalar()
+
     return templates.TemplateResponse("super_admin/schools.html", {
         "request": request,
-        "schools": schools,
+        "schools": page.items,
+        "page": page,
         "ContentType": models.ContentType
     })
 
@@ -45,6 +54,7 @@ def create_school(
     school_id: str = Form(...),
     name: str = Form(...),
     layout_type: int = Form(4),
+    district: str = Form(""),
     db: Session = Depends(get_db)
 ):
     if not check_super_admin(request, db):
@@ -53,7 +63,7 @@ def create_school(
     if db.query(models.School).filter(models.School.id == school_id).first():
         return RedirectResponse(url="/super_admin/schools?error=duplicate", status_code=status.HTTP_303_SEE_OTHER)
 
-    new_school = models.School(id=school_id, name=name, layout_type=layout_type)
+    new_school = models.School(id=school_id, name=name, layout_type=layout_type, district=district.strip() or None)
     db.add(new_school)
     
     slot_count = LAYOUT_SLOT_COUNTS.get(layout_type, 4)
@@ -67,9 +77,9 @@ def create_school(
 @router.post("/update")
 async def update_school(
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    if not check_super_admin(request, db):
+    if not await check_super_admin_async(request, db):
         return RedirectResponse(url="/")
     
     form_data = await request.form()
@@ -77,12 +87,13 @@ async def update_school(
     name = form_data.get("name")
     layout_type = int(form_data.get("layout_type"))
     
-    school = db.query(models.School).filter(models.School.id == school_id).first()
+    school = await db.get(models.School, school_id)
     if not school:
         raise HTTPException(status_code=404, detail="School not found")
 
     school.name = name
     school.layout_type = layout_type
+    school.district = (form_data.get("district") or "").strip() or None
 
     slot_count = LAYOUT_SLOT_COUNTS.get(layout_type, 4)
 
@@ -99,7 +110,10 @@ async def update_school(
     if new_slot_types.count(models.ContentType.AD) > 1:
         return RedirectResponse(url=f"/super_admin/schools?error=ad_limit&edit={school_id}", status_code=status.HTTP_303_SEE_OTHER)
 
-    existing_slots = db.query(models.Slot).filter(models.Slot.school_id == school_id).order_by(models.Slot.position).all()
+    result = await db.execute(
+        select(models.Slot).where(models.Slot.school_id == school_id).order_by(models.Slot.position)
+    )
+    existing_slots = result.scalars().all()
     existing_map = {s.position: s for s in existing_slots}
 
     for i, type_val in enumerate(new_slot_types):
@@ -112,9 +126,12 @@ async def update_school(
     
     for pos, slot in existing_map.items():
         if pos >= slot_count:
-            db.delete(slot)
+            await db.delete(slot)
 
-    db.commit()
+    # レイアウト・スロット構成の変更を表示端末に反映させる
+    await revisions.bump_in(db, [school_id])
+    await db.commit()
+    await revisions.refresh([school_id])
     return RedirectResponse(url="/super_admin/schools", status_code=status.HTTP_303_SEE_OTHER)
 
 @router.post("/delete")
@@ -130,5 +147,7 @@ def delete_school(
     if school:
         db.delete(school)
         db.commit()
+        # 所属ユーザーの school_id が NULL になるため、キャッシュ済みの権限情報を破棄
+        principal_cache.clear()
     
     return RedirectResponse(url="/super_admin/schools", status_code=status.HTTP_303_SEE_OTHER)
\ No newline at end of file
@@ -0,0 +1,36 @@
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import RedirectResponse, HTMLResponse
+from sqlalchemy.orm import Session
+
+from app.core.database import get_db
+from app.core.templates import templates
+from app.models import models
+from app.services.heartbeat import uptime_report
+from app.services.pagination import keyset_paginate
+from .dependencies import check_super_admin
+
+router = APIRouter(prefix="/uptime")
+
+# 画面で選択できる集計期間 (日)
+PERIOD_CHOICES = (7, 30, 90)
+
+@router.get("/", response_class=HTMLResponse)
+def uptime_page(request: Request, days: int = 30, cursor: str = None, db: Session = Depends(get_db)):
+    if not check_super_admin(request, db):
+        return RedirectResponse(url="/")
+
+    if days not in PERIOD_CHOICES:
+        days = 30
+
+    query = db.query(models.School.id, models.School.name)
+    page = keyset_paginate(query, models.School.id, cursor, descending=False)
+    day_list, report = uptime_report(db, [row.id for row in page.items], days)
+
+    return templates.TemplateResponse("super_admin/uptime.html", {
+        "request": request,
+        "page": page,
+        "days": days,
+        "period_choices": PERIOD_CHOICES,
+        "day_list": day_list,
+        "report": report,
+    })
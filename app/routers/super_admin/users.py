@@ -1,50 +1,76 @@
 from fastapi import APIRouter, Depends, Request, Form, status
 from fastapi.responses import RedirectResponse, HTMLResponse
-from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
-from passlib.context import CryptContext
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload
 
-from app.core.database import get_db
+from app.core.database import get_db, get_async_db
+from app.core.templates import templates
 from app.models import models
-from .dependencies import check_super_admin
+from app.services.auth import AuthBusyError, hash_password, principal_cache
+from app.services.pagination import filter_date_range, keyset_paginate
+from .dependencies import check_super_admin, check_super_admin_async
 
 router = APIRouter(prefix="/users")
-templates = Jinja2Templates(directory="templates")
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 @router.get("/", response_class=HTMLResponse)
-def list_users(request: Request, db: Session = Depends(get_db)):
-    """ユーザー一覧"""
+def list_users(
+    request: Request,
+    role: str = None,
+    school_id: str = None,
+    date_from: str = None,  # 登録日の範囲 (YYYY-MM-DD)
+    date_to: str = None,
+    cursor: str = None,
+    db: Session = Depends(get_db)
+):
+    """ユーザー一覧 (ロール・学校・登録日で絞り込み、ページング)"""
     if not check_super_admin(request, db):
         return RedirectResponse(url="/")
     
-    users = db.query(models.User).all()
-    schools = db.query(models.School).all()
+    query = db.query(models.User)
+    if role:
+        query = query.filter(models.User.role == role)
+    if school_id:
+        query = query.filter(models.User.school_id == school_id)
+    query = filter_date_range(query, models.User.created_at, date_from, date_to)
+    total = query.with_entities(func.count(models.User.id)).scalar()
+
+    # 所属学校名は同じクエリで JOIN して取得 (N+1 を避ける)
+    page = keyset_paginate(query.options(joinedload(models.User.school)), models.User.id, cursor, descending=False)
+    page.total = total
+
+    # 作成フォーム・絞り込みの選択肢用には ID と名前だけを取得
+    schools = db.query(models.School.id, models.School.name).order_by(models.School.id).all()
     
     return templates.TemplateResponse("super_admin/users.html", {
         "request": request,
-        "users": users,
+        "users": page.items,
+        "page": page,
         "schools": schools,
         "UserRole": models.UserRole
     })
 
 @router.post("/create")
-def create_user(
+async def create_user(
     request: Request,
     username: str = Form(...),
     password: str = Form(...),
     role: str = Form(...),
     school_id: str = Form(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """ユーザー作成"""
-    if not check_super_admin(request, db):
+    if not await check_super_admin_async(request, db):
         return RedirectResponse(url="/")
     
-    if db.query(models.User).filter(models.User.username == username).first():
+    result = await db.execute(select(models.User.id).where(models.User.username == username))
+    if result.first():
         return RedirectResponse(url="/super_admin/users?error=duplicate", status_code=status.HTTP_303_SEE_OTHER)
 
-    hashed_password = pwd_context.hash(password)
+    try:
+        hashed_password = await hash_password(password)
+    except AuthBusyError:
+        return RedirectResponse(url="/super_admin/users?error=busy", status_code=status.HTTP_303_SEE_OTHER)
     
     # 学校管理者の場合のみ学校IDをセット、それ以外はNoneにする等のロジック
     if role != models.UserRole.SCHOOL_ADMIN:
@@ -57,7 +83,7 @@ def create_user(
         school_id=school_id
     )
     db.add(new_user)
-    db.commit()
+    await db.commit()
     return RedirectResponse(url="/super_admin/users", status_code=status.HTTP_303_SEE_OTHER)
 
 @router.post("/delete")
@@ -79,5 +105,7 @@ def delete_user(
     if user:
         db.delete(user)
         db.commit()
+        # 削除済みユーザーのセッションが残っていても権限を使えないようにする
+        principal_cache.invalidate(user_id)
     
     return RedirectResponse(url="/super_admin/users", status_code=status.HTTP_303_SEE_OTHER)
\ No newline at end of file
@@ -1,40 +1,68 @@
-import shutil
 import os
 import json
 import re
 from datetime import datetime
+from typing import Optional
 from fastapi import APIRouter, Depends, Request, Form, UploadFile, File, status
-from fastapi.responses import RedirectResponse, HTMLResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy.orm.attributes import flag_modified
-from passlib.context import CryptContext
 
-from app.core.database import get_db
+from app.core.database import get_db, get_async_db
+from app.core.templates import templates
 from app.models import models
-from app.services.websocket import manager
+from app.services.auth import (
+    AuthBusyError, Principal, get_principal, ip_limiter, principal_cache, resolve_principal, user_limiter, verify_password
+)
+from app.services.content_style import update_layout, update_style
+from app.services.emergency import SCOPE_SCHOOL, dispatcher
+from app.services.fleet import ONLINE, status_of
+from app.services.revisions import revisions
+from app.services.storage import storage
 
 # ★修正: APIRouterをインポートし、ルーターオブジェクトを定義
 router = APIRouter() 
-templates = Jinja2Templates(directory="templates")
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 @router.get("/", response_class=HTMLResponse)
 def login_page(request: Request):
     return templates.TemplateResponse("login.html", {"request": request})
 
 @router.post("/login")
-def login(request: Request, school_id: str = Form(...), username: str = Form(...), password: str = Form(...), db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.username == username).first()
-    
-    if not user or not pwd_context.verify(password, user.hashed_password):
+async def login(request: Request, school_id: str = Form(...), username: str = Form(...), password: str = Form(...), db: AsyncSession = Depends(get_async_db)):
+    client_ip = request.client.host if request.client else "unknown"
+
+    # 失敗が続いている IP / ユーザー名はハッシュ計算の前に拒否する
+    if ip_limiter.retry_after(client_ip) or user_limiter.retry_after(username):
+        return templates.TemplateResponse("login.html", {"request": request, "error": "ログイン試行回数が多すぎます。しばらくしてから再度お試しください"}, status_code=status.HTTP_429_TOO_MANY_REQUESTS)
+
+    result = await db.execute(select(models.User).where(models.User.username == username))
+    user = result.scalar_one_or_none()
+
+    # 存在しないユーザー名は bcrypt を実行せずに即座に拒否する
+    if not user:
+        ip_limiter.record_failure(client_ip)
+        return templates.TemplateResponse("login.html", {"request": request, "error": "IDまたはパスワードが違います"})
+
+    try:
+        is_valid = await verify_password(password, user.hashed_password)
+    except AuthBusyError:
+        return templates.TemplateResponse("login.html", {"request": request, "error": "ただいま混雑しています。しばらくしてから再度お試しください"}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    if not is_valid:
+        ip_limiter.record_failure(client_ip)
+        user_limiter.record_failure(username)
         return templates.TemplateResponse("login.html", {"request": request, "error": "IDまたはパスワードが違います"})
+
+    user_limiter.reset(username)
     
     if user.role != models.UserRole.SUPER_ADMIN:
         if not user.school_id or user.school_id != school_id:
             return templates.TemplateResponse("login.html", {"request": request, "error": "所属学校の情報が一致しません"})
     
     request.session["user_id"] = user.id
+    principal_cache.set(Principal.from_user(user))
     
     if user.role == models.UserRole.SUPER_ADMIN:
         return RedirectResponse(url="/super_admin/dashboard", status_code=status.HTTP_303_SEE_OTHER)
@@ -48,51 +76,36 @@ def logout(request: Request):
 
 @router.get("/dashboard", response_class=HTMLResponse)
 def dashboard(request: Request, db: Session = Depends(get_db)):
-    user_id = request.session.get("user_id")
-    if not user_id:
-        return RedirectResponse(url="/")
-
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not user:
+    principal = resolve_principal(request, db)
+    if not principal:
         return RedirectResponse(url="/")
 
-    school = user.school
+    school = db.get(models.School, principal.school_id) if principal.school_id else None
     
     if not school:
-        if user.role == models.UserRole.SUPER_ADMIN:
+        if principal.is_super_admin:
             return RedirectResponse(url="/super_admin/dashboard")
         return templates.TemplateResponse("login.html", {"request": request, "error": "所属する学校情報がありません"})
 
-    is_online = False
+    is_online = status_of(db, school) == ONLINE
     last_seen_str = "データなし"
 
     if school.last_heartbeat:
-        delta = datetime.now() - school.last_heartbeat
-        if delta.total_seconds() < 600:
-            is_online = True
         last_seen_str = school.last_heartbeat.strftime("%m/%d %H:%M")
 
     slots_data = []
     for slot in sorted(school.slots, key=lambda x: x.position):
-        content = db.query(models.Content).filter(models.Content.slot_id == slot.id).first()
-        
         slot_dict = {
             "id": slot.id,
             "position": slot.position,
             "content_type": slot.content_type
         }
         
-        content_dict = {}
-        if content:
-            content_dict = {
-                "body": content.body,
-                "media_url": content.media_url,
-                "style_config": content.style_config or {},
-                "start_at": content.start_at.isoformat() if content.start_at else None,
-                "end_at": content.end_at.isoformat() if content.end_at else None,
-            }
-            
-        slots_data.append({"slot": slot_dict, "content": content_dict})
+        # プレイリストの各アイテム (slot.contents は表示順でロードされる)
+        items = [_content_to_dict(content) for content in slot.contents]
+        
+        # content は先頭アイテム (単一コンテンツ時代の画面互換)
+        slots_data.append({"slot": slot_dict, "content": items[0] if items else {}, "items": items})
 
     return templates.TemplateResponse("dashboard.html", {
         "request": request,
@@ -102,15 +115,42 @@ def dashboard(request: Request, db: Session = Depends(get_db)):
         "last_seen": last_seen_str
     })
 
+def _content_to_dict(content: models.Content) -> dict:
+    return {
+        "id": content.id,
+        "position": content.position,
+        "duration": content.duration,
+        "body": content.body,
+        "media_url": content.media_url,
+        "theme": content.theme,
+        "style_config": content.style_config or {},
+        "layout_config": content.layout_config or {},
+        "start_at": content.start_at.isoformat() if content.start_at else None,
+        "end_at": content.end_at.isoformat() if content.end_at else None,
+    }
+
+async def _own_slot(db: AsyncSession, slot_id: int, principal: Principal) -> Optional[models.Slot]:
+    """ログイン中のユーザーの学校のスロット (存在しない・他校のスロットの場合は None)"""
+    slot = await db.get(models.Slot, slot_id)
+    if slot is None or not principal.school_id or slot.school_id != principal.school_id:
+        return None
+    return slot
+
+def _forbidden() -> JSONResponse:
+    return JSONResponse({"detail": "Forbidden"}, status_code=status.HTTP_403_FORBIDDEN)
+
 @router.post("/update_content")
 async def update_content(
     request: Request,
     slot_id: int = Form(...),
+    # 編集対象のプレイリストアイテム (未指定時は先頭アイテム)
+    content_id: int = Form(None),
     body: str = Form(None),
     file: UploadFile = File(None),
     start_at: str = Form(None),
     end_at: str = Form(None),
     theme: str = Form("default"),
+    duration: int = Form(None),
     # スタイル設定
     style_bg_color: str = Form(None),
     style_text_color: str = Form(None),
@@ -122,21 +162,38 @@ async def update_content(
     style_align_items: str = Form(None),     
     style_flex_direction: str = Form(None),
     # 配置情報（JSON）
+    elements_json: str = Form(None),
     style_elements_layout: str = Form(None),
     # 画像削除フラグ
     delete_image: str = Form(None),
     # レンダリング済み画像
     generated_image: UploadFile = File(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    principal: Optional[Principal] = Depends(get_principal)
 ):
-    user_id = request.session.get("user_id")
-    if not user_id:
+    if not principal:
         return RedirectResponse(url="/")
+    slot = await _own_slot(db, slot_id, principal)
+    if not slot:
+        return _forbidden()
 
-    content = db.query(models.Content).filter(models.Content.slot_id == slot_id).first()
-    if not content:
-        content = models.Content(slot_id=slot_id)
-        db.add(content)
+    if content_id:
+        result = await db.execute(select(models.Content).where(
+            models.Content.id == content_id,
+            models.Content.slot_id == slot_id
+        ))
+        content = result.scalar_one_or_none()
+        if not content:
+            return RedirectResponse(url="/dashboard", status_code=status.HTTP_303_SEE_OTHER)
+    else:
+        result = await db.execute(
+            select(models.Content).where(models.Content.slot_id == slot_id).order_by(models.Content.position, models.Content.id).limit(1)
+        )
+        content = result.scalar_one_or_none()
+        if not content:
+            content = models.Content(slot_id=slot_id, position=0)
+            db.add(content)
+            await db.flush()
     
     if body is not None:
         content.body = body
@@ -156,55 +213,170 @@ async def update_content(
     else: content.end_at = None
 
     content.theme = theme
+    if duration is not None and duration > 0:
+        content.duration = duration
 
-    # スタイル情報の保存
-    current_style = dict(content.style_config or {})
+    # スタイル情報の保存 (送られてきた項目だけを変更する。値が変わらなければ列は書き換えない)
+    style_changes = {
+        "bg_color": style_bg_color,
+        "text_color": style_text_color,
+        "font_size": style_font_size,
+        "text_align": style_text_align,
+        "font_weight": style_font_weight,
+        "justify_content": style_justify_content,
+        "align_items": style_align_items,
+        "flex_direction": style_flex_direction,
+    }
+    style_changes = {k: v for k, v in style_changes.items() if v is not None}
 
-    if style_bg_color is not None: current_style["bg_color"] = style_bg_color
-    if style_text_color is not None: current_style["text_color"] = style_text_color
-    if style_font_size is not None: current_style["font_size"] = style_font_size
-    if style_text_align is not None: current_style["text_align"] = style_text_align
-    if style_font_weight is not None: current_style["font_weight"] = style_font_weight
-    if style_justify_content is not None: current_style["justify_content"] = style_justify_content
-    if style_align_items is not None: current_style["align_items"] = style_align_items
-    if style_flex_direction is not None: current_style["flex_direction"] = style_flex_direction
-
-    # 配置情報の保存
-    if style_elements_layout:
-        try:
-            layout_data = json.loads(style_elements_layout)
-            current_style["elements_layout"] = layout_data
-        except json.JSONDecodeError: pass
-    
     # レンダリング済み画像の保存処理
     if generated_image and generated_image.filename:
-        os.makedirs("static/rendered", exist_ok=True)
         timestamp = int(datetime.now().timestamp())
-        render_filename = f"render_slot_{slot_id}_{timestamp}.png"
-        render_path = f"static/rendered/{render_filename}"
-        
-        with open(render_path, "wb+") as file_object:
-            shutil.copyfileobj(generated_image.file, file_object)
-        
-        current_style["rendered_image_url"] = f"/static/rendered/{render_filename}"
+        render_filename = f"render_slot_{slot_id}_{content.id}_{timestamp}.png"
 
-    content.style_config = current_style
-    flag_modified(content, "style_config")
+        # 保存はブロッキングI/Oのためスレッドプールで実行する
+        style_changes["rendered_image_url"] = await run_in_threadpool(
+            storage.save, f"rendered/{render_filename}", generated_image.file, "image/png"
+        )
+
+    update_style(content, style_changes)
+
+    # 配置情報の保存 (エディタは elements_json、旧画面は style_elements_layout で送る)
+    layout_json = elements_json or style_elements_layout
+    if layout_json:
+        try:
+            update_layout(content, json.loads(layout_json))
+        except json.JSONDecodeError: pass
 
     # 素材画像の処理
     if delete_image == 'true':
         content.media_url = None
     elif file and file.filename:
-        os.makedirs("static", exist_ok=True)
-        filename = f"slot_{slot_id}_{file.filename}"
-        file_location = f"static/{filename}"
-        with open(file_location, "wb+") as file_object:
-            shutil.copyfileobj(file.file, file_object)
-        content.media_url = f"/static/{filename}"
+        filename = f"slot_{slot_id}_{os.path.basename(file.filename)}"
+        content.media_url = await run_in_threadpool(storage.save, filename, file.file, file.content_type)
+
+    await revisions.bump_in(db, [slot.school_id])
+    await db.commit()
+
+    # 変更した学校の端末だけに再取得させる
+    await revisions.refresh([slot.school_id])
+
+    return RedirectResponse(url="/dashboard", status_code=status.HTTP_303_SEE_OTHER)
+
+# --- プレイリスト操作 ---
+
+@router.post("/playlist/add")
+async def add_playlist_item(
+    request: Request,
+    slot_id: int = Form(...),
+    db: AsyncSession = Depends(get_async_db),
+    principal: Optional[Principal] = Depends(get_principal)
+):
+    """スロットのプレイリスト末尾に空のアイテムを追加"""
+    if not principal:
+        return RedirectResponse(url="/")
+    slot = await _own_slot(db, slot_id, principal)
+    if not slot:
+        return _forbidden()
+
+    result = await db.execute(
+        select(models.Content).where(models.Content.slot_id == slot_id).order_by(models.Content.position.desc()).limit(1)
+    )
+    last = result.scalar_one_or_none()
+    next_position = (last.position or 0) + 1 if last else 0
+
+    db.add(models.Content(slot_id=slot_id, position=next_position, body=""))
+    await revisions.bump_in(db, [slot.school_id])
+    await db.commit()
+    await revisions.refresh([slot.school_id])
+
+    return RedirectResponse(url="/dashboard", status_code=status.HTTP_303_SEE_OTHER)
+
+@router.post("/playlist/delete")
+async def delete_playlist_item(
+    request: Request,
+    content_id: int = Form(...),
+    db: AsyncSession = Depends(get_async_db),
+    principal: Optional[Principal] = Depends(get_principal)
+):
+    """プレイリストからアイテムを削除"""
+    if not principal:
+        return RedirectResponse(url="/")
 
-    db.commit()
-    db.refresh(content)
+    content = await db.get(models.Content, content_id)
+    if content:
+        slot = await _own_slot(db, content.slot_id, principal)
+        if not slot:
+            return _forbidden()
+        await db.delete(content)
+        await revisions.bump_in(db, [slot.school_id])
+        await db.commit()
+        await revisions.refresh([slot.school_id])
 
-    await manager.broadcast("RELOAD")
+    return RedirectResponse(url="/dashboard", status_code=status.HTTP_303_SEE_OTHER)
+
+@router.post("/playlist/move")
+async def move_playlist_item(
+    request: Request,
+    content_id: int = Form(...),
+    direction: str = Form(...),
+    db: AsyncSession = Depends(get_async_db),
+    principal: Optional[Principal] = Depends(get_principal)
+):
+    """アイテムの表示順を1つ前後に入れ替える (direction: up / down)"""
+    if not principal:
+        return RedirectResponse(url="/")
+
+    content = await db.get(models.Content, content_id)
+    if content:
+        slot = await _own_slot(db, content.slot_id, principal)
+        if not slot:
+            return _forbidden()
+        result = await db.execute(
+            select(models.Content).where(models.Content.slot_id == content.slot_id).order_by(models.Content.position, models.Content.id)
+        )
+        items = list(result.scalars().all())
+        idx = items.index(content)
+        swap_idx = idx - 1 if direction == "up" else idx + 1
+        if 0 <= swap_idx < len(items):
+            items[idx], items[swap_idx] = items[swap_idx], items[idx]
+            # 位置を振り直す (重複した position が残らないように)
+            for i, item in enumerate(items):
+                item.position = i
+            await revisions.bump_in(db, [slot.school_id])
+            await db.commit()
+            await revisions.refresh([slot.school_id])
+
+    return RedirectResponse(url="/dashboard", status_code=status.HTTP_303_SEE_OTHER)
 
-    return RedirectResponse(url="/dashboard", status_code=status.HTTP_303_SEE_OTHER)
\ No newline at end of file
+# --- 緊急連絡 (自校のみ) ---
+
+@router.post("/emergency/send")
+async def send_school_emergency(
+    request: Request,
+    message: str = Form(...),
+    principal: Optional[Principal] = Depends(get_principal)
+):
+    """自校の全端末に緊急連絡を直接配信する (設定の再取得を待たずに表示される)"""
+    if not principal or not principal.school_id:
+        return JSONResponse({"detail": "Forbidden"}, status_code=status.HTTP_403_FORBIDDEN)
+    if not message.strip():
+        return JSONResponse({"detail": "Message is required"}, status_code=status.HTTP_400_BAD_REQUEST)
+
+    alert = await dispatcher.send(
+        [principal.school_id], message.strip(),
+        scope=SCOPE_SCHOOL, target=principal.school_id, issued_by=principal.id,
+    )
+    return await dispatcher.report(alert.id)
+
+@router.post("/emergency/clear")
+async def clear_school_emergency(
+    request: Request,
+    alert_id: str = Form(...),
+    principal: Optional[Principal] = Depends(get_principal)
+):
+    alert = await dispatcher.get(alert_id)
+    if not principal or not alert or alert.school_ids != [principal.school_id]:
+        return JSONResponse({"detail": "Forbidden"}, status_code=status.HTTP_403_FORBIDDEN)
+    await dispatcher.clear(alert_id)
+    return await dispatcher.report(alert_id)
@@ -1,14 +1,52 @@
+import json
+
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from app.services.admission import CLOSE_TRY_AGAIN_LATER, admission, hello_message
+from app.services.emergency import MESSAGE_ACK, dispatcher
 from app.services.websocket import manager
 
 router = APIRouter()
 
+# 端末から受け取るメタデータ (クエリパラメータ)。長さは一覧表示用に制限する
+METADATA_KEYS = ("ua", "screen", "version")
+METADATA_MAX_LENGTH = 200
+DEVICE_ID_MAX_LENGTH = 64
+
+def _parse_message(text: str) -> dict:
+    """JSON 形式のメッセージ (緊急連絡の ACK など) を読む。それ以外 (PONG など) は空の dict"""
+    if not text.startswith("{"):
+        return {}
+    try:
+        message = json.loads(text)
+    except ValueError:
+        return {}
+    return message if isinstance(message, dict) else {}
+
 @router.websocket("/ws/{school_id}")
 async def websocket_endpoint(websocket: WebSocket, school_id: str):
-    await manager.connect(websocket)
+    # 再起動直後などに接続が殺到した場合は、待ち時間を伝えて切断する
+    retry_after_ms = admission.check()
+    if retry_after_ms:
+        await websocket.accept()
+        await websocket.close(code=CLOSE_TRY_AGAIN_LATER, reason=f"retry-after={retry_after_ms}")
+        return
+
+    params = websocket.query_params
+    metadata = {k: params[k][:METADATA_MAX_LENGTH] for k in METADATA_KEYS if params.get(k)}
+    device_id = (params.get("device_id") or "")[:DEVICE_ID_MAX_LENGTH] or None
+    device = await manager.connect(websocket, school_id, device_id, metadata)
     try:
+        await websocket.send_text(hello_message())
+        # 解除されていない緊急連絡があれば、接続直後に表示させる
+        await dispatcher.deliver_active(device)
         while True:
-            # メッセージ受信待機（接続維持）
-            await websocket.receive_text()
+            # PONG などの受信 = 端末が生きている (DBには書き込まない)
+            text = await websocket.receive_text()
+            manager.mark_seen(device)
+            message = _parse_message(text)
+            if message.get("type") == MESSAGE_ACK:
+                dispatcher.ack(str(message.get("alert_id")), device)
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
\ No newline at end of file
+        pass
+    finally:
+        manager.disconnect(device)
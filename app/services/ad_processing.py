@@ -0,0 +1,229 @@
+"""
+広告申請の画像処理キュー
+
+申請 (portal) では元画像を保存して PROCESSING の広告を登録するだけにし、
+画像の検証・メタデータ (EXIF の位置情報など) の除去・配信用画像と審査用サムネイルの作成は
+ワーカースレッドで行う。完了すると PENDING (審査待ち) になる。
+
+ストレージは公開配信されるため、元画像 (EXIF などのメタデータを含む) は処理が終わり次第 (却下時も) 削除する。
+処理待ちの間も推測されないよう、元画像のファイル名はランダムにする (app/routers/portal/application.py)。
+"""
+import io
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional, Set, Tuple
+
+from PIL import Image, ImageOps
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models import models
+from app.services.metrics import Counter, Gauge, Histogram, registry
+from app.services.scheduler import acquire_lease
+from app.services.storage import StorageError, storage
+
+logger = logging.getLogger(__name__)
+
+AD_PROCESSING_TOTAL = registry.register(Counter(
+    "signage_ad_processing_total", "Ad image processing runs by outcome", ("outcome",)))
+AD_PROCESSING_DURATION = registry.register(Histogram(
+    "signage_ad_processing_duration_seconds", "Ad image processing time",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)))
+
+# ストレージ上の保存先
+ORIGINAL_PREFIX = "ads/originals"
+DERIVATIVE_PREFIX = "ads"
+
+# 処理途中の広告の再投入を1ワーカーだけが行うためのリース (同時に起動したワーカーはこの秒数の間は再投入しない)
+RESUME_LEASE_NAME = "ad_queue_resume"
+RESUME_LEASE_SECONDS = 60
+
+# 先頭バイトによる形式判定 (Pillow で開く前の検証用)
+SIGNATURES = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+
+
+class ImageRejected(Exception):
+    """申請された画像が使えない (理由をそのまま審査画面に表示する)"""
+
+
+@dataclass
+class ProcessedImage:
+    display: bytes
+    display_ext: str
+    thumbnail: bytes
+
+
+def sniff_format(data: bytes) -> Optional[str]:
+    for signature, fmt in SIGNATURES:
+        if data.startswith(signature):
+            return fmt
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def _encode(image, max_size: int) -> Tuple[bytes, str]:
+    image = image.copy()
+    image.thumbnail((max_size, max_size))
+    out = io.BytesIO()
+    # 透過のある画像は PNG、それ以外は JPEG。どちらもメタデータは付けずに保存する
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        image.save(out, "PNG", optimize=True)
+        return out.getvalue(), "png"
+    image.convert("RGB").save(out, "JPEG", quality=85, optimize=True, progressive=True)
+    return out.getvalue(), "jpg"
+
+
+def process_image(data: bytes) -> ProcessedImage:
+    """画像を検証し、配信用画像とサムネイルを作る (CPU を使うためワーカースレッドで実行する)"""
+    if len(data) > settings.AD_MAX_UPLOAD_BYTES:
+        raise ImageRejected(f"ファイルサイズが上限 ({settings.AD_MAX_UPLOAD_BYTES // (1024 * 1024)}MB) を超えています")
+    fmt = sniff_format(data)
+    if fmt is None:
+        raise ImageRejected("画像ファイル (JPEG / PNG / GIF / WebP) ではありません")
+
+    try:
+        with Image.open(io.BytesIO(data)) as probe:
+            if probe.width * probe.height > settings.AD_MAX_PIXELS:
+                raise ImageRejected("画像の解像度が大きすぎます")
+            # 壊れたファイルの検出 (verify の後は再度開き直す必要がある)
+            probe.verify()
+        with Image.open(io.BytesIO(data)) as image:
+            image.load()
+            # 向きは EXIF に従って回転してから、EXIF ごと捨てる
+            image = ImageOps.exif_transpose(image)
+            display, ext = _encode(image, settings.AD_DISPLAY_MAX_SIZE)
+            thumbnail, _ = _encode(image, settings.AD_THUMBNAIL_SIZE)
+    except ImageRejected:
+        raise
+    except Exception:
+        raise ImageRejected("画像を読み込めませんでした (破損している可能性があります)")
+    return ProcessedImage(display=display, display_ext=ext, thumbnail=thumbnail)
+
+
+def _read(key: str) -> bytes:
+    buffer = bytearray()
+    for chunk in storage.open(key):
+        buffer.extend(chunk)
+        if len(buffer) > settings.AD_MAX_UPLOAD_BYTES:
+            # 上限を超えた時点で読むのをやめる
+            break
+    return bytes(buffer)
+
+
+def _discard_original(key: Optional[str]) -> None:
+    if key is None:
+        return
+    try:
+        storage.delete(key)
+    except (StorageError, OSError):
+        # 残った元画像は定期ジョブ (cleanup_media) が削除する
+        logger.warning("failed to remove original image %s", key)
+
+
+def process_ad(ad_id: int) -> str:
+    """広告1件の画像を処理して結果 (ok / rejected / skipped) を返す"""
+    db = SessionLocal()
+    try:
+        ad = db.get(models.Ad, ad_id)
+        if not ad or ad.status != models.AdStatus.PROCESSING:
+            return "skipped"
+        key = storage.key_for(ad.original_url)
+        try:
+            if key is None:
+                raise ImageRejected("元画像が見つかりません")
+            result = process_image(_read(key))
+        except ImageRejected as e:
+            ad.status = models.AdStatus.REJECTED
+            ad.processing_error = str(e)
+            ad.original_url = None
+            db.commit()
+            _discard_original(key)
+            return "rejected"
+
+        stem = os.path.splitext(os.path.basename(key))[0]
+        ad.media_url = storage.save(f"{DERIVATIVE_PREFIX}/{stem}.{result.display_ext}", io.BytesIO(result.display))
+        ad.thumbnail_url = storage.save(f"{DERIVATIVE_PREFIX}/thumbs/{stem}.{result.display_ext}",
+                                        io.BytesIO(result.thumbnail))
+        ad.processing_error = None
+        ad.status = models.AdStatus.PENDING
+        ad.original_url = None
+        db.commit()
+        _discard_original(key)
+        return "ok"
+    finally:
+        db.close()
+
+
+class AdProcessingQueue:
+    """広告IDを受け取り、ワーカースレッドで順に処理する"""
+
+    def __init__(self):
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: Set[int] = set()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=settings.AD_PROCESSING_WORKERS,
+                                                thread_name_prefix="ad-processing")
+        return self._executor
+
+    def enqueue(self, ad_id: int) -> None:
+        if ad_id in self._pending:
+            return
+        self._pending.add(ad_id)
+        future = self._get_executor().submit(self._run, ad_id)
+        future.add_done_callback(lambda f: self._pending.discard(ad_id))
+
+    def _run(self, ad_id: int) -> None:
+        start = time.perf_counter()
+        try:
+            outcome = process_ad(ad_id)
+        except Exception:
+            # ストレージ・DB の一時的なエラー。PROCESSING のまま残し、次回起動時に再処理する
+            logger.exception("ad %s: processing failed", ad_id)
+            outcome = "error"
+        AD_PROCESSING_DURATION.observe(time.perf_counter() - start)
+        AD_PROCESSING_TOTAL.inc(outcome=outcome)
+
+    def resume(self) -> int:
+        """
+        処理途中で停止した (PROCESSING のまま残っている) 広告を再投入する。
+        全ワーカーが起動時に呼ぶため、リースを取得できた1ワーカーだけが再投入する (同じ広告を重複して処理しない)
+        """
+        if not acquire_lease(RESUME_LEASE_NAME, RESUME_LEASE_SECONDS):
+            return 0
+        db = SessionLocal()
+        try:
+            ids = [ad_id for (ad_id,) in db.query(models.Ad.id).filter(models.Ad.status == models.AdStatus.PROCESSING)]
+        finally:
+            db.close()
+        for ad_id in ids:
+            self.enqueue(ad_id)
+        return len(ids)
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self._pending.clear()
+
+# シングルトンインスタンスとして公開
+ad_queue = AdProcessingQueue()
+
+registry.register(Gauge(
+    "signage_ad_processing_pending", "Ads waiting for image processing",
+    collect=lambda: {(): ad_queue.pending()},
+))
@@ -0,0 +1,133 @@
+"""
+WebSocket 接続の受け入れ制御
+
+デプロイ・再起動の直後は全端末が一斉に再接続してくるため、受け入れる速さを
+WS_ACCEPT_RATE (接続/秒) に制限し、超えた端末には再接続までの待ち時間を返して切断する。
+待ち時間は拒否した順に 1/WS_ACCEPT_RATE 秒ずつずらして割り当てるため、
+戻ってくる接続も一定の速さに均される (WS_BACKOFF_MAX_MS を超える分はその範囲内でばらけさせる)。
+速さと上限のデフォルトは、起動時に学校数 (端末数の見込み) とワーカー数から決める。
+上限は端末数の一部に抑え、起動直後はその一部しか受け入れない状態から始めるため、
+再起動直後の殺到も最初から一定の速さに均される。
+"""
+import json
+import random
+import time
+
+from app.core.config import settings
+from app.services.metrics import Counter, registry
+
+WS_ADMISSION_TOTAL = registry.register(Counter(
+    "signage_ws_admission_total", "WebSocket connection attempts by admission result", ("result",)))
+
+# 混雑による切断 (RFC 6455 の 1013 Try Again Later)。理由に "retry-after=<ミリ秒>" を入れる
+CLOSE_TRY_AGAIN_LATER = 1013
+# サーバー再起動による切断 (1012 Service Restart)
+CLOSE_SERVICE_RESTART = 1012
+
+MESSAGE_HELLO = "HELLO"
+MESSAGE_RECONNECT = "RECONNECT"
+
+
+# 受け入れ制御の下限 (端末数の見込みが少ない場合もこれ以上は受け入れる)。全ワーカーの合計
+MIN_ACCEPT_RATE = 50.0
+MIN_ACCEPT_BURST = 100
+# 瞬間的に受け入れる上限のデフォルト: 端末数に対する割合と、その上限 (全ワーカーの合計)
+ACCEPT_BURST_RATIO = 0.05
+MAX_ACCEPT_BURST = 500
+# 起動時に受け入れられる量 (上限に対する割合)。残りは WS_ACCEPT_RATE の速さで回復する
+INITIAL_BURST_RATIO = 0.25
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int, max_wait: float):
+        self.rate = rate
+        self.burst = burst
+        # 拒否した接続に返す待ち時間の上限 (秒)
+        self.max_wait = max_wait
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        # 拒否した接続に割り当てた最後の再接続時刻
+        self._next_slot = 0.0
+
+    def try_acquire(self) -> float:
+        """受け入れる場合は 0、拒否する場合は再接続までの秒数を返す"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= self.burst:
+            # 満タンまで回復した = 殺到は収まっている。割り当て済みの枠は忘れる
+            self._next_slot = 0.0
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        slot = max(self._next_slot, now + (1 - self.tokens) / self.rate) + 1 / self.rate
+        if slot - now > self.max_wait:
+            # 殺到が続いて枠が上限を超えた: 枠を進めず、上限の後半にばらけさせる
+            return random.uniform(self.max_wait / 2, self.max_wait)
+        self._next_slot = slot
+        return slot - now
+
+
+class Admission:
+    def __init__(self):
+        self.bucket = TokenBucket(MIN_ACCEPT_RATE, MIN_ACCEPT_BURST, settings.WS_BACKOFF_MAX_MS / 1000)
+        self.configure(0)
+        # 終了処理中は新しい接続を受け入れない
+        self.draining = False
+
+    def configure(self, school_count: int) -> None:
+        """
+        このワーカーの受け入れの速さと上限を決める (起動時に学校数を渡して呼ぶ)。
+        WS_ACCEPT_RATE / WS_ACCEPT_BURST (ワーカーごとの値) が指定されていればそれを使う
+        """
+        workers = max(settings.WEB_CONCURRENCY, 1)
+        devices = school_count * settings.WS_DEVICES_PER_SCHOOL
+        burst = settings.WS_ACCEPT_BURST or max(
+            1, max(MIN_ACCEPT_BURST, min(MAX_ACCEPT_BURST, int(devices * ACCEPT_BURST_RATIO))) // workers)
+        rate = settings.WS_ACCEPT_RATE or (
+            max(MIN_ACCEPT_RATE, devices / max(settings.WS_RESTART_SPREAD_SECONDS, 1)) / workers)
+        self.bucket.rate = rate
+        self.bucket.burst = burst
+        self.bucket.tokens = max(1.0, burst * INITIAL_BURST_RATIO)
+        self.bucket.updated_at = time.monotonic()
+
+    def check(self) -> int:
+        """受け入れる場合は 0、拒否する場合は再接続までのミリ秒を返す"""
+        if self.draining:
+            WS_ADMISSION_TOTAL.inc(result="draining")
+            return restart_delay_ms()
+        wait = self.bucket.try_acquire()
+        if not wait:
+            WS_ADMISSION_TOTAL.inc(result="accepted")
+            return 0
+        WS_ADMISSION_TOTAL.inc(result="rejected")
+        return max(int(wait * 1000), 1)
+
+
+def restart_delay_ms() -> int:
+    """再起動後に端末ごとにずらして再接続させる待ち時間"""
+    return random.randint(0, settings.WS_RESTART_SPREAD_SECONDS * 1000)
+
+
+def hello_message() -> str:
+    """
+    接続直後に送る再接続のパラメーター。端末はこれを保存し、
+    サーバーに接続できないときの指数バックオフ (full jitter) に使う。
+    """
+    return json.dumps({
+        "type": MESSAGE_HELLO,
+        "backoff": {
+            "base_ms": settings.WS_BACKOFF_BASE_MS,
+            "max_ms": settings.WS_BACKOFF_MAX_MS,
+            # 再起動 (1012) で切断されたときに再接続を分散させる幅
+            "restart_spread_ms": settings.WS_RESTART_SPREAD_SECONDS * 1000,
+        },
+        "ping_interval_ms": settings.WS_PING_INTERVAL_SECONDS * 1000,
+    })
+
+
+def reconnect_message() -> str:
+    return json.dumps({"type": MESSAGE_RECONNECT, "after_ms": restart_delay_ms()})
+
+# シングルトンインスタンスとして公開
+admission = Admission()
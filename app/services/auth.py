@@ -0,0 +1,196 @@
+import asyncio
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional, Tuple
+
+from fastapi import Depends, Request
+from passlib.context import CryptContext
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import get_async_db
+from app.models import models
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+class AuthBusyError(Exception):
+    """ハッシュ計算の待ち行列が上限に達している (ログイン集中時)"""
+
+
+# --- パスワードハッシュ (専用の上限付きエグゼキュータで実行) ---
+# bcrypt は1回 100〜300ms かかるため、イベントループや Starlette の共有スレッドプールで
+# 実行すると表示APIまで巻き込んで遅くなる。専用のワーカーに隔離して同時実行数を制限する。
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+def _hash(plain_password: str) -> str:
+    return pwd_context.hash(plain_password)
+
+_executor: Optional[Executor] = None
+_pending = 0
+
+def _get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        if settings.AUTH_HASH_EXECUTOR == "process":
+            # GIL の影響を受けない別プロセスで計算する
+            _executor = ProcessPoolExecutor(max_workers=settings.AUTH_HASH_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=settings.AUTH_HASH_WORKERS, thread_name_prefix="auth-hash")
+    return _executor
+
+async def _run_bounded(func, *args):
+    global _pending
+    if _pending >= settings.AUTH_HASH_MAX_PENDING:
+        raise AuthBusyError()
+    _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_executor(), func, *args)
+    finally:
+        _pending -= 1
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    if not hashed_password:
+        return False
+    return await _run_bounded(_verify, plain_password, hashed_password)
+
+async def hash_password(plain_password: str) -> str:
+    return await _run_bounded(_hash, plain_password)
+
+def shutdown_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+# --- ログイン試行回数の制限 ---
+
+class LoginRateLimiter:
+    """
+    一定時間内の失敗回数でキー (IPアドレス / ユーザー名) ごとにロックする。
+    プロセス内メモリのみで管理するため、ワーカーごとに独立してカウントされる。
+    """
+
+    def __init__(self, max_failures: int, window_seconds: int):
+        self.max_failures = max_failures
+        self.window_seconds = window_seconds
+        self._failures: Dict[str, Deque[float]] = defaultdict(deque)
+
+    def _prune(self, key: str, now: float) -> Deque[float]:
+        attempts = self._failures[key]
+        while attempts and attempts[0] <= now - self.window_seconds:
+            attempts.popleft()
+        if not attempts:
+            del self._failures[key]
+        return attempts
+
+    def retry_after(self, key: str) -> int:
+        """ロック中なら解除までの秒数、ロックされていなければ 0"""
+        now = time.monotonic()
+        attempts = self._prune(key, now)
+        if len(attempts) < self.max_failures:
+            return 0
+        return int(attempts[0] + self.window_seconds - now) + 1
+
+    def record_failure(self, key: str) -> None:
+        self._failures[key].append(time.monotonic())
+
+    def reset(self, key: str) -> None:
+        self._failures.pop(key, None)
+
+ip_limiter = LoginRateLimiter(settings.LOGIN_MAX_FAILURES_PER_IP, settings.LOGIN_FAILURE_WINDOW_SECONDS)
+user_limiter = LoginRateLimiter(settings.LOGIN_MAX_FAILURES_PER_USER, settings.LOGIN_FAILURE_WINDOW_SECONDS)
+
+
+# --- ログイン中ユーザー (Principal) の解決 ---
+
+@dataclass(frozen=True)
+class Principal:
+    """認可判定に必要な最小限のユーザー情報"""
+    id: int
+    role: str
+    school_id: Optional[str]
+
+    @property
+    def is_super_admin(self) -> bool:
+        return self.role == models.UserRole.SUPER_ADMIN
+
+    def has_role(self, *roles: str) -> bool:
+        return self.role in roles
+
+    @classmethod
+    def from_user(cls, user: models.User) -> "Principal":
+        return cls(id=user.id, role=user.role, school_id=user.school_id)
+
+
+class PrincipalCache:
+    """
+    user_id -> Principal の短期キャッシュ (プロセス内)。
+    ユーザーの更新・削除時は invalidate() で即座に破棄し、
+    他のワーカーでの変更は TTL 経過で反映される。
+    """
+
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[int, Tuple[float, Principal]] = {}
+
+    def get(self, user_id: int) -> Optional[Principal]:
+        entry = self._entries.get(user_id)
+        if not entry:
+            return None
+        expires_at, principal = entry
+        if expires_at < time.monotonic():
+            self._entries.pop(user_id, None)
+            return None
+        return principal
+
+    def set(self, principal: Principal) -> None:
+        self._entries[principal.id] = (time.monotonic() + self.ttl_seconds, principal)
+
+    def invalidate(self, user_id: int) -> None:
+        self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+principal_cache = PrincipalCache(settings.PRINCIPAL_CACHE_TTL_SECONDS)
+
+def resolve_principal(request: Request, db: Session) -> Optional[Principal]:
+    """セッションのユーザーを解決する (同期版)。キャッシュにあればDBを参照しない"""
+    user_id = request.session.get("user_id")
+    if not user_id:
+        return None
+    principal = principal_cache.get(user_id)
+    if principal:
+        return principal
+    user = db.get(models.User, user_id)
+    if not user:
+        return None
+    principal = Principal.from_user(user)
+    principal_cache.set(principal)
+    return principal
+
+async def get_principal(request: Request, db: AsyncSession = Depends(get_async_db)) -> Optional[Principal]:
+    """
+    セッションのユーザーを解決する (非同期版)。
+    ルーターでは principal: Optional[Principal] = Depends(get_principal) として使用します。
+    """
+    user_id = request.session.get("user_id")
+    if not user_id:
+        return None
+    principal = principal_cache.get(user_id)
+    if principal:
+        return principal
+    user = await db.get(models.User, user_id)
+    if not user:
+        return None
+    principal = Principal.from_user(user)
+    principal_cache.set(principal)
+    return principal
@@ -0,0 +1,129 @@
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import models
+from app.services.content_style import update_style
+from app.services.revisions import revisions
+from app.services.storage import storage
+
+# 一括更新で変更できるスタイル項目 (update_content のフォーム項目と同じキー)
+STYLE_KEYS = ("bg_color", "text_color", "font_size", "text_align", "font_weight")
+
+# 共有素材の保存先 (ストレージ上のキーの接頭辞)
+BULK_ASSET_PREFIX = "bulk"
+
+
+def parse_form_datetime(value: Optional[str]) -> Optional[datetime]:
+    """フォームの日時 (datetime-local 形式 / スペース区切り) を変換する。不正値は None"""
+    if not value:
+        return None
+    fmt = "%Y-%m-%dT%H:%M" if "T" in value else "%Y-%m-%d %H:%M"
+    try:
+        return datetime.strptime(value, fmt)
+    except ValueError:
+        return None
+
+
+def save_shared_asset(src, filename: str) -> str:
+    """
+    一括配信用の素材を1回だけ保存し、全校で共有する URL を返す。
+    (学校・スロットごとにファイルを複製しない)
+    """
+    safe_name = re.sub(r"[^A-Za-z0-9._-]", "_", os.path.basename(filename))
+    stored_name = f"{int(datetime.now().timestamp())}_{safe_name}"
+    return storage.save(f"{BULK_ASSET_PREFIX}/{stored_name}", src)
+
+
+@dataclass
+class BulkChange:
+    """全対象スロットに適用する変更 (None の項目は変更しない)"""
+    body: Optional[str] = None
+    theme: Optional[str] = None
+    start_at: Optional[datetime] = None
+    end_at: Optional[datetime] = None
+    # True の場合、start_at / end_at を (None も含めて) そのまま設定する
+    update_schedule: bool = False
+    duration: Optional[int] = None
+    media_url: Optional[str] = None
+    style: Dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class BulkResult:
+    school_ids: List[str] = field(default_factory=list)
+    updated: int = 0
+    created: int = 0
+
+
+def _apply(content: models.Content, change: BulkChange) -> None:
+    if change.body is not None:
+        content.body = change.body
+    if change.theme is not None:
+        content.theme = change.theme
+    if change.update_schedule:
+        content.start_at = change.start_at
+        content.end_at = change.end_at
+    if change.duration:
+        content.duration = change.duration
+    if change.media_url is not None:
+        content.media_url = change.media_url
+    style_changes = dict(change.style)
+    if change.body is not None or change.media_url is not None:
+        # 学校ごとに描画済みの画像が残っていると新しい文面・画像が表示されないため破棄する
+        style_changes.update(rendered_image_url=None, slides=None)
+    update_style(content, style_changes)
+
+
+async def apply_bulk_change(db: AsyncSession, school_ids: List[str], content_types: List[str],
+                            change: BulkChange) -> BulkResult:
+    """
+    指定した学校・スロット種別の先頭アイテムに同じ変更を適用する。
+    対象の取得は2クエリ、書き込み (リビジョンの更新を含む) は1トランザクションで行い、
+    コミット後に変更のあった学校へだけ RELOAD を送る。
+    """
+    result = BulkResult()
+    if not school_ids or not content_types:
+        return result
+
+    slots = (await db.execute(
+        select(models.Slot)
+        .where(models.Slot.school_id.in_(school_ids), models.Slot.content_type.in_(content_types))
+    )).scalars().all()
+    if not slots:
+        return result
+
+    # 各スロットの先頭アイテム (position, id の最小) を1クエリで取得
+    head_by_slot: Dict[int, models.Content] = {}
+    contents = (await db.execute(
+        select(models.Content)
+        .where(models.Content.slot_id.in_([s.id for s in slots]))
+        .order_by(models.Content.slot_id, models.Content.position, models.Content.id)
+    )).scalars()
+    for content in contents:
+        head_by_slot.setdefault(content.slot_id, content)
+
+    affected = set()
+    for slot in slots:
+        content = head_by_slot.get(slot.id)
+        if content is None:
+            content = models.Content(slot_id=slot.id, position=0, style_config={})
+            db.add(content)
+            result.created += 1
+        else:
+            result.updated += 1
+        _apply(content, change)
+        affected.add(slot.school_id)
+
+    result.school_ids = sorted(affected)
+    # リビジョンは変更と同じトランザクションで、対象校まとめて1文で進める
+    await revisions.bump_in(db, result.school_ids)
+    await db.commit()
+    # 対象校の端末 (全ワーカー) に RELOAD が送られる
+    await revisions.refresh(result.school_ids)
+    return result
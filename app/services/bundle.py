@@ -0,0 +1,318 @@
+"""
+オフライン用バンドル (表示設定 + 参照しているメディア一式を1つのアーカイブにまとめたもの)
+
+端末・現地の中継機は起動時にバンドルを1回取得すれば、個別の /config やメディアの取得なしで表示できる。
+アーカイブは tar 形式で、先頭から順に次のファイルを含む。
+
+    manifest.json   バンドルID・表示設定と各メディアの SHA-256 / サイズ / 配信URL
+    manifest.sig    manifest.json の HMAC-SHA256 (BUNDLE_SIGNING_KEY が設定されている場合のみ)
+    config.json     /v1/display/config と同じ内容
+    media/<キー>    メディア本体
+
+manifest.json が先頭にあるため、受信側はストリームのまま各ファイルを検証できる。
+base (前回取得したバンドルID) を渡すと、前回から変わっていないメディアを省いた差分バンドルを返す
+(省いたファイルも manifest.json には載り、"included": false になる)。
+"""
+import hashlib
+import hmac
+import json
+import tarfile
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models import models
+from app.services.display_config import build_display_config
+from app.services.metrics import Counter, registry
+from app.services.revisions import revisions
+from app.services.storage import StorageError, guess_content_type, storage
+
+BUNDLE_FORMAT = 1
+MANIFEST_NAME = "manifest.json"
+SIGNATURE_NAME = "manifest.sig"
+CONFIG_NAME = "config.json"
+MEDIA_DIR = "media"
+
+# 表示設定の中でメディアの URL が入る項目
+MEDIA_FIELDS = ("media_url", "rendered_image_url", "slideshow")
+
+# tar のブロックサイズ
+BLOCK_SIZE = 512
+
+# ハッシュを覚えておくメディアの数
+DIGEST_CACHE_SIZE = 4096
+
+BUNDLE_REQUESTS_TOTAL = registry.register(Counter(
+    "signage_bundle_requests_total", "Offline bundle requests by kind", ("kind",)))
+BUNDLE_BYTES_TOTAL = registry.register(Counter(
+    "signage_bundle_media_bytes_total", "Media bytes sent in offline bundles"))
+
+
+@dataclass
+class Asset:
+    key: str
+    url: str
+    sha256: str
+    size: int
+    included: bool = True
+
+    @property
+    def path(self) -> str:
+        return f"{MEDIA_DIR}/{self.key}"
+
+    def to_dict(self) -> dict:
+        return {
+            "path": self.path,
+            "url": self.url,
+            "sha256": self.sha256,
+            "size": self.size,
+            "content_type": guess_content_type(self.key),
+            "included": self.included,
+        }
+
+
+@dataclass
+class Bundle:
+    bundle_id: str
+    manifest: bytes
+    signature: Optional[bytes]
+    config: bytes
+    assets: List[Asset]
+    # 差分の基準にしたバンドルID (完全なバンドルの場合は None)
+    base: Optional[str] = None
+
+
+class DigestCache:
+    """
+    メディアの SHA-256 を、ストレージ上の版 (サイズ・更新日時 / ETag) が変わるまで覚えておく。
+    バンドルを作るたびに全メディアを読み直さないため
+    """
+
+    def __init__(self, size: int = DIGEST_CACHE_SIZE):
+        self.size = size
+        self._entries: "OrderedDict[str, Tuple[Tuple[int, str], str]]" = OrderedDict()
+
+    def digest(self, key: str) -> Optional[Tuple[str, int]]:
+        """(SHA-256, サイズ)。ファイルがなければ None"""
+        version = storage.stat(key)
+        if version is None:
+            return None
+        cached = self._entries.get(key)
+        if cached and cached[0] == version:
+            self._entries.move_to_end(key)
+            return cached[1], version[0]
+        h = hashlib.sha256()
+        try:
+            for chunk in storage.open(key):
+                h.update(chunk)
+        except StorageError:
+            return None
+        self._entries[key] = (version, h.hexdigest())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+        return h.hexdigest(), version[0]
+
+
+class ManifestHistory:
+    """差分の基準にするため、最近作ったバンドルのメディア一覧 (パス -> SHA-256) を覚えておく"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._entries: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+
+    def get(self, bundle_id: Optional[str]) -> Optional[Dict[str, str]]:
+        if not bundle_id:
+            return None
+        return self._entries.get(bundle_id)
+
+    def add(self, bundle_id: str, assets: List[Asset]) -> None:
+        self._entries[bundle_id] = {a.path: a.sha256 for a in assets}
+        self._entries.move_to_end(bundle_id)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+
+digests = DigestCache()
+history = ManifestHistory(settings.BUNDLE_MANIFEST_HISTORY)
+
+
+def media_keys(config: dict) -> List[str]:
+    """表示設定が参照しているメディアのストレージ上のキー (重複なし・出現順)"""
+    keys: List[str] = []
+
+    def add(url) -> None:
+        key = storage.key_for(url) if isinstance(url, str) else None
+        if key and key not in keys:
+            keys.append(key)
+
+    def walk(node) -> None:
+        if isinstance(node, dict):
+            for name, value in node.items():
+                if name in MEDIA_FIELDS:
+                    for url in value if isinstance(value, list) else [value]:
+                        add(url)
+                else:
+                    walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(config)
+    return keys
+
+
+def sign(data: bytes) -> Optional[bytes]:
+    if not settings.BUNDLE_SIGNING_KEY:
+        return None
+    return hmac.new(settings.BUNDLE_SIGNING_KEY.encode(), data, hashlib.sha256).hexdigest().encode()
+
+
+def verify(manifest: bytes, signature: bytes) -> bool:
+    """manifest.sig の検証 (中継機などで使う)"""
+    expected = sign(manifest)
+    return expected is not None and hmac.compare_digest(expected, signature.strip())
+
+
+def _dumps(data: dict) -> bytes:
+    return json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode()
+
+
+def _build(school_id: str, config: dict, base: Optional[str]) -> Bundle:
+    """マニフェストを組み立てる (メディアのハッシュ計算でストレージを読むため、スレッドプールで呼ぶ)"""
+    config_bytes = _dumps(config)
+    assets = []
+    for key in media_keys(config):
+        digest = digests.digest(key)
+        if digest is None:
+            # 削除済みのメディアは含めない (プレイヤーは表示できない項目として扱う)
+            continue
+        assets.append(Asset(key=key, url=storage.public_url(storage.url_for(key)), sha256=digest[0], size=digest[1]))
+
+    # バンドルIDは内容から決める (同じ内容なら同じID)
+    content_hash = hashlib.sha256(config_bytes)
+    for asset in assets:
+        content_hash.update(f"\n{asset.path}\0{asset.sha256}".encode())
+    bundle_id = content_hash.hexdigest()
+
+    base_files = history.get(base)
+    if base_files is None:
+        # 不明な base (再起動後・別ワーカーで作られたものなど) は完全なバンドルにする
+        base = None
+    else:
+        for asset in assets:
+            asset.included = base_files.get(asset.path) != asset.sha256
+    history.add(bundle_id, assets)
+
+    manifest = _dumps({
+        "format": BUNDLE_FORMAT,
+        "bundle_id": bundle_id,
+        "base": base,
+        "school_id": school_id,
+        "revision": config.get("revision"),
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "path": CONFIG_NAME,
+            "sha256": hashlib.sha256(config_bytes).hexdigest(),
+            "size": len(config_bytes),
+        },
+        "assets": [a.to_dict() for a in assets],
+    })
+    return Bundle(bundle_id=bundle_id, manifest=manifest, signature=sign(manifest),
+                  config=config_bytes, assets=assets, base=base)
+
+
+async def build_bundle(school_id: str, base: Optional[str] = None) -> Optional[Bundle]:
+    """学校のバンドルを組み立てる (学校が存在しなければ None)。メディア本体は stream() で読む"""
+    revision = revisions.current(school_id)
+    # 中継機が代理で取得する場合もあるため、稼働履歴 (heartbeat) には記録しない
+    async with AsyncSessionLocal() as db:
+        school = await db.get(models.School, school_id)
+        if not school:
+            return None
+        config = await build_display_config(db, school)
+    config["revision"] = revision
+
+    bundle = await run_in_threadpool(_build, school_id, config, base)
+    BUNDLE_REQUESTS_TOTAL.inc(kind="delta" if bundle.base else "full")
+    return bundle
+
+
+def _header(name: str, size: int, mtime: float) -> bytes:
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    return info.tobuf(format=tarfile.PAX_FORMAT)
+
+
+def _padding(size: int) -> bytes:
+    return b"\0" * (-size % BLOCK_SIZE)
+
+
+def stream(bundle: Bundle) -> Iterator[bytes]:
+    """
+    バンドルを tar 形式で少しずつ返す (全体をメモリやディスクに作らない)。
+    ストレージの読み出しはブロッキングのため、同期イテレータとしてスレッドプールで回す
+    """
+    now = time.time()
+    small_files = [(MANIFEST_NAME, bundle.manifest)]
+    if bundle.signature is not None:
+        small_files.append((SIGNATURE_NAME, bundle.signature))
+    small_files.append((CONFIG_NAME, bundle.config))
+    for name, data in small_files:
+        yield _header(name, len(data), now) + data + _padding(len(data))
+
+    for asset in bundle.assets:
+        if not asset.included:
+            continue
+        yield _header(asset.path, asset.size, now)
+        written = 0
+        h = hashlib.sha256()
+        for chunk in storage.open(asset.key):
+            written += len(chunk)
+            if written > asset.size:
+                break
+            h.update(chunk)
+            yield chunk
+        if written != asset.size or h.hexdigest() != asset.sha256:
+            # マニフェスト作成後に差し替えられた: 壊れたアーカイブとして途中で打ち切り、受信側に再取得させる
+            raise StorageError(f"media changed while streaming: {asset.key}")
+        BUNDLE_BYTES_TOTAL.inc(asset.size)
+        yield _padding(asset.size)
+
+    # アーカイブの終端
+    yield b"\0" * (BLOCK_SIZE * 2)
+
+
+def read_bundle(fileobj) -> Tuple[dict, Dict[str, bytes]]:
+    """
+    バンドルを読み、ハッシュ (と署名鍵が設定されていれば署名) を検証する (中継機・動作確認用)。
+    戻り値は (マニフェスト, {パス: 内容})。検証に失敗すると ValueError
+    """
+    files: Dict[str, bytes] = {}
+    with tarfile.open(fileobj=fileobj, mode="r|") as tar:
+        for member in tar:
+            f = tar.extractfile(member)
+            if f is not None:
+                files[member.name] = f.read()
+
+    manifest_bytes = files.get(MANIFEST_NAME)
+    if manifest_bytes is None:
+        raise ValueError("manifest.json がありません")
+    if settings.BUNDLE_SIGNING_KEY and not verify(manifest_bytes, files.get(SIGNATURE_NAME, b"")):
+        raise ValueError("署名が一致しません")
+    manifest = json.loads(manifest_bytes)
+
+    entries = [manifest["config"]] + [a for a in manifest["assets"] if a["included"]]
+    for entry in entries:
+        data = files.get(entry["path"])
+        if data is None or hashlib.sha256(data).hexdigest() != entry["sha256"]:
+            raise ValueError(f"{entry['path']} のハッシュが一致しません")
+    return manifest, files
@@ -0,0 +1,206 @@
+"""
+コンテンツのスタイル設定
+
+    Content.style_config  表示に使う項目 (背景色・文字色など) と描画済み画像。値のある項目だけを保存する
+    Content.layout_config エディタ上の要素の配置 (ダッシュボードでのみ使い、プレイヤーには送らない)
+
+どちらも保存前にここで定義した項目・値の形式で検証する。未知の項目や不正な値は保存しないため、
+1件あたりのサイズには上限がある。update_style() / update_layout() は値が変わった場合だけ列を書き換える
+(変わらない列は UPDATE 文に含まれない)。
+"""
+import math
+import re
+from typing import Callable, Dict, Optional
+
+from sqlalchemy.orm.attributes import flag_modified
+
+from app.models import models
+
+# 旧形式の複数スライドの上限枚数
+MAX_SLIDES = 20
+# 文字列項目の最大長
+MAX_URL_LENGTH = 500
+
+_COLOR_RE = re.compile(r"^(#[0-9a-fA-F]{3,8}|rgba?\([0-9.,%\s/]{1,40}\)|[a-zA-Z]{1,20})$")
+_SIZE_RE = re.compile(r"^\d{1,4}(\.\d{1,3})?(px|rem|em|%|vw|vh|pt)$")
+
+
+def _color(value) -> Optional[str]:
+    value = str(value).strip()
+    return value if _COLOR_RE.match(value) else None
+
+
+def _size(value) -> Optional[str]:
+    value = str(value).strip()
+    return value if _SIZE_RE.match(value) else None
+
+
+def _choice(*options: str) -> Callable[[object], Optional[str]]:
+    def validate(value) -> Optional[str]:
+        value = str(value).strip()
+        return value if value in options else None
+    return validate
+
+
+def _media_url(value) -> Optional[str]:
+    value = str(value).strip()
+    if len(value) > MAX_URL_LENGTH or not value.startswith(("/", "http://", "https://")):
+        return None
+    return value
+
+
+_FONT_WEIGHTS = ("normal", "bold", "bolder", "lighter") + tuple(str(w) for w in range(100, 1000, 100))
+_TEXT_ALIGNS = ("left", "center", "right", "justify", "start", "end")
+
+# style_config に保存できる項目 (項目名 -> 検証関数。不正な値なら None を返す)
+STYLE_FIELDS: Dict[str, Callable[[object], Optional[str]]] = {
+    "bg_color": _color,
+    "text_color": _color,
+    "font_size": _size,
+    "font_weight": _choice(*_FONT_WEIGHTS),
+    "text_align": _choice(*_TEXT_ALIGNS),
+    "justify_content": _choice("flex-start", "flex-end", "center", "space-between", "space-around",
+                               "space-evenly", "start", "end"),
+    "align_items": _choice("flex-start", "flex-end", "center", "stretch", "baseline", "start", "end"),
+    "flex_direction": _choice("row", "row-reverse", "column", "column-reverse"),
+    "rendered_image_url": _media_url,
+}
+
+# プレイヤーが実際に描画に使う項目 (/config にはこれだけを含める)
+PLAYER_STYLE_KEYS = ("bg_color", "text_color")
+
+# layout_config の要素 (text / image) ごとの項目
+LAYOUT_ELEMENTS = ("text", "image")
+LAYOUT_TEXT_FIELDS: Dict[str, Callable[[object], Optional[str]]] = {
+    "color": _color,
+    "fontSize": _size,
+    "fontWeight": _choice(*_FONT_WEIGHTS),
+    "textAlign": _choice(*_TEXT_ALIGNS),
+}
+# 位置・サイズ (キャンバスに対する %) の範囲
+LAYOUT_BOX_RANGES = {"left": (-100, 100), "top": (-100, 100), "width": (0, 100), "height": (0, 100)}
+
+
+def _percent(value, low: float, high: float) -> Optional[float]:
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(number):
+        return None
+    return round(min(max(number, low), high), 2)
+
+
+def normalize_slides(slides) -> list:
+    """旧形式の複数スライド (描画済み画像・表示秒数・背景色) を検証する"""
+    if not isinstance(slides, list):
+        return []
+    result = []
+    for slide in slides[:MAX_SLIDES]:
+        if not isinstance(slide, dict):
+            continue
+        url = _media_url(slide.get("rendered_image_url") or "")
+        if not url:
+            continue
+        item = {"rendered_image_url": url}
+        try:
+            item["duration"] = min(max(int(slide.get("duration") or 10), 1), 3600)
+        except (TypeError, ValueError):
+            item["duration"] = 10
+        bg_color = _color((slide.get("style") or {}).get("bg_color") or "")
+        item["style"] = {"bg_color": bg_color} if bg_color else {}
+        result.append(item)
+    return result
+
+
+def normalize_style(raw) -> dict:
+    """style_config を検証済みの項目だけにする (値が空・不正な項目は除く)"""
+    if not isinstance(raw, dict):
+        return {}
+    style = {}
+    for name, validate in STYLE_FIELDS.items():
+        if raw.get(name) not in (None, ""):
+            value = validate(raw[name])
+            if value is not None:
+                style[name] = value
+    slides = normalize_slides(raw.get("slides"))
+    if slides:
+        style["slides"] = slides
+    return style
+
+
+def normalize_layout(raw) -> dict:
+    """エディタの要素配置 ({"text": {...}, "image": {...}}) を検証する"""
+    if not isinstance(raw, dict):
+        return {}
+    layout = {}
+    for element in LAYOUT_ELEMENTS:
+        data = raw.get(element)
+        if not isinstance(data, dict):
+            continue
+        box = {}
+        for name, (low, high) in LAYOUT_BOX_RANGES.items():
+            value = _percent(data.get(name), low, high)
+            if value is not None:
+                box[name] = value
+        if element == "text":
+            for name, validate in LAYOUT_TEXT_FIELDS.items():
+                if data.get(name) not in (None, ""):
+                    value = validate(data[name])
+                    if value is not None:
+                        box[name] = value
+        if box:
+            layout[element] = box
+    return layout
+
+
+def split_legacy_style(raw) -> tuple:
+    """
+    旧形式の style_config (要素配置 elements / elements_layout を含む) を
+    (style_config, layout_config) に分ける (マイグレーション用)
+    """
+    raw = raw if isinstance(raw, dict) else {}
+    layout = normalize_layout(raw.get("elements") or raw.get("elements_layout"))
+    return normalize_style(raw), layout
+
+
+def update_style(content: models.Content, changes: Dict[str, Optional[object]]) -> bool:
+    """
+    style_config の指定した項目だけを変更する。値が None / 空文字の項目は削除、不正な値の項目は変更しない。
+    "slides" も指定できる。値が変わった場合だけ列を書き換え、True を返す
+    """
+    current = content.style_config or {}
+    style = dict(current)
+    for name, value in changes.items():
+        if value is None or value == "":
+            style.pop(name, None)
+        elif name == "slides":
+            slides = normalize_slides(value)
+            if slides:
+                style["slides"] = slides
+            else:
+                style.pop("slides", None)
+        elif name in STYLE_FIELDS:
+            value = STYLE_FIELDS[name](value)
+            if value is not None:
+                style[name] = value
+    if style == current:
+        return False
+    content.style_config = style
+    flag_modified(content, "style_config")
+    return True
+
+
+def update_layout(content: models.Content, raw) -> bool:
+    """要素配置を置き換える。値が変わった場合だけ列を書き換え、True を返す"""
+    layout = normalize_layout(raw)
+    if layout == (content.layout_config or {}):
+        return False
+    content.layout_config = layout or None
+    return True
+
+
+def player_style(style: Optional[dict]) -> dict:
+    """/config に含めるスタイル (プレイヤーが描画に使う項目のみ)"""
+    style = style or {}
+    return {k: style[k] for k in PLAYER_STYLE_KEYS if style.get(k)}
@@ -0,0 +1,150 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database import AsyncSessionLocal
+from app.models import models
+from app.services.emergency import active_alerts
+from app.services.heartbeat import record_heartbeat
+from app.services.metrics import Counter, Gauge, registry
+from app.services.playlist import compile_playlist, to_absolute_url
+from app.services.revisions import revisions
+from app.services.singleflight import SingleFlight
+from app.services.weather import get_weather_data
+
+# 天気スロットの表示地点
+WEATHER_LATITUDE = 35.3912
+WEATHER_LONGITUDE = 136.7223
+
+# 同じ学校の端末が一斉に取得しても書き込みが集中しないよう、これより短い間隔の通信は記録済みとみなす
+HEARTBEAT_RESOLUTION_SECONDS = 1
+
+# 同じ学校・同じリビジョンの設定の組み立てを1回にまとめる
+config_flight = SingleFlight()
+
+registry.register(Counter(
+    "signage_display_config_requests_total", "Display config requests by how they were served", ("result",),
+    collect=lambda: {
+        ("executed",): config_flight.executions,
+        ("collapsed",): config_flight.collapsed,
+        ("error",): config_flight.errors,
+    },
+))
+registry.register(Gauge(
+    "signage_display_config_in_flight", "Display config builds currently running",
+    collect=lambda: {(): config_flight.stats()["in_flight"]},
+))
+
+
+async def get_display_config(school_id: str) -> Optional[dict]:
+    """
+    プレイヤー用の表示設定を返す (学校が存在しなければ None)。
+    RELOAD 直後に同じ学校の端末から一斉に来るリクエストは、実行中の組み立てを共有する。
+    キーにリビジョンを含めるため、変更後に来たリクエストが変更前の結果を受け取ることはない。
+    """
+    # 組み立て中の変更を取りこぼさないよう、リビジョンは先に取得する
+    revision = revisions.current(school_id)
+    return await config_flight.run((school_id, revision), lambda: _load(school_id, revision))
+
+
+async def touch(school_id: str) -> None:
+    """
+    プレイヤーからの通信を記録する。
+    組み立ては同じ学校のリクエストで共有されるため、記録はリクエストごとにその外側で行う
+    """
+    async with AsyncSessionLocal() as db:
+        school = await db.get(models.School, school_id)
+        if not school:
+            return
+        now = datetime.now()
+        if school.last_heartbeat and (now - school.last_heartbeat).total_seconds() < HEARTBEAT_RESOLUTION_SECONDS:
+            return
+        try:
+            await record_heartbeat(db, school, now)
+            await db.commit()
+        except IntegrityError:
+            # 同時に他のワーカーが区間を開いた (その区間で記録される)
+            await db.rollback()
+
+
+async def _load(school_id: str, revision: str) -> Optional[dict]:
+    # 共有される処理のため、特定のリクエストに紐づかない専用のセッションを使う
+    async with AsyncSessionLocal() as db:
+        school = await db.get(models.School, school_id)
+        if not school:
+            return None
+
+        response = await build_display_config(db, school)
+        response["revision"] = revision
+        return response
+
+
+async def build_display_config(db: AsyncSession, school: models.School) -> dict:
+    school_id = school.id
+    now = datetime.now()
+
+    response = {
+        "layout_type": school.layout_type,
+        "school_name": school.name,
+        "slots": [],
+        # 解除されていない緊急連絡 (発信順、最後の連絡を全画面で表示する)
+        "emergency": await active_alerts(db, school_id),
+    }
+
+    result = await db.execute(
+        select(models.Slot).where(models.Slot.school_id == school_id).order_by(models.Slot.position)
+    )
+    slots = result.scalars().all()
+
+    # 全スロットのコンテンツを1クエリでまとめて取得
+    contents_by_slot = {}
+    slot_ids = [slot.id for slot in slots]
+    if slot_ids:
+        result = await db.execute(select(models.Content).where(models.Content.slot_id.in_(slot_ids)))
+        for c in result.scalars():
+            contents_by_slot.setdefault(c.slot_id, []).append(c)
+
+    # 承認済み広告は全スロット共通のため、広告スロットがあれば1回だけ取得する
+    # (配信用の画像がない広告は飛ばす)
+    ad_urls = []
+    if any(slot.content_type == "ad" for slot in slots):
+        result = await db.execute(
+            select(models.Ad.media_url)
+            .where(models.Ad.status == models.AdStatus.APPROVED, models.Ad.media_url.is_not(None))
+            .order_by(models.Ad.id)
+        )
+        ad_urls = [to_absolute_url(media_url) for media_url in result.scalars() if media_url]
+
+    for slot in slots:
+        slot_data = {
+            "position": slot.position,
+            "content_type": slot.content_type,
+            "content": {}
+        }
+        
+        if slot.content_type == "weather":
+            weather_text = await get_weather_data(WEATHER_LATITUDE, WEATHER_LONGITUDE)
+            slot_data["content"]["body"] = weather_text
+
+        elif slot.content_type == "ad":
+            if ad_urls:
+                slot_data["content"]["slideshow"] = ad_urls
+                slot_data["content"]["duration"] = 10000 
+            else:
+                slot_data["content"]["body"] = "広告募集中"
+
+        else:
+            # プレイリスト (複数アイテム) をそのまま再生できる形にコンパイル
+            slot_data["content"] = compile_playlist(slot.content_type, contents_by_slot.get(slot.id, []), now)
+
+        response["slots"].append(slot_data)
+
+    # 次にいずれかのスロットの表示内容が切り替わる時刻 (プレイヤーの再取得タイミング)
+    change_times = [s["content"]["valid_until"] for s in response["slots"] if s["content"].get("valid_until")]
+    if change_times:
+        response["valid_until"] = min(change_times)
+    
+    return response
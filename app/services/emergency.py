@@ -0,0 +1,307 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models import models
+from app.services.metrics import EMERGENCY_ACK_LATENCY
+from app.services.revisions import revisions
+from app.services.websocket import Device, manager
+
+logger = logging.getLogger(__name__)
+
+# 緊急連絡の配信範囲
+SCOPE_SCHOOL = "school"
+SCOPE_DISTRICT = "district"
+SCOPE_ALL = "all"
+SCOPES = (SCOPE_SCHOOL, SCOPE_DISTRICT, SCOPE_ALL)
+
+# WebSocket メッセージ種別 (RELOAD などの文字列メッセージと区別するため JSON で送る)
+MESSAGE_EMERGENCY = "EMERGENCY"
+MESSAGE_EMERGENCY_CLEAR = "EMERGENCY_CLEAR"
+# 接続時に送る、解除されていない連絡の一覧 (切断中に解除された連絡を端末側で消すため)
+MESSAGE_EMERGENCY_ACTIVE = "EMERGENCY_ACTIVE"
+MESSAGE_ACK = "ACK"
+
+
+def alert_content(alert: models.EmergencyAlert) -> dict:
+    """端末に表示する内容 (WebSocket の EMERGENCY メッセージと表示設定の emergency で共通)"""
+    return {
+        "alert_id": alert.id,
+        "message": alert.message,
+        "level": alert.level,
+        "issued_at": alert.issued_at.isoformat(),
+    }
+
+
+def payload(alert: models.EmergencyAlert) -> str:
+    return json.dumps({"type": MESSAGE_EMERGENCY, **alert_content(alert)}, ensure_ascii=False)
+
+
+async def active_alerts(db: AsyncSession, school_id: str) -> List[dict]:
+    """
+    学校の解除されていない緊急連絡 (発信順)。表示設定に含め、WebSocket を使わない
+    (ロングポーリングの) 端末や、設定を取り直した端末でも表示されるようにする
+    """
+    rows = (await db.execute(
+        select(models.EmergencyAlert)
+        .where(models.EmergencyAlert.cleared_at.is_(None))
+        .order_by(models.EmergencyAlert.issued_at)
+    )).scalars()
+    return [alert_content(alert) for alert in rows if school_id in (alert.school_ids or [])]
+
+
+def build_report(alert: models.EmergencyAlert, deliveries: Iterable[models.EmergencyDelivery]) -> dict:
+    """配信結果 (ACK 済み台数・遅延・未応答の端末・接続端末のない学校)"""
+    # 再接続などで同じ端末に複数回送った場合は、ACK のあった配信 (なければ最後の配信) を使う
+    latest: Dict[Tuple[str, str], models.EmergencyDelivery] = {}
+    for d in sorted(deliveries, key=lambda d: (d.acked_at is not None, d.sent_at)):
+        latest[(d.school_id, d.device_id)] = d
+    latencies = sorted(d.latency_ms for d in latest.values() if d.latency_ms is not None)
+    reached = {school_id for school_id, _ in latest}
+    return {
+        "alert_id": alert.id,
+        "message": alert.message,
+        "level": alert.level,
+        "scope": alert.scope,
+        "target": alert.target,
+        "issued_at": alert.issued_at.isoformat(),
+        "cleared_at": alert.cleared_at.isoformat() if alert.cleared_at else None,
+        "schools": len(alert.school_ids),
+        "devices": len(latest),
+        "acked": len(latencies),
+        "latency_ms": {
+            "p50": latencies[len(latencies) // 2] if latencies else None,
+            "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+            "max": latencies[-1] if latencies else None,
+        },
+        "unacked": [
+            {"school_id": school_id, "device_id": device_id, "error": d.error}
+            for (school_id, device_id), d in latest.items() if d.acked_at is None
+        ],
+        "unreachable_schools": [s for s in alert.school_ids if s not in reached],
+    }
+
+
+class EmergencyDispatcher:
+    """
+    緊急連絡を WebSocket で直接配信し、端末ごとの ACK を集計する。
+    通常の更新のように RELOAD → 設定の再取得を経由せず、表示内容そのものを送る。
+
+    連絡と配信状況は DB (emergency_alerts / emergency_deliveries) に保存するため、どのワーカーからでも
+    参照・解除でき、再起動しても解除されていない連絡は残る。各ワーカーは解除されていない連絡を
+    メモリに持っておき、EMERGENCY_SYNC_SECONDS ごとの同期 (run_sync) で他ワーカーでの発信・解除を取り込んで、
+    自分に接続している端末へ送る。
+    """
+
+    def __init__(self):
+        # 解除されていない連絡 (alert_id -> 行)
+        self._active: Dict[str, models.EmergencyAlert] = {}
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        # 送信時刻 (alert_id, school_id, device_id) -> time.monotonic。ACK までの遅延の計測用
+        self._sent: Dict[Tuple[str, str, str], float] = {}
+        # DB への書き込み待ちの ACK (alert_id, school_id, device_id, 時刻, 遅延ms)
+        self._acks: List[Tuple[str, str, str, datetime, int]] = []
+
+    async def get(self, alert_id: str) -> Optional[models.EmergencyAlert]:
+        async with AsyncSessionLocal() as db:
+            return await db.get(models.EmergencyAlert, alert_id)
+
+    async def report(self, alert_id: str) -> Optional[dict]:
+        async with AsyncSessionLocal() as db:
+            alert = await db.get(models.EmergencyAlert, alert_id)
+            if not alert:
+                return None
+            deliveries = (await db.execute(
+                select(models.EmergencyDelivery).where(models.EmergencyDelivery.alert_id == alert_id)
+            )).scalars().all()
+        return build_report(alert, deliveries)
+
+    async def recent_reports(self) -> List[dict]:
+        """直近 EMERGENCY_HISTORY_SIZE 件の配信結果 (新しい順)"""
+        async with AsyncSessionLocal() as db:
+            alerts = (await db.execute(
+                select(models.EmergencyAlert)
+                .order_by(models.EmergencyAlert.issued_at.desc())
+                .limit(settings.EMERGENCY_HISTORY_SIZE)
+            )).scalars().all()
+            deliveries: Dict[str, List[models.EmergencyDelivery]] = {alert.id: [] for alert in alerts}
+            if deliveries:
+                rows = (await db.execute(
+                    select(models.EmergencyDelivery).where(models.EmergencyDelivery.alert_id.in_(list(deliveries)))
+                )).scalars()
+                for d in rows:
+                    deliveries[d.alert_id].append(d)
+        return [build_report(alert, deliveries[alert.id]) for alert in alerts]
+
+    def _devices(self, school_ids: Iterable[str]) -> List[Device]:
+        """このワーカーに接続している対象校の端末"""
+        return [d for school_id in school_ids for d in manager.schools.get(school_id, {}).values()]
+
+    async def _send(self, device: Device, message: str) -> bool:
+        try:
+            await asyncio.wait_for(device.websocket.send_text(message), settings.EMERGENCY_SEND_TIMEOUT_SECONDS)
+            return True
+        except Exception:
+            return False
+
+    async def _deliver(self, alert: models.EmergencyAlert, devices: List[Device]) -> None:
+        if not devices:
+            return
+        # ACK が配信状況の記録より先に届かないよう、送信前に記録する
+        now = datetime.now()
+        rows = [
+            models.EmergencyDelivery(alert_id=alert.id, school_id=d.school_id, device_id=d.device_id, sent_at=now)
+            for d in devices
+        ]
+        async with AsyncSessionLocal() as db:
+            db.add_all(rows)
+            await db.commit()
+        sent_at = time.monotonic()
+        for device in devices:
+            self._sent[(alert.id, device.school_id, device.device_id)] = sent_at
+
+        # 端末ごとに順番に送ると遅い端末に引きずられるため、全端末へ同時に送る
+        message = payload(alert)
+        results = await asyncio.gather(*(self._send(device, message) for device in devices))
+        failed = [row.id for row, ok in zip(rows, results) if not ok]
+        if failed:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(models.EmergencyDelivery).where(models.EmergencyDelivery.id.in_(failed)).values(error=True)
+                )
+                await db.commit()
+
+    async def _send_clear(self, alert_id: str, school_ids: Iterable[str]) -> None:
+        for key in [k for k in self._sent if k[0] == alert_id]:
+            del self._sent[key]
+        message = json.dumps({"type": MESSAGE_EMERGENCY_CLEAR, "alert_id": alert_id})
+        await asyncio.gather(*(self._send(device, message) for device in self._devices(school_ids)))
+
+    async def send(self, school_ids: List[str], message: str, level: str = "urgent",
+                   scope: str = SCOPE_SCHOOL, target: Optional[str] = None,
+                   issued_by: Optional[int] = None) -> models.EmergencyAlert:
+        alert = models.EmergencyAlert(
+            id=uuid.uuid4().hex, message=message, level=level, scope=scope, target=target,
+            school_ids=list(school_ids), issued_by=issued_by, issued_at=datetime.now(),
+        )
+        async with self._lock:
+            async with AsyncSessionLocal() as db:
+                db.add(alert)
+                # 表示設定にも含まれるため、対象校のリビジョンを同じトランザクションで進める
+                await revisions.bump_in(db, alert.school_ids)
+                await db.commit()
+            self._active[alert.id] = alert
+        # 他ワーカーの端末へは、各ワーカーの同期 (run_sync) で配信される
+        await self._deliver(alert, self._devices(alert.school_ids))
+        # 直接の配信を先に済ませてから、設定の再取得 (RELOAD・ロングポーリングの応答) を促す
+        await revisions.refresh(alert.school_ids)
+        return alert
+
+    async def clear(self, alert_id: str) -> Optional[models.EmergencyAlert]:
+        async with self._lock:
+            async with AsyncSessionLocal() as db:
+                alert = await db.get(models.EmergencyAlert, alert_id)
+                if not alert or alert.cleared_at is not None:
+                    return alert
+                alert.cleared_at = datetime.now()
+                await revisions.bump_in(db, alert.school_ids)
+                await db.commit()
+            self._active.pop(alert_id, None)
+        await self._send_clear(alert.id, alert.school_ids)
+        await revisions.refresh(alert.school_ids)
+        return alert
+
+    async def deliver_active(self, device: Device) -> None:
+        """接続 (再接続) してきた端末に、解除されていない緊急連絡を送る"""
+        await self._ensure_loaded()
+        active = [alert for alert in list(self._active.values()) if device.school_id in alert.school_ids]
+        for alert in active:
+            await self._deliver(alert, [device])
+        await self._send(device, json.dumps({
+            "type": MESSAGE_EMERGENCY_ACTIVE, "alert_ids": [alert.id for alert in active],
+        }))
+
+    def ack(self, alert_id: str, device: Device) -> None:
+        """ACK の記録 (DB へは次の同期でまとめて書き込む)"""
+        sent_at = self._sent.pop((alert_id, device.school_id, device.device_id), None)
+        if sent_at is None:
+            return
+        latency = time.monotonic() - sent_at
+        EMERGENCY_ACK_LATENCY.observe(latency)
+        self._acks.append((alert_id, device.school_id, device.device_id, datetime.now(), int(latency * 1000)))
+
+    async def _flush_acks(self) -> None:
+        acks, self._acks = self._acks, []
+        if not acks:
+            return
+        Delivery = models.EmergencyDelivery
+        try:
+            async with AsyncSessionLocal() as db:
+                for alert_id, school_id, device_id, acked_at, latency_ms in acks:
+                    await db.execute(
+                        update(Delivery)
+                        .where(Delivery.alert_id == alert_id, Delivery.school_id == school_id,
+                               Delivery.device_id == device_id, Delivery.acked_at.is_(None))
+                        .values(acked_at=acked_at, latency_ms=latency_ms)
+                    )
+                await db.commit()
+        except SQLAlchemyError:
+            # 次の同期で書き込み直す
+            self._acks[:0] = acks
+            raise
+
+    async def _load_active(self) -> Dict[str, models.EmergencyAlert]:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(models.EmergencyAlert)
+                .where(models.EmergencyAlert.cleared_at.is_(None))
+                .order_by(models.EmergencyAlert.issued_at)
+            )).scalars().all()
+        return {alert.id: alert for alert in rows}
+
+    async def _ensure_loaded(self) -> None:
+        """起動直後 (最初の同期の前) に接続してきた端末のために、解除されていない連絡を読み込む"""
+        if self._loaded:
+            return
+        async with self._lock:
+            if not self._loaded:
+                self._active = await self._load_active()
+                self._loaded = True
+
+    async def sync(self) -> None:
+        """解除されていない連絡を DB から読み直し、他ワーカーで発信・解除された連絡を端末へ送る"""
+        await self._flush_acks()
+        async with self._lock:
+            active = await self._load_active()
+            # 初回 (起動直後) は接続してきた端末に deliver_active で送るため、ここでは送らない
+            issued = [alert for alert_id, alert in active.items() if alert_id not in self._active] if self._loaded else []
+            cleared = [alert for alert_id, alert in self._active.items() if alert_id not in active]
+            self._active = active
+            self._loaded = True
+        for alert in issued:
+            await self._deliver(alert, self._devices(alert.school_ids))
+        for alert in cleared:
+            await self._send_clear(alert.id, alert.school_ids)
+
+    async def run_sync(self):
+        """他ワーカーでの発信・解除の取り込み (アプリ起動時にバックグラウンドタスクとして開始する)"""
+        while True:
+            try:
+                await self.sync()
+            except SQLAlchemyError:
+                logger.exception("failed to sync emergency alerts")
+            await asyncio.sleep(settings.EMERGENCY_SYNC_SECONDS)
+
+# シングルトンインスタンスとして公開
+dispatcher = EmergencyDispatcher()
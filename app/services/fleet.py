@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models import models
+from app.services.pagination import DEFAULT_PAGE_SIZE, Page, keyset_paginate
+from app.services.presence import connected_condition, device_count_expression, fresh_since
+
+# 端末の稼働状態
+ONLINE = "online"    # いずれかのワーカーに WebSocket で接続中、または FLEET_ONLINE_SECONDS 以内に通信あり
+STALE = "stale"      # 接続はないが、FLEET_STALE_SECONDS 以内に通信あり
+OFFLINE = "offline"  # それ以上通信がない、または一度も通信していない
+STATUSES = (ONLINE, STALE, OFFLINE)
+
+
+def _thresholds(now: datetime):
+    return (
+        now - timedelta(seconds=settings.FLEET_ONLINE_SECONDS),
+        now - timedelta(seconds=settings.FLEET_STALE_SECONDS),
+    )
+
+
+def status_of(db: Session, school: models.School, now: Optional[datetime] = None) -> str:
+    """1校分の稼働状態 (Python側で判定する場合。判定基準は SQL 版と同じ)"""
+    now = now or datetime.now()
+    online_since, stale_since = _thresholds(now)
+    hb = school.last_heartbeat
+    if hb and hb >= online_since:
+        return ONLINE
+    connected = db.query(models.WorkerPresence.school_id).filter(
+        models.WorkerPresence.school_id == school.id,
+        models.WorkerPresence.last_seen >= fresh_since(now),
+    ).first()
+    if connected:
+        return ONLINE
+    if hb and hb >= stale_since:
+        return STALE
+    return OFFLINE
+
+
+def _conditions(now: datetime):
+    """(online の条件, stale の条件, offline の条件) を SQL 式で返す"""
+    online_since, stale_since = _thresholds(now)
+    hb = models.School.last_heartbeat
+    # WebSocket の接続状況 (全ワーカー分) を優先し、WebSocket を使わない端末は通信時刻で判定する
+    online = connected_condition(now) | (hb.isnot(None) & (hb >= online_since))
+    stale = ~online & (hb >= stale_since)
+    offline = ~online & ((hb == None) | (hb < stale_since))  # noqa: E711
+    return online, stale, offline
+
+
+def _status_expression(now: datetime):
+    online, stale, _ = _conditions(now)
+    return case((online, ONLINE), (stale, STALE), else_=OFFLINE)
+
+
+def _status_filter(query, status: str, now: datetime):
+    return query.filter(dict(zip(STATUSES, _conditions(now)))[status])
+
+
+def fleet_summary(db: Session, now: Optional[datetime] = None) -> dict:
+    """全校の稼働状態の件数を1回の集計クエリで求める"""
+    online_cond, stale_cond, _ = _conditions(now or datetime.now())
+    total, online, stale = db.query(
+        func.count(models.School.id),
+        func.sum(case((online_cond, 1), else_=0)),
+        func.sum(case((stale_cond, 1), else_=0)),
+    ).one()
+    total, online, stale = total or 0, online or 0, stale or 0
+    return {"total": total, ONLINE: online, STALE: stale, OFFLINE: total - online - stale}
+
+
+def school_statuses(db: Session, status: Optional[str] = None, cursor: Optional[str] = None,
+                    limit: int = DEFAULT_PAGE_SIZE, now: Optional[datetime] = None) -> Page:
+    """
+    学校ごとの稼働状態 (1ページ分)。
+    ORMオブジェクトは生成せず、表示に必要な列と SQL で判定した状態だけを取得する。
+    """
+    now = now or datetime.now()
+    query = db.query(
+        models.School.id,
+        models.School.name,
+        models.School.last_heartbeat,
+        _status_expression(now).label("status"),
+        device_count_expression(now).label("devices"),
+    )
+    if status in STATUSES:
+        query = _status_filter(query, status, now)
+    return keyset_paginate(query, models.School.id, cursor, limit=limit, descending=False)
+
+
+def status_to_dict(row) -> dict:
+    return {
+        "id": row.id,
+        "name": row.name,
+        "status": row.status,
+        "devices": row.devices,
+        "last_heartbeat": row.last_heartbeat.isoformat() if row.last_heartbeat else None,
+    }
@@ -0,0 +1,163 @@
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, exists, func, insert, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models import models
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+# --- 記録 ---
+
+async def record_heartbeat(db: AsyncSession, school: models.School, now: Optional[datetime] = None) -> None:
+    """
+    プレイヤーからの通信を記録する (コミットは呼び出し側で行う)。
+    前回の通信から HEARTBEAT_GAP_SECONDS 以内なら継続中の区間がそのまま延びるだけなので、
+    last_heartbeat の更新以外は何も書き込まない。
+
+    複数のワーカーが同時に途切れを検知しても区間が重複しないよう、区間は継続中のものがない場合だけ開く。
+    (それでも競合した場合は継続中の区間の一意インデックスで IntegrityError になる)
+    """
+    now = now or datetime.now()
+    prev = school.last_heartbeat
+    if prev is None or (now - prev).total_seconds() > settings.HEARTBEAT_GAP_SECONDS:
+        hb = models.HeartbeatInterval
+        if prev is not None:
+            # 途切れる前の区間を、最後に通信した時刻で閉じる
+            # (他のワーカーがすでに開き直した、prev より後に始まる区間は閉じない)
+            await db.execute(
+                update(hb)
+                .where(hb.school_id == school.id, hb.ended_at.is_(None), hb.started_at <= prev)
+                .values(ended_at=prev)
+            )
+        open_interval = exists().where(hb.school_id == school.id, hb.ended_at.is_(None))
+        await db.execute(
+            insert(hb).from_select(
+                ["school_id", "started_at"],
+                select(literal(school.id, hb.school_id.type), literal(now, hb.started_at.type)).where(~open_interval),
+            )
+        )
+    school.last_heartbeat = now
+
+
+# --- 集計 ---
+
+def _day_start(day: date) -> datetime:
+    return datetime.combine(day, time.min)
+
+def _online_seconds(db: Session, range_start: datetime, range_end: datetime,
+                    school_ids: Optional[Iterable[str]] = None) -> Dict[Tuple[str, date], float]:
+    """期間内のオンライン秒数を (school_id, 日付) ごとに合計する"""
+    hb = models.HeartbeatInterval
+    query = (
+        db.query(hb.school_id, hb.started_at, func.coalesce(hb.ended_at, models.School.last_heartbeat))
+        .join(models.School, models.School.id == hb.school_id)
+        .filter(hb.started_at < range_end)
+        .filter((hb.ended_at == None) | (hb.ended_at > range_start))  # noqa: E711
+    )
+    if school_ids is not None:
+        query = query.filter(hb.school_id.in_(list(school_ids)))
+
+    totals: Dict[Tuple[str, date], float] = defaultdict(float)
+    for school_id, started_at, ended_at in query:
+        start, end = max(started_at, range_start), min(ended_at or started_at, range_end)
+        # 日をまたぐ区間は日ごとに分割する
+        while start < end:
+            chunk_end = min(end, _day_start(start.date() + timedelta(days=1)))
+            totals[(school_id, start.date())] += (chunk_end - start).total_seconds()
+            start = chunk_end
+    return totals
+
+def rolled_up_through(db: Session) -> Optional[date]:
+    """日次集計が済んでいる最後の日"""
+    return db.query(func.max(models.HeartbeatDaily.day)).scalar()
+
+def rollup_heartbeats(db: Session, now: Optional[datetime] = None) -> int:
+    """
+    前日までの未集計分を日次集計に追加し、保持期間を過ぎたデータを削除する。
+    集計した日数を返す。定期的に (1日1回以上) 実行してください。
+    """
+    now = now or datetime.now()
+    today = now.date()
+
+    last = rolled_up_through(db)
+    if last is not None:
+        start_day = last + timedelta(days=1)
+    else:
+        first = db.query(func.min(models.HeartbeatInterval.started_at)).scalar()
+        start_day = first.date() if first else today
+    start_day = max(start_day, today - timedelta(days=settings.HEARTBEAT_DAILY_RETENTION_DAYS))
+
+    days = [start_day + timedelta(days=i) for i in range((today - start_day).days)]
+    if days:
+        totals = _online_seconds(db, _day_start(days[0]), _day_start(today))
+        school_ids = [school_id for (school_id,) in db.query(models.School.id)]
+        # 通信のなかった日も 0 秒として1行ずつ記録する (集計済みの日を判定できるように)
+        rows = [
+            {"school_id": school_id, "day": day, "online_seconds": int(totals.get((school_id, day), 0))}
+            for day in days for school_id in school_ids
+        ]
+        if rows:
+            db.execute(insert(models.HeartbeatDaily), rows)
+
+    # 保持期間を過ぎたデータの削除 (継続中の区間は残す)
+    # オンライン区間は日次集計が済んだ日の分だけ削除する (集計が遅れていても未集計の区間を失わないように)
+    through = rolled_up_through(db)
+    if through is not None:
+        raw_cutoff = min(now - timedelta(days=settings.HEARTBEAT_RAW_RETENTION_DAYS),
+                         _day_start(through + timedelta(days=1)))
+        db.execute(delete(models.HeartbeatInterval).where(models.HeartbeatInterval.ended_at < raw_cutoff))
+    daily_cutoff = today - timedelta(days=settings.HEARTBEAT_DAILY_RETENTION_DAYS)
+    db.execute(delete(models.HeartbeatDaily).where(models.HeartbeatDaily.day < daily_cutoff))
+    db.commit()
+    return len(days)
+
+
+# --- レポート ---
+
+def uptime_report(db: Session, school_ids: List[str], days: int,
+                  now: Optional[datetime] = None) -> Tuple[List[date], Dict[str, dict]]:
+    """
+    直近 days 日間 (今日を含む) の学校ごとの稼働率。
+    集計済みの日は日次集計から、未集計の日 (今日など) はオンライン区間から計算するため、
+    クエリ量は日数と通信の途切れた回数にのみ比例する。
+
+    戻り値: (日付のリスト, {school_id: {"days": [日ごとの稼働率], "uptime": 期間全体の稼働率}})
+    """
+    now = now or datetime.now()
+    today = now.date()
+    day_list = [today - timedelta(days=i) for i in range(days - 1, -1, -1)]
+    if not school_ids:
+        return day_list, {}
+
+    totals: Dict[Tuple[str, date], float] = defaultdict(float)
+    last = rolled_up_through(db)
+    raw_from = day_list[0]
+    if last is not None and last >= day_list[0]:
+        rows = (
+            db.query(models.HeartbeatDaily.school_id, models.HeartbeatDaily.day, models.HeartbeatDaily.online_seconds)
+            .filter(models.HeartbeatDaily.school_id.in_(school_ids))
+            .filter(models.HeartbeatDaily.day >= day_list[0], models.HeartbeatDaily.day <= last)
+        )
+        for school_id, day, seconds in rows:
+            totals[(school_id, day)] = seconds or 0
+        raw_from = last + timedelta(days=1)
+    if raw_from <= today:
+        for key, seconds in _online_seconds(db, _day_start(raw_from), now, school_ids).items():
+            totals[key] += seconds
+
+    # 今日は経過時間に対する割合
+    denominators = [SECONDS_PER_DAY] * (len(day_list) - 1) + [max((now - _day_start(today)).total_seconds(), 1)]
+    report = {}
+    for school_id in school_ids:
+        seconds = [totals.get((school_id, day), 0) for day in day_list]
+        report[school_id] = {
+            "days": [min(s / d, 1.0) for s, d in zip(seconds, denominators)],
+            "uptime": min(sum(seconds) / sum(denominators), 1.0),
+        }
+    return day_list, report
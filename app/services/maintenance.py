@@ -0,0 +1,114 @@
+"""
+定期ジョブ (app.services.scheduler で実行する)
+
+リクエスト処理の中で行う必要のない後片付け・先読みをまとめたもの。
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Iterable, Set
+
+from sqlalchemy import delete
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models import models
+from app.services.ad_processing import ORIGINAL_PREFIX
+from app.services.bulk_content import BULK_ASSET_PREFIX
+from app.services.display_config import WEATHER_LATITUDE, WEATHER_LONGITUDE
+from app.services.heartbeat import rollup_heartbeats
+from app.services.scheduler import Job, Scheduler
+from app.services.storage import storage
+from app.services.weather import get_weather_data
+
+logger = logging.getLogger(__name__)
+
+# 参照がなくなったら削除してよいファイルの置き場所 (ストレージ上のキーの接頭辞)
+# 学校がアップロードした素材 (直下, ads/) は対象にしない。広告の元画像 (ads/originals) は処理待ちの分だけ残す
+MEDIA_CLEANUP_PREFIXES = ("rendered", BULK_ASSET_PREFIX, ORIGINAL_PREFIX)
+
+
+def expire_invitation_tokens(now: datetime = None) -> int:
+    """期限切れから一定日数が過ぎた未使用の招待トークンを削除し、件数を返す"""
+    cutoff = (now or datetime.now()) - timedelta(days=settings.INVITATION_TOKEN_RETENTION_DAYS)
+    db = SessionLocal()
+    try:
+        result = db.execute(
+            delete(models.InvitationToken)
+            .where(models.InvitationToken.is_used == False, models.InvitationToken.expires_at < cutoff)  # noqa: E712
+        )
+        db.commit()
+        return result.rowcount
+    finally:
+        db.close()
+
+
+def rollup_heartbeat_history() -> int:
+    db = SessionLocal()
+    try:
+        return rollup_heartbeats(db)
+    finally:
+        db.close()
+
+
+async def warm_weather() -> None:
+    """天気のキャッシュが切れる前に取得し直す (プレイヤーの設定取得で外部APIを待たないように)"""
+    await get_weather_data(WEATHER_LATITUDE, WEATHER_LONGITUDE, refresh=True)
+
+
+def _strings(value) -> Iterable[str]:
+    """style_config などの JSON に含まれる文字列をすべて返す"""
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for v in value.values():
+            yield from _strings(v)
+    elif isinstance(value, list):
+        for v in value:
+            yield from _strings(v)
+
+
+def _referenced_keys(db) -> Set[str]:
+    """コンテンツ・広告から参照されているファイルのキー"""
+    urls = set()
+    for media_url, style_config in db.query(models.Content.media_url, models.Content.style_config):
+        urls.add(media_url)
+        urls.update(_strings(style_config))
+    for media_url, original_url in db.query(models.Ad.media_url, models.Ad.original_url):
+        urls.update((media_url, original_url))
+    # 絶対URL (HOST_URL 付き) で保存されている場合も key_for がパス部分で比較する
+    return {key for key in map(storage.key_for, urls) if key}
+
+
+def cleanup_media(now: datetime = None) -> int:
+    """どのコンテンツからも参照されていない描画済み画像・一括配信素材・広告の元画像を削除し、件数を返す"""
+    cutoff = (now or datetime.now()) - timedelta(hours=settings.MEDIA_CLEANUP_GRACE_HOURS)
+    db = SessionLocal()
+    try:
+        referenced = _referenced_keys(db)
+    finally:
+        db.close()
+
+    removed = 0
+    for prefix in MEDIA_CLEANUP_PREFIXES:
+        for key, modified_at in list(storage.list(prefix)):
+            if modified_at > cutoff or key in referenced:
+                continue
+            try:
+                storage.delete(key)
+                removed += 1
+            except Exception:
+                logger.warning("failed to remove %s", key)
+    return removed
+
+
+def register_jobs(scheduler: Scheduler) -> None:
+    scheduler.add(Job("expire_invitation_tokens", expire_invitation_tokens, interval=3600, jitter=300))
+    # 未集計の日がなければすぐ終わるため、1日1回ではなく1時間ごとに実行する (再起動で取りこぼさないように)
+    scheduler.add(Job("rollup_heartbeats", rollup_heartbeat_history, interval=3600, jitter=300,
+                      run_at_startup=True))
+    scheduler.add(Job("cleanup_media", cleanup_media, daily_at="03:30", jitter=600, timeout=900))
+    if settings.WEATHER_CACHE_TTL_SECONDS > 0:
+        # キャッシュはワーカーごとなので全ワーカーで実行する
+        scheduler.add(Job("warm_weather", warm_weather,
+                          interval=max(60, settings.WEATHER_CACHE_TTL_SECONDS - 60), jitter=30,
+                          timeout=30, leader_only=False, run_at_startup=True))
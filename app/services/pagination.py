@@ -0,0 +1,70 @@
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Any, List, Optional
+
+# 管理画面の一覧で1ページに表示する件数
+DEFAULT_PAGE_SIZE = 50
+
+
+@dataclass
+class Page:
+    items: List[Any] = field(default_factory=list)
+    # 次ページ取得用のカーソル (最後の行のキー値)。次ページがなければ None
+    next_cursor: Optional[Any] = None
+    # 絞り込み条件に一致する総件数 (SQL の COUNT で算出)
+    total: Optional[int] = None
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+
+def parse_cursor(key_column, cursor: Optional[str]):
+    """クエリパラメータのカーソル文字列をキー列の型に変換する (不正値は先頭ページ扱い)"""
+    if cursor in (None, ""):
+        return None
+    try:
+        return key_column.type.python_type(cursor)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_date(value: Optional[str]) -> Optional[date]:
+    """クエリパラメータの日付 (YYYY-MM-DD) を読む (空・不正値は None)"""
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def filter_date_range(query, column, date_from: Optional[str] = None, date_to: Optional[str] = None):
+    """日時の列を期間 (date_from 〜 date_to、両端の日を含む) で絞り込む。指定のない側は制限しない"""
+    start, end = parse_date(date_from), parse_date(date_to)
+    if start:
+        query = query.filter(column >= datetime.combine(start, datetime.min.time()))
+    if end:
+        query = query.filter(column < datetime.combine(end + timedelta(days=1), datetime.min.time()))
+    return query
+
+
+def keyset_paginate(query, key_column, cursor: Optional[str] = None,
+                    limit: int = DEFAULT_PAGE_SIZE, descending: bool = True) -> Page:
+    """
+    キーセット方式のページング。
+
+    OFFSET を使わず「前ページ最後のキーより後」を条件にするため、
+    何ページ目でもインデックスを辿るだけで済み、テーブルサイズに関係なく一定コストになる。
+    key_column は一意でソート可能な列 (通常は主キー) を指定する。
+    """
+    value = parse_cursor(key_column, cursor)
+    if value is not None:
+        query = query.filter(key_column < value if descending else key_column > value)
+    query = query.order_by(key_column.desc() if descending else key_column.asc())
+
+    # 1件多く取得して次ページの有無を判定する
+    rows = query.limit(limit + 1).all()
+    items = rows[:limit]
+    next_cursor = getattr(items[-1], key_column.key) if len(rows) > limit else None
+    return Page(items=items, next_cursor=next_cursor)
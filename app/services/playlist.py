@@ -0,0 +1,110 @@
+from datetime import datetime
+from typing import List, Optional
+
+from app.models import models
+from app.services.content_style import player_style
+from app.services.storage import storage
+
+# プレイリスト1件あたりのデフォルト表示秒数
+DEFAULT_ITEM_DURATION = 10
+
+# レンダリング済み画像を使わないスロット種別 (システムが内容を生成する枠)
+AUTO_RENDER_EXCLUDED_TYPES = ("weather", "ad", "countdown")
+
+
+def to_absolute_url(url: Optional[str]) -> Optional[str]:
+    """相対パス (/static/...) をプレイヤーから参照できる絶対URLに変換する (CDN などの配信URLを含む)"""
+    return storage.public_url(url)
+
+
+def is_scheduled(content: models.Content, now: datetime) -> bool:
+    """掲載期間内かどうか"""
+    if content.is_active is False:
+        return False
+    if content.start_at and content.start_at > now:
+        return False
+    if content.end_at and content.end_at < now:
+        return False
+    return True
+
+
+def build_item(content_type: str, content: models.Content) -> dict:
+    """
+    1件のコンテンツをプレイヤー用の表示データに変換する。
+    (従来の get_display_config の1スロット分の処理と同じ形式)
+    """
+    item = {}
+    style = content.style_config or {}
+    # スタイルはプレイヤーが描画に使う項目だけを送る (エディタ用の項目や描画済み画像のパスは含めない)
+    item["style"] = player_style(style)
+
+    # 複数スライドデータがある場合は含める (旧形式の互換)
+    if isinstance(style.get("slides"), list) and len(style["slides"]) > 0:
+        processed_slides = []
+        for s in style["slides"]:
+            # ORMが保持しているJSONを書き換えないよう、必要な項目だけを新しい dict に詰める
+            processed_slides.append({
+                "rendered_image_url": to_absolute_url(s.get("rendered_image_url")),
+                "duration": s.get("duration"),
+                "style": player_style(s.get("style")),
+            })
+        item["slides"] = processed_slides
+
+    item["body"] = content.body
+    item["theme"] = content.theme
+
+    if style.get("rendered_image_url") and content_type not in AUTO_RENDER_EXCLUDED_TYPES:
+        # スライドリストがない場合のみ単体レンダリング画像を使う
+        if not item.get("slides"):
+            item["media_url"] = to_absolute_url(style["rendered_image_url"])
+            item["body"] = ""
+    elif content.media_url:
+        item["media_url"] = to_absolute_url(content.media_url)
+
+    if content_type == "countdown":
+        if content.end_at:
+            item["target_time"] = content.end_at.isoformat()
+    elif content_type == "wbgt":
+        item["level"] = content.body
+    elif content_type == "emergency":
+        item["theme"] = "urgent"
+
+    item["content_id"] = content.id
+    item["duration"] = content.duration or DEFAULT_ITEM_DURATION
+    return item
+
+
+def next_schedule_change(contents: List[models.Content], now: datetime) -> Optional[datetime]:
+    """現在以降で、いずれかのアイテムの表示/非表示が切り替わる最も早い時刻"""
+    candidates = []
+    for c in contents:
+        if c.start_at and c.start_at > now:
+            candidates.append(c.start_at)
+        if c.end_at and c.end_at > now:
+            candidates.append(c.end_at)
+    return min(candidates) if candidates else None
+
+
+def compile_playlist(content_type: str, contents: List[models.Content], now: datetime) -> dict:
+    """
+    スロットのプレイリストを、そのまま再生できる順序付きシーケンスに変換する。
+
+    戻り値の content には先頭アイテムの内容が展開され (単一コンテンツ時代のプレイヤー互換)、
+    2件以上有効なアイテムがある場合のみ "playlist" に全アイテムが入る。
+    "valid_until" は次にスケジュールが切り替わる時刻で、プレイヤーはこの時刻に再取得すればよい。
+    """
+    ordered = sorted(contents, key=lambda c: (c.position or 0, c.id or 0))
+    items = [build_item(content_type, c) for c in ordered if is_scheduled(c, now)]
+
+    if not items:
+        # 掲載期間外のみ: 従来通り空表示
+        compiled = {"body": ""} if ordered else {}
+    else:
+        compiled = dict(items[0])
+        if len(items) > 1:
+            compiled["playlist"] = items
+
+    change_at = next_schedule_change(ordered, now)
+    if change_at:
+        compiled["valid_until"] = change_at.isoformat()
+    return compiled
@@ -0,0 +1,117 @@
+"""
+WebSocket の接続状況 (presence) のワーカー間共有
+
+接続はワーカーごとのメモリ (ConnectionManager) にしかないため、各ワーカーが学校ごとの接続台数を
+PRESENCE_FLUSH_SECONDS ごとに worker_presence へまとめて書き込む。PING ごとには書き込まない。
+稼働監視 (app/services/fleet.py) は last_seen が PRESENCE_TTL_SECONDS 以内の行を「接続中」とみなすため、
+どのワーカーに接続していても数秒の遅れで online と判定される。
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import and_, bindparam, delete, func, insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models import models
+from app.services.scheduler import WORKER_ID
+from app.services.websocket import manager
+
+logger = logging.getLogger(__name__)
+
+
+def fresh_since(now: datetime) -> datetime:
+    return now - timedelta(seconds=settings.PRESENCE_TTL_SECONDS)
+
+
+def connected_condition(now: datetime):
+    """いずれかのワーカーに WebSocket で接続中の学校 (School に対する SQL 式)"""
+    wp = models.WorkerPresence
+    return select(wp.school_id).where(
+        wp.school_id == models.School.id, wp.last_seen >= fresh_since(now)
+    ).exists()
+
+
+def device_count_expression(now: datetime):
+    """全ワーカーの接続台数の合計 (School に対する相関サブクエリ)"""
+    wp = models.WorkerPresence
+    return (
+        select(func.coalesce(func.sum(wp.devices), 0))
+        .where(wp.school_id == models.School.id, wp.last_seen >= fresh_since(now))
+        .scalar_subquery()
+    )
+
+
+class PresenceRecorder:
+    """このワーカーの接続台数を worker_presence に反映する"""
+
+    def __init__(self, worker_id: str = WORKER_ID):
+        self.worker_id = worker_id
+        # 最後に書き込んだ学校ごとの台数 (None: 未書き込み、または失敗したので全て書き直す)
+        self._written: Optional[Dict[str, int]] = None
+
+    async def flush(self, now: Optional[datetime] = None) -> None:
+        """
+        前回から変わった行だけを書き込み、残りの行は last_seen を1文でまとめて更新する。
+        期限切れの行 (停止したワーカーの分) もここで削除する
+        """
+        now = now or datetime.now()
+        current = {school_id: len(devices) for school_id, devices in manager.schools.items() if devices}
+        written = self._written
+        wp = models.WorkerPresence
+        mine = wp.worker_id == self.worker_id
+        try:
+            async with AsyncSessionLocal() as db:
+                if written is None:
+                    await db.execute(delete(wp).where(mine))
+                    written = {}
+                gone = [school_id for school_id in written if school_id not in current]
+                if gone:
+                    await db.execute(delete(wp).where(mine, wp.school_id.in_(gone)))
+                await db.execute(update(wp).where(mine).values(last_seen=now))
+                added = [
+                    {"worker_id": self.worker_id, "school_id": school_id, "devices": count, "last_seen": now}
+                    for school_id, count in current.items() if school_id not in written
+                ]
+                if added:
+                    await db.execute(insert(wp), added)
+                changed = [
+                    {"b_school_id": school_id, "b_devices": count}
+                    for school_id, count in current.items() if school_id in written and written[school_id] != count
+                ]
+                if changed:
+                    await db.execute(
+                        update(wp.__table__)
+                        .where(and_(wp.__table__.c.worker_id == self.worker_id,
+                                    wp.__table__.c.school_id == bindparam("b_school_id")))
+                        .values(devices=bindparam("b_devices")),
+                        changed,
+                    )
+                await db.execute(delete(wp).where(wp.last_seen < fresh_since(now)))
+                await db.commit()
+        except SQLAlchemyError:
+            self._written = None
+            raise
+        self._written = current
+
+    async def clear(self) -> None:
+        """終了時に自分の行を削除する (他ワーカーからは期限切れを待たずに接続なしと判定される)"""
+        self._written = None
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(models.WorkerPresence).where(models.WorkerPresence.worker_id == self.worker_id))
+            await db.commit()
+
+    async def run(self):
+        """接続状況の定期書き込み (アプリ起動時にバックグラウンドタスクとして開始する)"""
+        while True:
+            try:
+                await self.flush()
+            except SQLAlchemyError:
+                logger.exception("failed to write websocket presence")
+            await asyncio.sleep(settings.PRESENCE_FLUSH_SECONDS)
+
+# シングルトンインスタンスとして公開
+presence = PresenceRecorder()
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models import models
+
+logger = logging.getLogger(__name__)
+
+
+class RevisionTracker:
+    """
+    学校ごとの表示設定のリビジョン (変更のたびに進むカウンタ)。
+    ロングポーリング中のプレイヤーは wait() で変更を待つ。asyncio.Event で待機するため、
+    待っている間スレッドやDB接続を占有しない。
+
+    リビジョンは schools.config_revision (DB) に保存するため、複数ワーカー・再起動をまたいでも同じ値になる。
+    各ワーカーは値をメモリに持っておき、自分での変更はその場で、他ワーカーでの変更は
+    REVISION_SYNC_SECONDS ごとの同期 (run_sync) で反映して、待っているプレイヤーを起こす。
+    リビジョンが進んだ学校はリスナー (add_listener) にも通知し、このワーカーに WebSocket で
+    接続している端末へ RELOAD を送る。
+
+    設定を変更する側は、変更と同じトランザクションで bump_in() を実行し、コミット後に refresh() を呼ぶ。
+    """
+
+    def __init__(self):
+        self._revisions: Dict[str, int] = {}
+        self._events: Dict[str, asyncio.Event] = {}
+        self._listeners: List[Callable[[List[str]], Awaitable[None]]] = []
+        # 全校分を一度読み込んだか (起動直後の読み込みでは RELOAD を送らない)
+        self._loaded = False
+
+    def current(self, school_id: str) -> str:
+        return str(self._revisions.get(school_id, 0))
+
+    def add_listener(self, callback: Callable[[List[str]], Awaitable[None]]) -> None:
+        """リビジョンが進んだ学校IDの一覧を受け取るコールバックを登録する"""
+        self._listeners.append(callback)
+
+    def _update(self, revisions: Dict[str, int]) -> List[str]:
+        """読み込んだリビジョンを反映し、進んだ学校を待っているプレイヤーを起こす。進んだ学校IDを返す"""
+        advanced = []
+        for school_id, revision in revisions.items():
+            known = self._revisions.get(school_id)
+            if revision > (known or 0):
+                self._revisions[school_id] = revision
+                event = self._events.pop(school_id, None)
+                if event:
+                    event.set()
+                # 起動直後は値を知らなかっただけの学校もあるため、読み込み済みの学校だけを通知する
+                if self._loaded or known is not None:
+                    advanced.append(school_id)
+        return advanced
+
+    async def refresh(self, school_ids: Optional[Iterable[str]] = None) -> None:
+        """
+        DB からリビジョンを読み込み (school_ids を省略した場合は全校)、進んだ学校をリスナーに通知する。
+        bump_in() した側はコミット後にこれを呼ぶ
+        """
+        query = select(models.School.id, models.School.config_revision)
+        if school_ids is not None:
+            query = query.where(models.School.id.in_(list(school_ids)))
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(query)).all()
+        advanced = self._update({school_id: revision or 0 for school_id, revision in rows})
+        if school_ids is None:
+            self._loaded = True
+        if advanced:
+            for listener in self._listeners:
+                await listener(advanced)
+
+    async def bump_in(self, db: AsyncSession, school_ids: Optional[Iterable[str]] = None) -> None:
+        """
+        指定した学校 (省略した場合は全校) のリビジョンを進める UPDATE を、呼び出し側のトランザクションで実行する。
+        設定の変更と同時にコミットされるため、変更済みなのにリビジョンが古いままの時間ができない
+        """
+        statement = update(models.School).values(config_revision=func.coalesce(models.School.config_revision, 0) + 1)
+        if school_ids is not None:
+            school_ids = list(school_ids)
+            if not school_ids:
+                return
+            statement = statement.where(models.School.id.in_(school_ids))
+        await db.execute(statement)
+
+    async def bump(self, school_id: str) -> None:
+        """指定した学校の設定が変わった (変更とは別のトランザクションで進める場合)"""
+        async with AsyncSessionLocal() as db:
+            await self.bump_in(db, [school_id])
+            await db.commit()
+        await self.refresh([school_id])
+
+    async def bump_all(self) -> None:
+        """全校の設定が変わった (変更とは別のトランザクションで進める場合)"""
+        async with AsyncSessionLocal() as db:
+            await self.bump_in(db)
+            await db.commit()
+        await self.refresh()
+
+    async def wait(self, school_id: str, revision: Optional[str], timeout: float) -> bool:
+        """リビジョンが revision から変わるまで待つ。変わったら True、タイムアウトなら False"""
+        try:
+            known = int(revision)
+        except (TypeError, ValueError):
+            # 未取得・旧形式のリビジョン
+            return True
+        if known > self._revisions.get(school_id, 0):
+            # 他ワーカーで進んだ値を持っている: 同期を待たずに読み直す
+            await self.refresh([school_id])
+        if known != self._revisions.get(school_id, 0):
+            return True
+        event = self._events.setdefault(school_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return known != self._revisions.get(school_id, 0)
+
+    async def run_sync(self):
+        """他ワーカーでの変更の取り込み (アプリ起動時にバックグラウンドタスクとして開始する)"""
+        while True:
+            try:
+                await self.refresh()
+            except SQLAlchemyError:
+                logger.exception("failed to sync config revisions")
+            await asyncio.sleep(settings.REVISION_SYNC_SECONDS)
+
+# シングルトンインスタンスとして公開
+revisions = RevisionTracker()
@@ -0,0 +1,200 @@
+"""
+アプリ内の定期ジョブ実行 (lifespan で開始・停止する)
+
+    scheduler.add(Job("rollup_heartbeats", rollup, interval=3600))
+    scheduler.add(Job("cleanup_media", cleanup, daily_at="03:30"))
+
+leader_only=True のジョブは DB のリース (scheduler_leases) を取得できたワーカーだけが実行するため、
+複数ワーカー・複数台で運用しても1周期に1回だけ実行されます。
+プロセス内のキャッシュを温めるジョブなどは leader_only=False にして全ワーカーで実行します。
+"""
+import asyncio
+import inspect
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Union
+
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+
+from app.core.database import SessionLocal
+from app.models import models
+from app.services.metrics import Counter, Gauge, Histogram, registry
+
+logger = logging.getLogger(__name__)
+
+JOB_RUNS_TOTAL = registry.register(Counter(
+    "signage_job_runs_total", "Background job runs by outcome", ("job", "outcome")))
+JOB_DURATION = registry.register(Histogram(
+    "signage_job_duration_seconds", "Background job run time", ("job",),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)))
+
+# このワーカーの識別子 (リースの所有者)
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+JobFunc = Callable[[], Union[None, Awaitable[None]]]
+
+
+@dataclass
+class Job:
+    """
+    name     : ジョブ名 (リース・メトリクスのキー)
+    func     : 引数なしの関数。同期関数はスレッドプールで実行する
+    interval : 実行間隔 (秒)。daily_at を指定した場合は無視する
+    daily_at : 毎日の実行時刻 ("HH:MM", サーバーのローカル時刻)
+    jitter   : 実行時刻をずらす最大秒数 (複数ワーカーの同時起動で一斉に動かないように)
+    timeout  : 1回の実行の制限時間 (秒)
+    """
+    name: str
+    func: JobFunc
+    interval: float = 3600
+    daily_at: Optional[str] = None
+    jitter: float = 0
+    timeout: float = 300
+    leader_only: bool = True
+    # 起動直後に1回実行する (daily_at のジョブでは無視)
+    run_at_startup: bool = False
+    last_run_at: Optional[datetime] = None
+    last_success_at: Optional[datetime] = None
+    last_error: Optional[str] = None
+
+    def next_delay(self, now: Optional[datetime] = None) -> float:
+        """次の実行までの秒数 (ジッター込み)"""
+        jitter = random.uniform(0, self.jitter) if self.jitter else 0
+        if not self.daily_at:
+            return self.interval + jitter
+        now = now or datetime.now()
+        hour, minute = (int(v) for v in self.daily_at.split(":"))
+        next_run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        return (next_run - now).total_seconds() + jitter
+
+    @property
+    def lease_seconds(self) -> float:
+        # 次の周期の少し手前で切れるようにする (担当のワーカーが落ちても次の周期は他が引き継ぐ)
+        period = 86400 if self.daily_at else self.interval
+        return max(self.timeout, period * 0.9)
+
+
+def acquire_lease(name: str, seconds: float, owner: str = WORKER_ID, now: Optional[datetime] = None) -> bool:
+    """ジョブの実行権を取得する。他のワーカーが有効なリースを持っていれば False"""
+    now = now or datetime.now()
+    expires_at = now + timedelta(seconds=seconds)
+    db = SessionLocal()
+    try:
+        # 自分のリース、または期限切れのリースなら引き継ぐ (条件付き UPDATE なので取得できるのは1ワーカーだけ)
+        result = db.execute(
+            update(models.SchedulerLease)
+            .where(
+                models.SchedulerLease.name == name,
+                or_(models.SchedulerLease.owner == owner, models.SchedulerLease.expires_at < now),
+            )
+            .values(owner=owner, expires_at=expires_at)
+        )
+        if result.rowcount:
+            db.commit()
+            return True
+        db.add(models.SchedulerLease(name=name, owner=owner, expires_at=expires_at))
+        try:
+            db.commit()
+            return True
+        except IntegrityError:
+            # 他のワーカーが有効なリースを持っている
+            db.rollback()
+            return False
+    finally:
+        db.close()
+
+
+class Scheduler:
+    def __init__(self):
+        self.jobs: Dict[str, Job] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def add(self, job: Job) -> Job:
+        self.jobs[job.name] = job
+        return job
+
+    async def run_job(self, job: Job) -> Optional[str]:
+        """ジョブを1回実行し、結果 (ok / error / timeout / skipped) を返す"""
+        if job.leader_only:
+            try:
+                acquired = await asyncio.to_thread(acquire_lease, job.name, job.lease_seconds)
+            except Exception:
+                logger.exception("job %s: failed to acquire lease", job.name)
+                acquired = False
+            if not acquired:
+                JOB_RUNS_TOTAL.inc(job=job.name, outcome="skipped")
+                return "skipped"
+
+        job.last_run_at = datetime.now()
+        start = time.perf_counter()
+        try:
+            if inspect.iscoroutinefunction(job.func):
+                await asyncio.wait_for(job.func(), job.timeout)
+            else:
+                # 制限時間を過ぎても実行中のスレッドは止まらない (結果を待たずに次の周期へ進む)
+                await asyncio.wait_for(asyncio.to_thread(job.func), job.timeout)
+            outcome = "ok"
+            job.last_success_at = datetime.now()
+            job.last_error = None
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            job.last_error = f"timed out after {job.timeout}s"
+            logger.warning("job %s timed out after %ss", job.name, job.timeout)
+        except Exception as e:
+            outcome = "error"
+            job.last_error = repr(e)
+            logger.exception("job %s failed", job.name)
+        JOB_DURATION.observe(time.perf_counter() - start, job=job.name)
+        JOB_RUNS_TOTAL.inc(job=job.name, outcome=outcome)
+        return outcome
+
+    async def _loop(self, job: Job) -> None:
+        if job.run_at_startup and not job.daily_at:
+            await asyncio.sleep(random.uniform(0, job.jitter) if job.jitter else 0)
+            await self.run_job(job)
+        while True:
+            await asyncio.sleep(job.next_delay())
+            await self.run_job(job)
+
+    def start(self) -> None:
+        for job in self.jobs.values():
+            self._tasks.append(asyncio.create_task(self._loop(job), name=f"job:{job.name}"))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def status(self) -> List[dict]:
+        return [
+            {
+                "name": job.name,
+                "schedule": f"daily {job.daily_at}" if job.daily_at else f"every {int(job.interval)}s",
+                "leader_only": job.leader_only,
+                "last_run_at": job.last_run_at.isoformat() if job.last_run_at else None,
+                "last_success_at": job.last_success_at.isoformat() if job.last_success_at else None,
+                "last_error": job.last_error,
+            }
+            for job in self.jobs.values()
+        ]
+
+# シングルトンインスタンスとして公開
+scheduler = Scheduler()
+
+registry.register(Gauge(
+    "signage_job_last_success_timestamp_seconds", "Unix time of the last successful run", ("job",),
+    collect=lambda: {
+        (job.name,): job.last_success_at.timestamp()
+        for job in scheduler.jobs.values() if job.last_success_at
+    },
+))
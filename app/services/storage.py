@@ -0,0 +1,262 @@
+"""
+メディアファイル (アップロード画像・描画済み画像など) の保存先
+
+    from app.services.storage import storage
+    url = storage.save("ads/ad_req_1_foo.png", upload.file)   # DB にはこの URL を保存する
+    storage.public_url(url)                                 # プレイヤーに渡す絶対URL
+
+STORAGE_BACKEND=local (デフォルト): MEDIA_ROOT (static/) に保存し、/static から配信する
+STORAGE_BACKEND=s3               : S3 互換ストレージに保存する (boto3 が必要)。
+    S3_PUBLIC_BASE_URL (CDN / 公開バケット) があればそこから、なければ /media 経由でアプリが中継して配信する。
+    S3_ENDPOINT_URL を指定すると MinIO などの互換サーバー (ローカルの代替環境を含む) を使える。
+
+DB には MEDIA_URL_PREFIX + キー (例: /static/ads/x.png) の形で保存するため、
+バックエンドを切り替えても既存の行は書き換えずに読める。
+"""
+import mimetypes
+import os
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+from app.core.config import settings
+
+# ストリーミングで読み書きする単位
+CHUNK_SIZE = 64 * 1024
+
+
+class StorageError(Exception):
+    pass
+
+
+def guess_content_type(key: str) -> str:
+    return mimetypes.guess_type(key)[0] or "application/octet-stream"
+
+
+def _clean_key(key: str) -> str:
+    """キーを正規化し、保存先の外を指すパス (../ など) を拒否する"""
+    key = key.replace("\\", "/").lstrip("/")
+    parts = [p for p in key.split("/") if p not in ("", ".")]
+    if not parts or ".." in parts:
+        raise StorageError(f"invalid key: {key!r}")
+    return "/".join(parts)
+
+
+class Storage(ABC):
+    """保存先の共通部分 (URL とキーの変換)。バックエンドは save / open / exists / stat / delete / list を実装する"""
+
+    def __init__(self, url_prefix: str):
+        self.url_prefix = url_prefix.rstrip("/")
+
+    def url_for(self, key: str) -> str:
+        """DB に保存する URL (相対パス)"""
+        return f"{self.url_prefix}/{_clean_key(key)}"
+
+    def key_for(self, url: Optional[str]) -> Optional[str]:
+        """DB の URL からキーを取り出す (このストレージのファイルでなければ None)"""
+        if not url:
+            return None
+        if url.startswith("http") and f"{self.url_prefix}/" in url:
+            url = url[url.index(f"{self.url_prefix}/"):]
+        if not url.startswith(f"{self.url_prefix}/"):
+            return None
+        return url[len(self.url_prefix) + 1:]
+
+    def public_url(self, url: Optional[str]) -> Optional[str]:
+        """プレイヤーから参照できる絶対URL"""
+        if not url or url.startswith("http"):
+            return url
+        return f"{settings.HOST_URL}{url}"
+
+    # --- バックエンドごとの実装 ---
+
+    @abstractmethod
+    def save(self, key: str, src: BinaryIO, content_type: Optional[str] = None) -> str:
+        ...
+
+    @abstractmethod
+    def open(self, key: str) -> Iterator[bytes]:
+        ...
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    def stat(self, key: str) -> Optional[Tuple[int, str]]:
+        """(サイズ, 版を表す文字列)。ファイルがなければ None。内容が変わると版も変わる"""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def list(self, prefix: str) -> Iterator[Tuple[str, datetime]]:
+        """prefix 以下のファイルの (キー, 更新日時)"""
+
+
+class LocalStorage(Storage):
+    def __init__(self, root: str, url_prefix: str):
+        super().__init__(url_prefix)
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *_clean_key(key).split("/"))
+
+    def save(self, key: str, src: BinaryIO, content_type: Optional[str] = None) -> str:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 書き込み途中のファイルを配信しないよう、一時ファイルに書いてから置き換える
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return self.url_for(key)
+
+    def open(self, key: str) -> Iterator[bytes]:
+        try:
+            f = open(self._path(key), "rb")
+        except (FileNotFoundError, IsADirectoryError):
+            raise StorageError(f"not found: {key}")
+
+        def chunks():
+            with f:
+                while True:
+                    chunk = f.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+        return chunks()
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self._path(key))
+
+    def stat(self, key: str) -> Optional[Tuple[int, str]]:
+        try:
+            st = os.stat(self._path(key))
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        return st.st_size, str(st.st_mtime_ns)
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix: str) -> Iterator[Tuple[str, datetime]]:
+        directory = self._path(prefix)
+        if not os.path.isdir(directory):
+            return
+        base = _clean_key(prefix)
+        for dirpath, _, filenames in os.walk(directory):
+            rel = os.path.relpath(dirpath, directory).replace(os.sep, "/")
+            for name in filenames:
+                if name.startswith(".upload-"):
+                    continue
+                key = "/".join(p for p in (base, rel, name) if p and p != ".")
+                yield key, datetime.fromtimestamp(os.path.getmtime(os.path.join(dirpath, name)))
+
+
+class S3Storage(Storage):
+    def __init__(self, bucket: str, url_prefix: str, key_prefix: str = "", public_base_url: str = "",
+                 endpoint_url: Optional[str] = None, region: Optional[str] = None,
+                 access_key_id: Optional[str] = None, secret_access_key: Optional[str] = None):
+        super().__init__(url_prefix)
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=s3 には boto3 が必要です (pip install boto3)")
+        self.bucket = bucket
+        self.key_prefix = key_prefix.strip("/")
+        self.public_base_url = public_base_url.rstrip("/")
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or None,
+            region_name=region or None,
+            aws_access_key_id=access_key_id or None,
+            aws_secret_access_key=secret_access_key or None,
+        )
+
+    def _object_key(self, key: str) -> str:
+        key = _clean_key(key)
+        return f"{self.key_prefix}/{key}" if self.key_prefix else key
+
+    def key_for(self, url: Optional[str]) -> Optional[str]:
+        # 公開URL (CDN) に変換済みの URL も受け付ける
+        base = f"{self.public_base_url}/{self.key_prefix}/" if self.key_prefix else f"{self.public_base_url}/"
+        if url and self.public_base_url and url.startswith(base):
+            return url[len(base):]
+        return super().key_for(url)
+
+    def public_url(self, url: Optional[str]) -> Optional[str]:
+        key = self.key_for(url)
+        if key is not None and self.public_base_url:
+            return f"{self.public_base_url}/{self._object_key(key)}"
+        return super().public_url(url)
+
+    def save(self, key: str, src: BinaryIO, content_type: Optional[str] = None) -> str:
+        # upload_fileobj はサイズに応じてマルチパートで送るため、全体をメモリに載せない
+        self.client.upload_fileobj(
+            src, self.bucket, self._object_key(key),
+            ExtraArgs={"ContentType": content_type or guess_content_type(key)},
+        )
+        return self.url_for(key)
+
+    def open(self, key: str) -> Iterator[bytes]:
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except self.client.exceptions.NoSuchKey:
+            raise StorageError(f"not found: {key}")
+        return obj["Body"].iter_chunks(CHUNK_SIZE)
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except Exception:
+            return False
+
+    def stat(self, key: str) -> Optional[Tuple[int, str]]:
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception:
+            return None
+        return head["ContentLength"], head["ETag"]
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+    def list(self, prefix: str) -> Iterator[Tuple[str, datetime]]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        strip = len(self.key_prefix) + 1 if self.key_prefix else 0
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._object_key(prefix)):
+            for obj in page.get("Contents", []):
+                yield obj["Key"][strip:], obj["LastModified"].astimezone().replace(tzinfo=None)
+
+
+def create_storage() -> Storage:
+    if settings.STORAGE_BACKEND == "s3":
+        return S3Storage(
+            bucket=settings.S3_BUCKET,
+            url_prefix=settings.MEDIA_URL_PREFIX or "/media",
+            key_prefix=settings.S3_KEY_PREFIX,
+            public_base_url=settings.S3_PUBLIC_BASE_URL,
+            endpoint_url=settings.S3_ENDPOINT_URL,
+            region=settings.S3_REGION,
+            access_key_id=settings.S3_ACCESS_KEY_ID,
+            secret_access_key=settings.S3_SECRET_ACCESS_KEY,
+        )
+    # static/ 以外に保存する場合は /static のマウントでは配信できないため /media で中継する
+    default_prefix = "/static" if os.path.normpath(settings.MEDIA_ROOT) == "static" else "/media"
+    return LocalStorage(settings.MEDIA_ROOT, settings.MEDIA_URL_PREFIX or default_prefix)
+
+# シングルトンインスタンスとして公開
+storage = create_storage()
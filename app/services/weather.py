@@ -1,19 +1,61 @@
+import logging
+import time
+from typing import Dict, Tuple
+
 import httpx
 
-def get_weather_data(latitude: float, longitude: float) -> str:
+from app.core.config import settings
+from app.services.metrics import UPSTREAM_DURATION, WEATHER_CACHE_TOTAL
+
+logger = logging.getLogger(__name__)
+
+# 接続を使い回すための共有クライアント
+_client = httpx.AsyncClient(timeout=5.0)
+
+# 座標 -> (取得時刻 (time.monotonic), 表示文字列)
+# 全校の設定取得のたびに外部APIを呼ばないよう、一定時間は同じ結果を返す
+_cache: Dict[Tuple[float, float], Tuple[float, str]] = {}
+# 座標 -> 取得に失敗した時刻 (time.monotonic)
+# 外部APIが落ちている間に設定取得のたびにタイムアウトまで待たないよう、一定時間は再試行しない
+_failures: Dict[Tuple[float, float], float] = {}
+
+UNAVAILABLE_TEXT = "天気情報取得不可"
+
+
+def _fallback(key: Tuple[float, float]) -> str:
+    """取得できないときの表示 (前回取得できた結果があれば、期限切れでもそれを使う)"""
+    cached = _cache.get(key)
+    return cached[1] if cached else UNAVAILABLE_TEXT
+
+
+async def get_weather_data(latitude: float, longitude: float, refresh: bool = False) -> str:
     """
     指定座標の現在の天気を取得して文字列で返す
+    (refresh=True の場合はキャッシュを使わずに取得し直す。定期ジョブでの先読み用)
     """
+    key = (round(latitude, 3), round(longitude, 3))
+    cached = _cache.get(key)
+    if cached and not refresh and time.monotonic() - cached[0] < settings.WEATHER_CACHE_TTL_SECONDS:
+        WEATHER_CACHE_TOTAL.inc(result="hit")
+        return cached[1]
+    failed_at = _failures.get(key)
+    if failed_at is not None and not refresh and time.monotonic() - failed_at < settings.WEATHER_ERROR_TTL_SECONDS:
+        WEATHER_CACHE_TOTAL.inc(result="error")
+        return _fallback(key)
+    WEATHER_CACHE_TOTAL.inc(result="miss")
+
+    start = time.perf_counter()
     try:
-        url = "https://api.open-meteo.com/v1/forecast"
+        url = settings.WEATHER_API_URL
         params = {
             "latitude": latitude,
             "longitude": longitude,
             "current_weather": "true",
             "timezone": "Asia/Tokyo"
         }
-        # 同期的に取得
-        resp = httpx.get(url, params=params, timeout=5.0)
+        # 非同期で取得 (待機中もイベントループをブロックしない)
+        resp = await _client.get(url, params=params)
+        resp.raise_for_status()
         data = resp.json()
         
         current = data.get("current_weather", {})
@@ -30,7 +72,15 @@ def get_weather_data(latitude: float, longitude: float) -> str:
         }
         status = weather_map.get(weather_code, "不明")
         
-        return f"【現在の天気】\n{status}\n気温: {temp}℃"
+        text = f"【現在の天気】\n{status}\n気温: {temp}℃"
     except Exception as e:
-        print(f"Weather API Error: {e}")
-        return "天気情報取得不可"
\ No newline at end of file
+        UPSTREAM_DURATION.observe(time.perf_counter() - start, upstream="open-meteo", outcome="error")
+        logger.warning("Weather API Error: %s", e)
+        # 失敗も WEATHER_ERROR_TTL_SECONDS の間は覚えておき、その間は前回の結果を返す
+        _failures[key] = time.monotonic()
+        return _fallback(key)
+
+    UPSTREAM_DURATION.observe(time.perf_counter() - start, upstream="open-meteo", outcome="ok")
+    _cache[key] = (time.monotonic(), text)
+    _failures.pop(key, None)
+    return text
@@ -1,26 +1,187 @@
-from typing import List
+import asyncio
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional
+
 from fastapi import WebSocket
 
+from app.core.config import settings
+from app.services.admission import CLOSE_SERVICE_RESTART, reconnect_message
+from app.services.metrics import Gauge, WS_MESSAGES_TOTAL, WS_SEND_DURATION, registry
+from app.services.revisions import revisions
+
+# サーバー → 端末の死活確認と、その応答
+PING_MESSAGE = "PING"
+PONG_MESSAGE = "PONG"
+# 表示設定の再取得要求 (リビジョンが進んだ学校に送る。ロングポーリング中のプレイヤーにはリビジョン経由で通知される)
+RELOAD_MESSAGE = "RELOAD"
+
+
+@dataclass(eq=False)
+class Device:
+    """接続中の端末1台分"""
+    websocket: WebSocket
+    school_id: str
+    device_id: str
+    metadata: Dict[str, str] = field(default_factory=dict)
+    connected_at: datetime = field(default_factory=datetime.now)
+    # 最後に端末からメッセージ (PONG など) を受け取った時刻 (time.monotonic)
+    last_seen: float = field(default_factory=time.monotonic)
+
+    def to_dict(self) -> dict:
+        return {
+            "device_id": self.device_id,
+            "metadata": self.metadata,
+            "connected_at": self.connected_at.isoformat(),
+            "idle_seconds": int(time.monotonic() - self.last_seen),
+        }
+
+
 class ConnectionManager:
+    """
+    WebSocket 接続を学校ごと・端末ごとに管理する。
+    接続状況は稼働監視 (presence) の情報源にもなる。プロセス内メモリのみで管理するため、
+    複数ワーカー構成ではワーカーごとに自分の接続だけを把握している点に注意
+    (ワーカー間では app/services/presence.py が DB 経由で共有する)。
+    """
+
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.schools: Dict[str, Dict[str, Device]] = {}
 
-    async def connect(self, websocket: WebSocket):
+    @property
+    def active_connections(self) -> List[WebSocket]:
+        return [d.websocket for devices in self.schools.values() for d in devices.values()]
+
+    async def connect(self, websocket: WebSocket, school_id: str = "",
+                      device_id: Optional[str] = None, metadata: Optional[Dict[str, str]] = None) -> Device:
         await websocket.accept()
-        self.active_connections.append(websocket)
+        device = Device(
+            websocket=websocket,
+            school_id=school_id,
+            device_id=device_id or uuid.uuid4().hex,
+            metadata=metadata or {},
+        )
+        devices = self.schools.setdefault(school_id, {})
+        # 同じ端末の再接続は古い接続を置き換える
+        old = devices.get(device.device_id)
+        devices[device.device_id] = device
+        if old:
+            await self._close(old)
+        return device
+
+    def disconnect(self, device: Device):
+        devices = self.schools.get(device.school_id)
+        if devices and devices.get(device.device_id) is device:
+            del devices[device.device_id]
+            if not devices:
+                del self.schools[device.school_id]
+
+    def mark_seen(self, device: Device):
+        device.last_seen = time.monotonic()
+
+    async def _close(self, device: Device, code: int = 1000):
+        try:
+            await device.websocket.close(code=code)
+        except Exception:
+            pass
 
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+    async def _send(self, devices: List[Device], message: str, target: str):
+        # メトリクスのラベルは RELOAD / PING などの文字列メッセージはそのまま、JSON は "json" にまとめる
+        kind = "json" if message.startswith("{") else message
+        start = time.perf_counter()
+        sent = failed = 0
+        for device in devices:
+            try:
+                await device.websocket.send_text(message)
+                sent += 1
+            except Exception:
+                # 接続切れなどのエラーは無視して次へ
+                failed += 1
+        WS_SEND_DURATION.observe(time.perf_counter() - start, target=target)
+        if sent:
+            WS_MESSAGES_TOTAL.inc(sent, kind=kind, outcome="sent")
+        if failed:
+            WS_MESSAGES_TOTAL.inc(failed, kind=kind, outcome="error")
 
     async def broadcast(self, message: str):
         """接続している全ラズパイにメッセージを送る"""
-        for connection in self.active_connections:
+        if message == RELOAD_MESSAGE:
+            # リビジョンを進めると reload_schools() 経由で全ワーカーの端末に RELOAD が送られる
+            await revisions.bump_all()
+            return
+        await self._send([d for devices in self.schools.values() for d in devices.values()], message, "broadcast")
+
+    async def send_to_school(self, school_id: str, message: str):
+        """指定した学校の端末にだけメッセージを送る"""
+        if message == RELOAD_MESSAGE:
+            await revisions.bump(school_id)
+            return
+        await self._send(list(self.schools.get(school_id, {}).values()), message, "school")
+
+    async def reload_schools(self, school_ids: List[str]):
+        """
+        リビジョンが進んだ学校の、このワーカーに接続している端末へ RELOAD を送る
+        (どのワーカーで変更されても、各ワーカーのリビジョンの取り込み時に呼ばれる)
+        """
+        devices = [d for school_id in school_ids for d in self.schools.get(school_id, {}).values()]
+        if devices:
+            await self._send(devices, RELOAD_MESSAGE, "school")
+
+    # --- presence ---
+
+    def is_online(self, school_id: str) -> bool:
+        return bool(self.schools.get(school_id))
+
+    def online_school_ids(self) -> List[str]:
+        return [school_id for school_id, devices in self.schools.items() if devices]
+
+    def device_count(self, school_id: str) -> int:
+        return len(self.schools.get(school_id, {}))
+
+    def devices(self, school_id: str) -> List[dict]:
+        return [d.to_dict() for d in self.schools.get(school_id, {}).values()]
+
+    async def drain(self):
+        """
+        終了時に全端末へ再接続の待ち時間 (端末ごとにばらばら) を送ってから切断する。
+        再起動後に全端末が同時に再接続してこないようにするため。
+        """
+        async def drain_one(device: Device):
             try:
-                await connection.send_text(message)
+                await asyncio.wait_for(device.websocket.send_text(reconnect_message()), 2)
             except Exception:
-                # 接続切れなどのエラーは無視して次へ
                 pass
+            self.disconnect(device)
+            await self._close(device, CLOSE_SERVICE_RESTART)
+
+        devices = [d for devices in self.schools.values() for d in devices.values()]
+        await asyncio.gather(*(drain_one(d) for d in devices))
+
+    # --- keepalive ---
+
+    async def ping_all(self):
+        """全端末に PING を送り、応答が途絶えた端末を切断する"""
+        deadline = time.monotonic() - settings.WS_PING_TIMEOUT_SECONDS
+        for devices in list(self.schools.values()):
+            for device in list(devices.values()):
+                if device.last_seen < deadline:
+                    self.disconnect(device)
+                    await self._close(device)
+        await self.broadcast(PING_MESSAGE)
+
+    async def run_keepalive(self):
+        """PING の定期送信 (アプリ起動時にバックグラウンドタスクとして開始する)"""
+        while True:
+            await asyncio.sleep(settings.WS_PING_INTERVAL_SECONDS)
+            await self.ping_all()
 
 # シングルトンインスタンスとして公開
-manager = ConnectionManager()
\ No newline at end of file
+manager = ConnectionManager()
+revisions.add_listener(manager.reload_schools)
+
+registry.register(Gauge(
+    "signage_ws_connections", "Connected devices by school", ("school_id",),
+    collect=lambda: {(school_id,): len(devices) for school_id, devices in manager.schools.items()},
+))
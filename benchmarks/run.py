@@ -0,0 +1,322 @@
+"""
+プレイヤー端末群を模擬する負荷試験・ベンチマーク
+
+一時ディレクトリに DB を作成してデータを投入し、天気APIのスタブと uvicorn でサーバーを起動して
+以下のシナリオを順に実行します。外部ネットワークは使いません。
+
+    config   : /v1/display/config の並列ポーリング (スループット, p50/p99)
+    connect  : /ws/{school_id} の接続確立 (p50/p99。受け入れ制御 (close 1013) で断られた数は rejected)
+    reload   : 広告の承認 → RELOAD の一斉配信 → 全端末の設定再取得
+               (配信の到達時間 = fan-out と、再取得の p50/p99・完了までの時間)
+
+結果は JSON で標準出力と --output (デフォルト benchmarks/results/<日時>-<commit>.json) に書き出します。
+データ・リクエスト順は乱数シード固定のため、同じ引数ならコミット間で比較できます。
+
+    python benchmarks/run.py --schools 200 --devices 400 --concurrency 50 --requests 2000
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List
+
+import httpx
+import websockets
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+
+from benchmarks import weather_stub  # noqa: E402
+from benchmarks.seed import school_ids  # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def _summary(latencies: List[float], elapsed: float = None, errors: int = 0) -> Dict[str, float]:
+    """秒単位の計測値をミリ秒の要約にする"""
+    result = {
+        "count": len(latencies),
+        "errors": errors,
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies, default=0) * 1000, 2),
+    }
+    if elapsed is not None:
+        result["elapsed_s"] = round(elapsed, 3)
+        result["throughput_rps"] = round(len(latencies) / elapsed, 1) if elapsed else 0.0
+    return result
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+# --- シナリオ ---
+
+async def bench_config(client: httpx.AsyncClient, ids: List[str], total: int, concurrency: int,
+                       rng: random.Random) -> dict:
+    targets = [rng.choice(ids) for _ in range(total)]
+    latencies: List[float] = []
+    errors = 0
+
+    async def worker(queue: List[str]):
+        nonlocal errors
+        while queue:
+            school_id = queue.pop()
+            start = time.perf_counter()
+            try:
+                resp = await client.get("/v1/display/config", params={"school_id": school_id})
+                if resp.status_code != 200:
+                    errors += 1
+                    continue
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(targets) for _ in range(concurrency)))
+    return _summary(latencies, time.perf_counter() - start, errors)
+
+
+class Rejected(Exception):
+    """サーバーの受け入れ制御により接続を断られた (close 1013)"""
+
+
+class Player:
+    """WebSocket で接続し、RELOAD を受けたら設定を再取得する端末1台"""
+
+    def __init__(self, ws_url: str, school_id: str, device_id: str):
+        self.url = f"{ws_url}/ws/{school_id}?device_id={device_id}&ua=benchmark"
+        self.school_id = school_id
+        self.ws = None
+        self.reload = asyncio.Event()
+        self.reload_at = 0.0
+
+    async def connect(self) -> float:
+        """HELLO を受け取るまでを接続とみなす (受け入れ制御で 1013 で切断された場合は Rejected)"""
+        start = time.perf_counter()
+        ws = await websockets.connect(self.url, open_timeout=30, max_queue=None)
+        try:
+            hello = json.loads(await asyncio.wait_for(ws.recv(), 30))
+        except websockets.ConnectionClosed as e:
+            raise Rejected(e.rcvd.reason if e.rcvd else "") from e
+        if hello.get("type") != "HELLO":
+            await ws.close()
+            raise RuntimeError(f"unexpected first message: {hello}")
+        self.ws = ws
+        return time.perf_counter() - start
+
+    async def listen(self):
+        try:
+            async for message in self.ws:
+                if message == "PING":
+                    await self.ws.send("PONG")
+                elif message == "RELOAD" and not self.reload.is_set():
+                    self.reload_at = time.perf_counter()
+                    self.reload.set()
+        except websockets.ConnectionClosed:
+            pass
+
+
+async def bench_connect(players: List[Player], concurrency: int) -> dict:
+    latencies: List[float] = []
+    errors = rejected = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def connect(player: Player):
+        nonlocal errors, rejected
+        async with semaphore:
+            try:
+                latencies.append(await player.connect())
+            except Rejected:
+                rejected += 1
+                errors += 1
+            except Exception:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(connect(p) for p in players))
+    summary = _summary(latencies, time.perf_counter() - start, errors)
+    summary["rejected"] = rejected
+    return summary
+
+
+async def bench_reload(client: httpx.AsyncClient, players: List[Player], timeout: float) -> dict:
+    """RELOAD の一斉配信と、それに続く全端末の設定再取得 (refetch storm)"""
+    connected = [p for p in players if p.ws is not None]
+    listeners = [asyncio.create_task(p.listen()) for p in connected]
+    # 端末はそれぞれ独立して再取得するため、接続数を制限しない別のクライアントを使う
+    storm_client = httpx.AsyncClient(base_url=client.base_url, timeout=timeout,
+                                     limits=httpx.Limits(max_connections=None))
+
+    login = await client.post("/login", data={"school_id": "", "username": "admin", "password": "admin123"})
+    if login.status_code >= 400:
+        raise RuntimeError(f"admin login failed: {login.status_code}")
+
+    refetch_latencies: List[float] = []
+    errors = 0
+
+    async def refetch(player: Player):
+        nonlocal errors
+        await player.reload.wait()
+        start = time.perf_counter()
+        try:
+            resp = await storm_client.get("/v1/display/config", params={"school_id": player.school_id})
+            if resp.status_code != 200:
+                errors += 1
+                return
+        except httpx.HTTPError:
+            errors += 1
+            return
+        refetch_latencies.append(time.perf_counter() - start)
+
+    refetches = [asyncio.create_task(refetch(p)) for p in connected]
+    trigger_at = time.perf_counter()
+    # 広告の承認 = 全端末への RELOAD (admin_ads.update_ad_status)
+    await client.post("/admin/ads/update", data={"ad_id": "1", "action": "approve"})
+    done, pending = await asyncio.wait(refetches, timeout=timeout)
+    storm_elapsed = time.perf_counter() - trigger_at
+    for task in pending:
+        task.cancel()
+
+    await storm_client.aclose()
+    for player in connected:
+        await player.ws.close()
+    await asyncio.gather(*listeners, return_exceptions=True)
+
+    fan_out = [p.reload_at - trigger_at for p in connected if p.reload.is_set()]
+    return {
+        "devices": len(connected),
+        "reloaded": len(fan_out),
+        "fan_out": _summary(fan_out),
+        "refetch": _summary(refetch_latencies, storm_elapsed, errors + len(pending)),
+    }
+
+
+# --- サーバーの起動 ---
+
+async def _wait_ready(base_url: str, process: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError("server exited during startup")
+            try:
+                await client.get("/")
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+async def main(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="signage-bench-")
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "ASYNC_DATABASE_URL": "",
+        "DB_PROFILE": args.db_profile,
+        "PYTHONPATH": ROOT,
+        # 受け入れ制御で接続を断られると接続・RELOAD の計測にならないため、全端末を一度に受け入れさせる
+        "WS_ACCEPT_BURST": str(args.ws_accept_burst or args.devices),
+        "WS_ACCEPT_RATE": str(args.ws_accept_rate or args.devices),
+    })
+
+    subprocess.run(
+        [sys.executable, os.path.join(ROOT, "benchmarks", "seed.py"), "--schools", str(args.schools),
+         "--seed", str(args.seed)],
+        env=env, cwd=ROOT, check=True, stdout=subprocess.DEVNULL,
+    )
+
+    weather_port = _free_port()
+    stub = await weather_stub.serve(weather_port)
+    env["WEATHER_API_URL"] = f"http://127.0.0.1:{weather_port}/v1/forecast"
+
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        env=env, cwd=ROOT,
+    )
+    try:
+        await _wait_ready(base_url, server)
+        rng = random.Random(args.seed)
+        ids = school_ids(args.schools)
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+            # 初回アクセス (テンプレート・接続プールの準備) を計測から除く
+            await bench_config(client, ids, min(args.concurrency, len(ids)), args.concurrency, rng)
+            results = {"config": await bench_config(client, ids, args.requests, args.concurrency, rng)}
+
+            players = [
+                Player(f"ws://127.0.0.1:{port}", ids[i % len(ids)], f"bench-device-{i}")
+                for i in range(args.devices)
+            ]
+            results["connect"] = await bench_connect(players, args.concurrency)
+            results["reload"] = await bench_reload(client, players, args.reload_timeout)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        stub.server.should_exit = True
+        await stub
+
+    return {
+        "commit": _git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": vars(args),
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="プレイヤー端末群を模擬したベンチマーク")
+    parser.add_argument("--schools", type=int, default=200)
+    parser.add_argument("--devices", type=int, default=400, help="WebSocket で接続する端末数")
+    parser.add_argument("--requests", type=int, default=2000, help="config シナリオのリクエスト数")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--reload-timeout", type=float, default=60.0)
+    parser.add_argument("--db-profile", default="production", help="サーバーの DB_PROFILE")
+    parser.add_argument("--ws-accept-burst", type=int, default=0,
+                        help="サーバーの WS_ACCEPT_BURST (未指定時は --devices。受け入れ制御を計測する場合に小さくする)")
+    parser.add_argument("--ws-accept-rate", type=float, default=0, help="サーバーの WS_ACCEPT_RATE (未指定時は --devices)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="結果の JSON の保存先")
+    args = parser.parse_args()
+
+    report = asyncio.run(main(args))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        f.write(text + "\n")
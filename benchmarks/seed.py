@@ -0,0 +1,82 @@
+"""
+ベンチマーク用のデータ投入
+
+scripts/init_db.py で初期データを作成したうえで、学校・スロット・コンテンツ・広告を
+指定件数だけ追加します。乱数のシードを固定しているため、同じ引数なら毎回同じデータになります。
+
+    DATABASE_URL=sqlite:///./bench.db python benchmarks/seed.py --schools 200
+"""
+import argparse
+import os
+import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.database import SessionLocal
+from app.models.models import Ad, AdStatus, Content, ContentType, School, Slot, User
+from scripts.init_db import init_db
+
+# 学校ID の接頭辞 (run.py はこの ID の学校に接続する)
+SCHOOL_ID_PREFIX = "bench-"
+SLOT_TYPES = (ContentType.NOTICE, ContentType.AD, ContentType.WEATHER, ContentType.COUNTDOWN)
+
+
+def school_ids(count: int):
+    return [f"{SCHOOL_ID_PREFIX}{i:05d}" for i in range(count)]
+
+
+def seed(schools: int, contents_per_slot: int = 3, ads: int = 20, random_seed: int = 42) -> None:
+    init_db()
+    rng = random.Random(random_seed)
+    db = SessionLocal()
+    try:
+        if db.query(School).filter(School.id.like(f"{SCHOOL_ID_PREFIX}%")).first():
+            print("Benchmark data already exists. No data added.")
+            return
+
+        db.bulk_save_objects([
+            School(id=school_id, name=f"ベンチマーク校{i}", layout_type=rng.choice((1, 2, 3, 4)),
+                   district=f"district-{i % 10}")
+            for i, school_id in enumerate(school_ids(schools))
+        ])
+        slots = [
+            Slot(school_id=school_id, position=position, content_type=content_type)
+            for school_id in school_ids(schools)
+            for position, content_type in enumerate(SLOT_TYPES)
+        ]
+        db.add_all(slots)
+        db.flush()
+
+        contents = []
+        for slot in slots:
+            if slot.content_type != ContentType.NOTICE:
+                continue
+            for position in range(contents_per_slot):
+                contents.append(Content(
+                    slot_id=slot.id, position=position, duration=10,
+                    body=f"お知らせ {slot.school_id} #{position}\n" + "本文" * rng.randint(5, 50),
+                    style_config={"bg_color": "#ffffff", "text_color": "#000000"},
+                ))
+        db.bulk_save_objects(contents)
+
+        owner = db.query(User).filter(User.username == "teacher1").first()
+        db.bulk_save_objects([
+            Ad(owner_id=owner.id if owner else None, title=f"ベンチマーク広告{i}",
+               media_url="/static/sample.jpg", target_area="Gifu", status=AdStatus.APPROVED)
+            for i in range(ads)
+        ])
+        db.commit()
+        print(f"Seeded {schools} schools, {len(slots)} slots, {len(contents)} contents, {ads} ads")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ベンチマーク用のデータを投入する")
+    parser.add_argument("--schools", type=int, default=200)
+    parser.add_argument("--contents-per-slot", type=int, default=3)
+    parser.add_argument("--ads", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    seed(args.schools, args.contents_per_slot, args.ads, args.seed)
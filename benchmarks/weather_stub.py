@@ -0,0 +1,37 @@
+"""
+天気API (Open-Meteo) のローカルスタブ
+
+ベンチマークを外部ネットワークなしで実行し、外部APIの応答時間に結果が左右されないようにする。
+WEATHER_API_URL=http://127.0.0.1:<port>/v1/forecast としてサーバーに渡す。
+"""
+import asyncio
+import json
+
+RESPONSE = json.dumps({"current_weather": {"temperature": 21.5, "weathercode": 1}}).encode()
+
+
+async def app(scope, receive, send):
+    if scope["type"] != "http":
+        return
+    if scope.get("path") != "/v1/forecast":
+        await send({"type": "http.response.start", "status": 404, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+        return
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(RESPONSE)).encode())],
+    })
+    await send({"type": "http.response.body", "body": RESPONSE})
+
+
+async def serve(port: int) -> asyncio.Task:
+    """スタブをバックグラウンドで起動し、そのタスクを返す"""
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    task.server = server
+    return task
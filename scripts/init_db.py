@@ -4,17 +4,15 @@ import os
 # プロジェクトルートへのパスを通す (appモジュールをインポートできるようにするため)
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from app.core.database import engine, SessionLocal, Base
+from app.core.database import engine, SessionLocal
+from app.core.migrations import run_migrations
 from app.models.models import School, Slot, Content, ContentType, User, UserRole, Ad, AdStatus
-from passlib.context import CryptContext
-
-# パスワードハッシュ化の設定
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from app.services.auth import pwd_context
 
 def init_db():
-    # 1. テーブル作成（既存のものがあっても無視され、ないものが作られる）
-    print("Creating tables...")
-    Base.metadata.create_all(bind=engine)
+    # 1. テーブル作成・スキーマ更新（未適用のマイグレーションのみ実行される）
+    print("Migrating schema...")
+    run_migrations(engine)
 
     db = SessionLocal()
 
@@ -0,0 +1,24 @@
+import sys
+import os
+
+# プロジェクトルートへのパスを通す (appモジュールをインポートできるようにするため)
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.database import engine
+from app.core.migrations import MIGRATIONS, applied_versions, run_migrations
+
+def show_status():
+    done = applied_versions(engine)
+    for version, description, _ in MIGRATIONS:
+        mark = "x" if version in done else " "
+        print(f"[{mark}] {version:04d} {description}")
+
+if __name__ == "__main__":
+    if "--status" in sys.argv:
+        show_status()
+    else:
+        applied = run_migrations(engine)
+        if applied:
+            print(f"Applied migrations: {', '.join(f'{v:04d}' for v in applied)}")
+        else:
+            print("Database is up to date.")
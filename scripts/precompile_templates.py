@@ -0,0 +1,14 @@
+import sys
+import os
+
+# プロジェクトルートへのパスを通す (appモジュールをインポートできるようにするため)
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.config import settings
+from app.core.templates import precompile_templates
+
+# デプロイ時 (ビルド時) に実行すると、バイトコードキャッシュ (TEMPLATE_CACHE_DIR) が作成され、
+# 各ワーカーは起動時にテンプレートを再コンパイルせずに済む
+if __name__ == "__main__":
+    count = precompile_templates()
+    print(f"Compiled {count} templates into {settings.TEMPLATE_CACHE_DIR or '(memory only)'}.")
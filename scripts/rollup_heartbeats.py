@@ -0,0 +1,18 @@
+import sys
+import os
+
+# プロジェクトルートへのパスを通す (appモジュールをインポートできるようにするため)
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.database import SessionLocal
+from app.services.heartbeat import rollup_heartbeats
+
+# 通常はアプリ内の定期ジョブ (app.services.maintenance) が実行する。
+# SCHEDULER_ENABLED=false で運用する場合は cron などで1日1回以上実行してください
+if __name__ == "__main__":
+    db = SessionLocal()
+    try:
+        days = rollup_heartbeats(db)
+        print(f"Rolled up {days} day(s) of heartbeat history.")
+    finally:
+        db.close()